@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import asyncio
+import logging
+import time
+from configparser import ConfigParser
+from typing import Dict, List, Optional, Tuple
+
+from asynctransaction.data.access.task import DEDUP_WINDOW
+from asynctransaction.metrics import ARCHIVED
+
+log = logging.getLogger('asynctransaction.data.access.archiver')
+
+# finished: spread or processed, all steps processed and nothing changed since the time of both parameters
+_FINISHED = """TASKS.STATE IN (3, 4) AND TASKS.UPDATED_ON < ?
+               AND NOT EXISTS (SELECT 1 FROM PROCESSING_STEPS PS
+                                WHERE PS.TASK_ID = TASKS.ID AND (PS.STATE <> 4 OR PS.UPDATED_ON >= ?))"""
+
+
+class Archiver(object):
+    """
+    Removes finished tasks and their processing steps from the data base, so the scans by state and the duplicate
+    check don't slow down with the history. A task is finished when it is spread or processed, all its steps are
+    processed and neither it nor one of its steps was updated within the retention. Steps on error or given up
+    stay, so do their tasks.
+
+    With an archive file the rows are copied there before they are deleted, else they are just deleted. A pass
+    looks for finished tasks in ranges of scan_rows ids and moves them chunk by chunk, each chunk is one short
+    transaction on the writer thread, with a pause in between, so the ingest never waits for more than one chunk.
+
+    A POST task which was archived is no longer found by the duplicate check, a repeated POST of it is stored
+    again, the same holds for its idempotency key. The retention can't be shorter than the dedup window of PUT.
+    """
+
+    def __init__(self, con: sqlite3.Connection, retention: float = 7 * 24 * 3600.0, archive_file: str = None,
+                 chunk: int = 200, scan_rows: int = 5000, pause: float = 0.01, interval: float = 300.0):
+        """
+        Constructor of Archiver
+        :param con: Connection of the data base
+        :param retention: Optional: Seconds a finished task is kept. Default is 7 days [float]
+        :param archive_file: Optional: Data base file the rows are copied to. Default None deletes them [str]
+        :param chunk: Optional: Tasks moved with one transaction, at most 500. Default is 200 [int]
+        :param scan_rows: Optional: Range of task ids looked through with one read. Default is 5000 [int]
+        :param pause: Optional: Seconds between two chunks. Default is 0.01 [float]
+        :param interval: Optional: Seconds between two passes of run(). Default is 300.0 [float]
+        """
+        if retention < DEDUP_WINDOW.total_seconds():
+            raise ValueError(f"retention {retention}s is shorter than the dedup window {DEDUP_WINDOW}")
+        if not 0 < chunk <= 500:
+            raise ValueError(f"chunk {chunk} is not between 1 and 500")
+        self.executor = con.executor
+        self.retention = retention
+        self.archive_file = archive_file
+        self.chunk = chunk
+        self.scan_rows = scan_rows
+        self.pause = pause
+        self.interval = interval
+        self._attached = False
+        self.passes = 0
+        self.tasks = 0
+        self.steps = 0
+        self.max_chunk_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config: ConfigParser, con: sqlite3.Connection) -> 'Archiver':
+        """
+        Archiver of the [ARCHIVE] section of the config file
+        """
+        return cls(con, retention=config.getfloat('ARCHIVE', 'retention_hours', fallback=7 * 24.0) * 3600,
+                   archive_file=config.get('ARCHIVE', 'archive_file', fallback=None),
+                   chunk=config.getint('ARCHIVE', 'chunk', fallback=200),
+                   scan_rows=config.getint('ARCHIVE', 'scan_rows', fallback=5000),
+                   pause=config.getint('ARCHIVE', 'pause_ms', fallback=10) / 1000,
+                   interval=config.getfloat('ARCHIVE', 'interval', fallback=300.0))
+
+    def stats(self) -> Dict:
+        return {'passes': self.passes, 'tasks': self.tasks, 'steps': self.steps,
+                'max_chunk_ms': round(self.max_chunk_seconds * 1000, 3)}
+
+    async def run(self):
+        """
+        Background loop: a pass every interval seconds until it is cancelled
+        """
+        while True:
+            try:
+                await self.run_once()
+            except sqlite3.Error as error:
+                log.error(f"archive pass failed: {error}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Tuple[int, int]:
+        """
+        One pass over all tasks
+        :return: number of archived (or deleted) tasks and processing steps
+        """
+        if self.archive_file is not None and self._attached is False:
+            await self.executor.write(self._attach, self.archive_file)
+            self._attached = True
+        before = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - self.retention))
+        low, high = await self.executor.read(self._id_range)
+        tasks = steps = 0
+        while low is not None and low <= high:
+            ids = await self.executor.read(self._finished_ids, low, low + self.scan_rows - 1, before)
+            low += self.scan_rows
+            for start in range(0, len(ids), self.chunk):
+                started = time.perf_counter()
+                moved_tasks, moved_steps = await self.executor.write(
+                    self._move, ids[start:start + self.chunk], before, self.archive_file is not None)
+                self.max_chunk_seconds = max(self.max_chunk_seconds, time.perf_counter() - started)
+                tasks += moved_tasks
+                steps += moved_steps
+                await asyncio.sleep(self.pause)  # the writer is free for the ingest in between
+        self.passes += 1
+        self.tasks += tasks
+        self.steps += steps
+        ARCHIVED.inc('TASKS', amount=tasks)
+        ARCHIVED.inc('PROCESSING_STEPS', amount=steps)
+        if tasks > 0:
+            log.info(f"{'archived' if self.archive_file else 'deleted'} {tasks} tasks and {steps} processing steps")
+        return tasks, steps
+
+    async def close(self):
+        if self._attached:
+            await self.executor.write(self._detach)
+            self._attached = False
+
+    @staticmethod
+    def _id_range(con: sqlite3.Connection) -> Tuple[Optional[int], Optional[int]]:
+        row = con.execute('SELECT MIN(ID) AS LOW, MAX(ID) AS HIGH FROM TASKS').fetchone()
+        return row['LOW'], row['HIGH']
+
+    @staticmethod
+    def _finished_ids(con: sqlite3.Connection, low: int, high: int, before: str) -> List[int]:
+        sql = f"SELECT ID FROM TASKS WHERE ID BETWEEN ? AND ? AND {_FINISHED} ORDER BY ID"
+        return [row['ID'] for row in con.execute(sql, [low, high, before, before])]
+
+    @staticmethod
+    def _move(con: sqlite3.Connection, ids: List[int], before: str, archive: bool) -> Tuple[int, int]:
+        # runs on the writer thread, one transaction; the tasks are checked again, a step may have changed since
+        marks = ','.join('?' * len(ids))
+        with con:
+            ids = [row['ID'] for row in con.execute(f"SELECT ID FROM TASKS WHERE ID IN ({marks}) AND {_FINISHED}",
+                                                    ids + [before, before])]
+            if len(ids) == 0:
+                return 0, 0
+            marks = ','.join('?' * len(ids))
+            if archive:
+                for table, key in (('TASKS', 'ID'), ('PROCESSING_STEPS', 'TASK_ID')):
+                    columns = ', '.join(_columns(con, 'main', table))
+                    con.execute(f"INSERT OR REPLACE INTO ARCHIVE.{table} ({columns}) "
+                                f"SELECT {columns} FROM main.{table} WHERE {key} IN ({marks})", ids)
+            steps = con.execute(f"DELETE FROM PROCESSING_STEPS WHERE TASK_ID IN ({marks})", ids).rowcount
+            tasks = con.execute(f"DELETE FROM TASKS WHERE ID IN ({marks})", ids).rowcount
+        return tasks, steps
+
+    @staticmethod
+    def _attach(con: sqlite3.Connection, archive_file: str):
+        # the archive gets the columns of the tables, a column added to the data base later is added there as well
+        con.execute('ATTACH DATABASE ? AS ARCHIVE', [os.path.abspath(archive_file)])
+        with con:
+            for table in ('TASKS', 'PROCESSING_STEPS'):
+                existing = _columns(con, 'ARCHIVE', table)
+                if len(existing) == 0:
+                    con.execute(f"CREATE TABLE ARCHIVE.{table} AS SELECT * FROM main.{table} WHERE 0")
+                    con.execute(f"CREATE UNIQUE INDEX ARCHIVE.{table}_ID ON {table}(ID)")
+                    continue
+                for column in _columns(con, 'main', table):
+                    if column not in existing:
+                        con.execute(f"ALTER TABLE ARCHIVE.{table} ADD COLUMN {column}")
+
+    @staticmethod
+    def _detach(con: sqlite3.Connection):
+        con.execute('DETACH DATABASE ARCHIVE')
+
+
+def _columns(con: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row['NAME'] for row in con.execute(f"PRAGMA {schema}.table_info({table})")]
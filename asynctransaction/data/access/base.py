@@ -1,11 +1,28 @@
 import sqlite3
 import asyncio
 import logging
+import re
+from functools import partial
+from typing import AsyncIterator, Optional, Type
 
 from asynctransaction.data.entity import *
+from asynctransaction.data.access.executor import DbExecutor
+from asynctransaction.data.access.registry import MetadataRegistry
 
 log = logging.getLogger('asynctransaction.data.access.base')
 
+# pragmas of the performance profiles, durable is the plain sqlite setup with rollback journal and full sync
+PROFILES: Dict[str, Dict[str, str]] = {
+    'durable': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'busy_timeout': '5000'},
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': '268435456', 'cache_size': '-16000',
+             'temp_store': 'MEMORY', 'busy_timeout': '5000'},
+}
+PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout')
+
+# entity class per table name
+ENTITIES: Dict[str, Type[EntityBase]] = {x.name: x for x in (ProcessingStep, Task, Partner, Event, Subscriber)}
+
 
 class MixedEntitiesException(ValueError):
     def __init__(self, *args):
@@ -17,21 +34,48 @@ class EntityNotFound(IndexError):
         super().__init__(args)
 
 
+class DbConnection(sqlite3.Connection):
+    """
+    sqlite3 connection owning the executor which runs all statements on this data base and the registry of its
+    reference data
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor: DbExecutor = None
+        self.registry: MetadataRegistry = None
+        self.pragmas: Dict[str, str] = {}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        super().close()
+
+
 class DataAccessBase(object):
-    def __init__(self, con: sqlite3.Connection, name: str = '',
+    def __init__(self, con: DbConnection, name: str = '',
                  loop: asyncio.AbstractEventLoop = None):
         if loop is None:
             self._loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
         else:
             self._loop: asyncio.AbstractEventLoop = loop
         self.data: List[EntityBase] = []
-        self.connection: sqlite3.Connection = con
+        self.connection: DbConnection = con
         self._name: str = name.upper()  # could also be set after data are populated
+        self._entity_type: Optional[Type[EntityBase]] = None
 
     @property
     def loop(self):
         return self._loop
 
+    @property
+    def executor(self) -> DbExecutor:
+        return self.connection.executor
+
+    @property
+    def registry(self) -> MetadataRegistry:
+        return self.connection.registry
+
     @property
     def name(self):
         if self._name == '':
@@ -52,21 +96,64 @@ class DataAccessBase(object):
     async def read(self, entity_id: int = 0, no_join: bool = False, by_state: bool = False) -> int:
         if self.name not in DataAccessBase._allowed_entities():
             return 0
-        entity = self._entity_factory(row={'ID': entity_id})
-        sql = entity.create_select_statement(read_all=(entity_id == 0), no_joins=no_join, by_state=by_state)
+        sql = self._entity_class().select_statement(read_all=(entity_id == 0), no_joins=no_join, by_state=by_state)
         future: asyncio.Future = self._loop.create_future()
-        asyncio.ensure_future(self._execute_select(sql=sql, parameters=[entity_id], future=future))
-        await future
+        await self._execute_select(sql=sql, parameters=[entity_id], future=future)
         return future.result()
 
-    async def update_state(self, to_state: int) -> int:
+    async def iter_by_state(self, state: int, batch_size: int = 500) -> AsyncIterator[List[EntityBase]]:
+        """
+        Read the entities of a state batch by batch in the order of their ID. The next batch is read when the
+        previous one is consumed and starts after its last ID, so memory is bounded by the batch size and the first
+        batch can be processed before the others are read. self.data is not touched.
+        :param state: state of the entities [int]
+        :param batch_size: Optional: Maximal number of entities per batch. Default is 500 [int >0]
+        :return: async iterator over lists of entities
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch size {batch_size} is less than 1")
+        sql = self._state_page_statement()
+        parameters = {'STATE': state, 'LIMIT': batch_size, **self._first_page()}
+        while True:
+            batch: List[EntityBase] = await self.executor.read(self._select, sql, parameters)
+            if len(batch) > 0:
+                yield batch
+            if len(batch) < batch_size:
+                return
+            parameters.update(self._next_page(batch[-1]))
+
+    async def count_by_state(self, states: Tuple[int, ...] = ()) -> Dict[int, int]:
+        """
+        :param states: Optional: count only these states, with the index on the state instead of reading the whole
+            table. Default counts all states [tuple of int]
+        :return: number of entities per state, states without entities are missing
+        """
+        __, rows = await self.executor.read(self._count_by_state, self.name, states)
+        return dict(rows)
+
+    @staticmethod
+    def _count_by_state(con: sqlite3.Connection, name: str, states: Tuple[int, ...]):
+        where = f" WHERE STATE IN ({','.join('?' * len(states))})" if states else ''
+        keys, cursor = select_tuples(con, f"SELECT STATE, COUNT(*) FROM {name}{where} GROUP BY STATE", list(states))
+        return keys, cursor.fetchall()
+
+    def _state_page_statement(self) -> str:
+        return f"SELECT * FROM {self.name} WHERE STATE = :STATE AND ID > :LAST_ID ORDER BY ID LIMIT :LIMIT"
+
+    def _first_page(self) -> Dict:
+        # parameters of the page statement besides STATE and LIMIT
+        return {'LAST_ID': 0}
+
+    def _next_page(self, last: EntityBase) -> Dict:
+        return {'LAST_ID': last.id}
+
+    async def update_state(self, to_state: int, **kwargs) -> int:
         if len(self.data) == 0:
             return 0
-        parameters = {'ID': self.data[0].id, 'STATE': to_state}
+        parameters = {'ID': self.data[0].id, 'STATE': to_state, **kwargs}
         sql = self.data[0].create_update_statement(**parameters)
         future: asyncio.Future = self._loop.create_future()
-        asyncio.ensure_future(self._execute_one(sql, [parameters], future))
-        await future
+        await self._execute_one(sql, [parameters], future)
         return future.result()
 
     async def insert(self) -> int:
@@ -74,54 +161,132 @@ class DataAccessBase(object):
             return 0
         sql = self.data[0].create_insert_statement()
         future: asyncio.Future = self._loop.create_future()
-        asyncio.ensure_future(self._execute_one(sql, [x.to_dict() for x in self.data], future))
-        await future
+        await self._execute_one(sql, [x.to_dict() for x in self.data], future)
         return future.result()
 
     async def _execute_select(self, sql: str, parameters: List, future: asyncio.Future):
         self.data.clear()
         try:
-            with self.connection as con:
-                for row in con.execute(sql, parameters):
-                    self.data.append(self._entity_factory(row))
+            self.data.extend(await self.executor.read(self._select, sql, parameters))
             future.set_result(len(self.data))
         except sqlite3.DatabaseError as error:
             future.set_exception(error)
 
     async def _execute_one(self, sql: str, parameters: List, future: asyncio.Future):
         try:
-            with self.connection as con:
-                if len(parameters) == 1 and sql.startswith('INSERT'):
-                    cur = con.execute(sql, parameters[0])
-                    future.set_result(cur.lastrowid)
-
-                else:
-                    cur = con.executemany(sql, parameters)
-                    future.set_result(cur.rowcount)
-
+            future.set_result(await self.executor.write(self._write, sql, parameters))
+            if self.name in MetadataRegistry.TABLES:
+                self.registry.invalidate()
         except sqlite3.DatabaseError as error:
             future.set_exception(error)
 
+    def _select(self, con: sqlite3.Connection, sql: str, parameters: List) -> List[EntityBase]:
+        # runs on a data base thread
+        entity_class = self._entity_class()
+        with con:
+            return entity_class.from_rows(*select_tuples(con, sql, parameters))
+
+    @staticmethod
+    def _write(con: sqlite3.Connection, sql: str, parameters: List) -> int:
+        # runs on the writer thread
+        with con:
+            if len(parameters) == 1 and sql.startswith('INSERT'):
+                return con.execute(sql, parameters[0]).lastrowid
+            return con.executemany(sql, parameters).rowcount
+
     def _entity_factory(self, row: Dict) -> EntityBase:
-        if self.name not in DataAccessBase._allowed_entities():
-            raise NoValidEntity
-        # just make from CLASS_NAME a ClassName(**row) call
-        return eval(''.join([x.capitalize() for x in self.name[:-1].split('_')]))(**row)
+        return self._entity_class()(**row)
+
+    def _entity_class(self) -> Type[EntityBase]:
+        if self._entity_type is None:
+            if self.name not in ENTITIES:
+                raise NoValidEntity
+            self._entity_type = ENTITIES[self.name]
+        return self._entity_type
 
     @classmethod
     def _allowed_entities(cls):
-        return {'PROCESSING_STEPS', 'TASKS', 'PARTNERS', 'EVENTS', 'SUBSCRIBERS'}
+        return ENTITIES.keys()
+
+
+_last_keys: Tuple[Tuple, Tuple[str, ...]] = ((), ())  # description of the last result and its column names
+
 
+def row_keys(description: Tuple) -> Tuple[str, ...]:
+    """
+    Column names of a result in upper letters, computed once per cursor description
+    :param description: description of a cursor
+    :return: names in the order of the columns
+    """
+    global _last_keys
+    last_description, keys = _last_keys
+    if description is not last_description:
+        keys = tuple(x[0].upper() for x in description)
+        _last_keys = (description, keys)
+    return keys
 
-def row_to_dict(cursor: sqlite3.Cursor, row: sqlite3.Row) -> Dict:
-    a = {}
-    for index, col in enumerate(cursor.description):
-        a[col[0].upper()] = row[index]
-    return a
 
+def select_tuples(con: sqlite3.Connection, sql: str, parameters=()) -> Tuple[Tuple[str, ...], sqlite3.Cursor]:
+    """
+    Execute a select which returns positional rows instead of dictionaries
+    :return: the column names and the cursor to iterate over the rows, see EntityBase.from_rows()
+    """
+    cursor = con.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, parameters)
+    return row_keys(cursor.description), cursor
 
-def prepare_connection(database_name: str = ':memory:') -> sqlite3.Connection:
-    connection = sqlite3.connect(database_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
+def row_to_dict(cursor: sqlite3.Cursor, row: Tuple) -> Dict:
+    return dict(zip(row_keys(cursor.description), row))
+
+
+def connect(database_name: str = ':memory:', pragmas: Dict[str, str] = None,
+            cached_statements: int = 128) -> DbConnection:
+    connection = sqlite3.connect(database_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                                 factory=DbConnection, check_same_thread=False, cached_statements=cached_statements)
     connection.row_factory = row_to_dict
     connection.execute('PRAGMA foreign_keys=ON;')
+    for name, value in (pragmas or {}).items():
+        connection.execute(f'PRAGMA {name}={value};')
+        applied: Dict = connection.execute(f'PRAGMA {name};').fetchone()
+        connection.pragmas[name] = str(next(iter(applied.values())))
+    return connection
+
+
+def profile_pragmas(profile: str = 'durable', **kwargs) -> Dict[str, str]:
+    """
+    Pragmas of a performance profile
+    :param profile: Optional: durable, wal or fast. Default is durable [str]
+    :param kwargs: Optional: single pragmas of PRAGMAS overriding the profile
+    :return: pragma name and value
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"unknown data base profile {profile}")
+    pragmas = {**PROFILES[profile], **{key: str(value) for key, value in kwargs.items()}}
+    for name, value in pragmas.items():
+        if name not in PRAGMAS or re.fullmatch(r'-?\w+', value) is None:
+            raise ValueError(f"pragma {name}={value} is not supported")
+    return pragmas
+
+
+def prepare_connection(database_name: str = ':memory:', readers: int = 0, queue_size: int = 1000,
+                       pragmas: Dict[str, str] = None, cached_statements: int = 128) -> DbConnection:
+    """
+    Open the data base and start its executor
+    :param database_name: Optional: File name of the data base. Default is an in memory data base [str]
+    :param readers: Optional: Number of reader threads with own connections. An in memory data base can't be
+        shared between connections, so it always runs with the writer thread only [int]
+    :param queue_size: Optional: Maximal number of pending data base calls [int]
+    :param pragmas: Optional: Pragmas for all connections, see profile_pragmas(). Default are the sqlite defaults
+    :param cached_statements: Optional: Size of the statement cache per connection. Default is 128 [int]
+    :return: the connection of the writer thread, its attribute pragmas holds the applied values
+    """
+    connection = connect(database_name, pragmas=pragmas, cached_statements=cached_statements)
+    if database_name == ':memory:':
+        readers = 0
+    connection.executor = DbExecutor(connection, readers=readers, queue_size=queue_size,
+                                     connect=partial(connect, database_name, pragmas=pragmas,
+                                                     cached_statements=cached_statements))
+    connection.registry = MetadataRegistry(connection.executor)
     return connection
@@ -0,0 +1,128 @@
+import time
+import logging
+from configparser import ConfigParser
+from typing import Dict
+
+log = logging.getLogger('asynctransaction.data.access.circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Circuit of one partner. It opens after failure_threshold failed deliveries in a row, no delivery to the partner
+    is tried then. After probe_interval seconds the circuit is half open and lets one delivery through as a probe,
+    a success closes it, a failure opens it again. A probe which never reports is repeated after probe_interval.
+    """
+
+    def __init__(self, failure_threshold: int = 5, probe_interval: float = 30.0):
+        """
+        Constructor of CircuitBreaker
+        :param failure_threshold: Optional: Failed deliveries in a row which open the circuit. Default is 5 [int]
+        :param probe_interval: Optional: Seconds until an open circuit lets a probe through. Default is 30.0 [float]
+        """
+        if failure_threshold < 1:
+            raise ValueError(f"failure threshold {failure_threshold} is less than 1")
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state: str = CLOSED
+        self.failures: int = 0
+        self.opened: int = 0
+        self._since: float = 0.0  # monotonic time the circuit was opened or the last probe let through
+
+    @property
+    def blocks(self) -> bool:
+        """
+        True if no delivery is let through now, doesn't change the state
+        """
+        return self.state != CLOSED and time.monotonic() - self._since < self.probe_interval
+
+    def allow(self) -> bool:
+        """
+        Ask before a delivery is started
+        :return: True if the delivery may go to the partner, an open circuit due for a probe becomes half open
+        """
+        if self.state == CLOSED:
+            return True
+        if self.blocks:
+            return False
+        self.state = HALF_OPEN
+        self._since = time.monotonic()
+        return True
+
+    def success(self):
+        if self.state != CLOSED:
+            log.info(f"circuit closed after {self.failures} failures")
+        self.state = CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._since = time.monotonic()
+
+    def to_dict(self) -> Dict:
+        probe_in = max(0.0, self.probe_interval - (time.monotonic() - self._since)) if self.state != CLOSED else 0.0
+        return {'STATE': self.state, 'FAILURES': self.failures, 'OPENED': self.opened,
+                'PROBE_IN': round(probe_in, 1)}
+
+
+class CircuitBreakers(object):
+    """
+    The circuit breakers of all partners, keyed by partner id. A circuit is created closed on first use.
+    """
+
+    def __init__(self, failure_threshold: int = 5, probe_interval: float = 30.0):
+        """
+        Constructor of CircuitBreakers
+        :param failure_threshold: Optional: Failed deliveries in a row which open a circuit. Default is 5 [int]
+        :param probe_interval: Optional: Seconds until an open circuit lets a probe through. Default is 30.0 [float]
+        """
+        if failure_threshold < 1:
+            raise ValueError(f"failure threshold {failure_threshold} is less than 1")
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self._circuits: Dict[int, CircuitBreaker] = {}
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> 'CircuitBreakers':
+        """
+        Circuit breakers of the optional [CIRCUIT] section of the config file
+        """
+        return cls(failure_threshold=config.getint('CIRCUIT', 'failure_threshold', fallback=5),
+                   probe_interval=config.getfloat('CIRCUIT', 'probe_interval', fallback=30.0))
+
+    def get(self, partner_id: int) -> CircuitBreaker:
+        circuit = self._circuits.get(partner_id)
+        if circuit is None:
+            circuit = CircuitBreaker(self.failure_threshold, self.probe_interval)
+            self._circuits[partner_id] = circuit
+        return circuit
+
+    def blocks(self, partner_id: int) -> bool:
+        circuit = self._circuits.get(partner_id)
+        return circuit is not None and circuit.blocks
+
+    def allow(self, partner_id: int) -> bool:
+        circuit = self._circuits.get(partner_id)
+        return circuit is None or circuit.allow()
+
+    def success(self, partner_id: int):
+        circuit = self._circuits.get(partner_id)
+        if circuit is not None:
+            circuit.success()
+
+    def failure(self, partner_id: int):
+        circuit = self.get(partner_id)
+        state = circuit.state
+        circuit.failure()
+        if circuit.state == OPEN and state != OPEN:
+            log.warning(f"circuit of partner {partner_id} opened after {circuit.failures} failures")
+
+    def to_dict(self) -> Dict[int, Dict]:
+        return {partner_id: circuit.to_dict() for partner_id, circuit in self._circuits.items()}
@@ -0,0 +1,115 @@
+import sqlite3
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from asynctransaction.metrics import DB_EXECUTE_SECONDS
+
+log = logging.getLogger('asynctransaction.data.access.executor')
+
+
+class DbExecutor(object):
+    """
+    Execution layer for all sqlite3 work of the data access classes. Nothing here runs on the event loop thread:
+    writes are serialized on one dedicated writer thread owning the main connection, reads go to optional reader
+    threads with their own connections. The number of pending calls is bounded, callers wait for a free slot.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, readers: int = 0, queue_size: int = 1000,
+                 connect: Callable[[], sqlite3.Connection] = None):
+        """
+        Constructor of DbExecutor
+        :param connection: Connection used by the writer thread [sqlite3.Connection]
+        :param readers: Optional: Number of reader threads. Default 0 means reads run on the writer [int]
+        :param queue_size: Optional: Maximal number of pending calls. Default is 1000 [int]
+        :param connect: Optional: Factory for the reader connections, mandatory if readers > 0 [Callable]
+        """
+        if readers > 0 and connect is None:
+            raise ValueError('reader threads need a connection factory')
+        self.connection = connection
+        self.queue_size = queue_size
+        self._connect = connect
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='likemc-db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='likemc-db-reader') \
+            if readers > 0 else None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reader_connections: List[sqlite3.Connection] = []
+        self._slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.pending = 0
+        self.max_pending = 0
+        self.executed = 0
+
+    async def write(self, function: Callable, *args):
+        """
+        Run function(connection, *args) on the writer thread
+        :return: result of the function
+        """
+        return await self._submit(self._writer, self._run_write, function, args)
+
+    async def read(self, function: Callable, *args):
+        """
+        Run function(connection, *args) on a reader thread, or on the writer if there are no readers
+        :return: result of the function
+        """
+        if self._readers is None:
+            return await self.write(function, *args)
+        return await self._submit(self._readers, self._run_read, function, args)
+
+    def stats(self) -> Dict:
+        return {'pending': self.pending, 'max_pending': self.max_pending, 'executed': self.executed,
+                'queue_size': self.queue_size, 'readers': len(self._reader_connections)}
+
+    def shutdown(self):
+        self._writer.shutdown(wait=True)
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+        with self._lock:
+            for connection in self._reader_connections:
+                connection.close()
+            self._reader_connections.clear()
+
+    async def _submit(self, pool: ThreadPoolExecutor, runner: Callable, function: Callable, args):
+        loop = asyncio.get_event_loop()
+        async with self._loop_slots(loop):
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            try:
+                return await loop.run_in_executor(pool, runner, function, args)
+            finally:
+                self.pending -= 1
+                self.executed += 1
+
+    def _loop_slots(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        # asyncio primitives are bound to one loop, the tests and the server may use several
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = asyncio.Semaphore(self.queue_size)
+            self._slots[loop] = slots
+        return slots
+
+    def _run_write(self, function: Callable, args):
+        start = time.perf_counter()
+        try:
+            return function(self.connection, *args)
+        finally:
+            DB_EXECUTE_SECONDS.observe(time.perf_counter() - start, getattr(function, '__name__', 'other'))
+
+    def _run_read(self, function: Callable, args):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+            with self._lock:
+                self._reader_connections.append(connection)
+            log.debug(f"reader connection opened in {threading.current_thread().name}")
+        start = time.perf_counter()
+        try:
+            return function(connection, *args)
+        finally:
+            DB_EXECUTE_SECONDS.observe(time.perf_counter() - start, getattr(function, '__name__', 'other'))
+
@@ -5,11 +5,18 @@ from asynctransaction.data.access.partner import Partner
 from asynctransaction.data.access.task import Task
 from asynctransaction.data.access.processing_step import ProcessingStep
 from asynctransaction.data.access.subscriber import Subscriber
+from asynctransaction.data.access.state_buffer import StateBuffer
+from asynctransaction.data.access.retry import RetryPolicy
+from asynctransaction.data.access.circuit_breaker import CircuitBreakers
+from asynctransaction.tracing import Tracer
 
 
-def create_transaction(con, transaction_type: str = 'default') -> ITransaction:
+def create_transaction(con, transaction_type: str = 'default', state_buffer: StateBuffer = None,
+                       retry_policy: RetryPolicy = None, circuit_breakers: CircuitBreakers = None,
+                       tracer: Tracer = None, trace_id: str = None) -> ITransaction:
     if transaction_type == 'default':
-        return Transaction(con)
+        return Transaction(con, state_buffer=state_buffer, retry_policy=retry_policy,
+                           circuit_breakers=circuit_breakers, tracer=tracer, trace_id=trace_id)
     raise NotImplementedError
 
 
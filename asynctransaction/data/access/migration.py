@@ -0,0 +1,215 @@
+"""
+Versioned migrations of the data base schema. The tables, their columns and their indexes are taken from the entity
+classes, see DbColumn and DbIndex, so a new column or a new query of the data access is declared at the entity and
+a migration brings existing data bases there. The version of a data base is kept in PRAGMA user_version.
+
+The distributor runs the missing migrations at startup, each one in its own transaction. A new data base file is
+created completely, an old one gets its missing tables, columns and indexes in place, the rows stay as they are.
+From the command line::
+
+    python -m asynctransaction.data.access.migration transaction.db
+
+A change of the schema declares its columns and indexes at the entities and adds a migration to MIGRATIONS which
+creates them in an existing data base, e.g. _extend('TASKS', ('IDEMPOTENCY_KEY',), ('TASK_IDEMPOTENCY_KEY',)).
+"""
+import sys
+import sqlite3
+import logging
+from typing import Callable, Iterable, List, Tuple, Type
+
+from asynctransaction.data.entity import *
+from asynctransaction.data.access.base import DbConnection, ENTITIES, connect
+
+log = logging.getLogger('asynctransaction.data.access.migration')
+
+# entity classes of the tables, referenced tables first
+SCHEMA: Tuple[Type[EntityBase], ...] = (Event, Partner, Subscriber, Task, ProcessingStep)
+
+
+def _create_tables(con: sqlite3.Connection):
+    # tables as declared now, the columns missing in an existing table are added by the later migrations
+    for entity in SCHEMA:
+        if len(_columns(con, entity.name)) == 0:
+            con.execute(entity().create_table_statement())
+
+
+def _add_column(con: sqlite3.Connection, table: str, column: DbColumn):
+    # a timestamp column can't be added with its default datetime(), it is added without and set once
+    if column.default.startswith('DEFAULT(datetime('):
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column.name} {column.data_type}")
+        con.execute(f"UPDATE {table} SET {column.name} = {column.default[len('DEFAULT('):-1]}")
+    else:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column.name} {column.data_type} {column.default}")
+    log.info(f"added column {table}.{column.name}")
+
+
+def _rebuild(con: sqlite3.Connection, entity: Type[EntityBase], existing: List[str]):
+    # the table is created again as declared and the rows are copied, so a new timestamp column keeps its default
+    # for the rows inserted later; the indexes are dropped with the old table and created again
+    table, columns = entity.name, ', '.join(existing)
+    con.execute(entity().create_table_statement().replace(f'CREATE TABLE {table} (', f'CREATE TABLE {table}_NEW (', 1))
+    con.execute(f"INSERT INTO {table}_NEW ({columns}) SELECT {columns} FROM {table}")
+    con.execute(f"DROP TABLE {table}")
+    con.execute(f"ALTER TABLE {table}_NEW RENAME TO {table}")
+    for index in entity.indexes:
+        if all(x in existing for x in index.columns):
+            con.execute(index.create_statement(table))
+    log.info(f"created table {table} again with the columns {', '.join(x.name for x in entity.columns)}")
+
+
+def _add_columns(con: sqlite3.Connection, entity: Type[EntityBase], names: Iterable[str]):
+    existing = _columns(con, entity.name)
+    adding = [x for x in sorted(entity.columns, key=lambda x: x.index) if x.name in names and x.name not in existing]
+    declared = {'ID'} | {x.name for x in entity.columns}
+    if any(x.default.startswith('DEFAULT(datetime(') for x in adding) and declared.issuperset(existing):
+        _rebuild(con, entity, existing)
+        return
+    for column in adding:
+        _add_column(con, entity.name, column)
+
+
+def _extend(table: str, columns: Tuple[str, ...],
+            indexes: Tuple[str, ...] = ()) -> Callable[[sqlite3.Connection], None]:
+    """
+    Migration adding columns and indexes to a table, as they are declared at its entity
+    :param table: name of the table
+    :param columns: names of the columns, the ones which exist already are skipped
+    :param indexes: Optional: names of the indexes
+    """
+    def extend(con: sqlite3.Connection):
+        entity = ENTITIES[table]
+        _add_columns(con, entity, columns)
+        for index in entity.indexes:
+            if index.name in indexes:
+                con.execute(index.create_statement(table))
+    return extend
+
+
+def _conform(table: str) -> Callable[[sqlite3.Connection], None]:
+    """
+    Migration creating a table again if the defaults of its columns differ from the ones declared at its entity,
+    sqlite can't change them in place. Meant for the small tables, all rows are copied.
+    :param table: name of the table
+    """
+    def conform(con: sqlite3.Connection):
+        entity = ENTITIES[table]
+        existing = {row['NAME']: row['DFLT_VALUE'] for row in con.execute(f"PRAGMA table_info({table})")}
+        declared = {x.name: x.default[len('DEFAULT('):-1] or None for x in entity.columns}
+        differing = [x for x, y in declared.items() if x in existing and existing[x] != y]
+        if len(differing) > 0 and {'ID', *declared}.issuperset(existing):
+            _rebuild(con, entity, list(existing))
+    return conform
+
+
+def _create_indexes(con: sqlite3.Connection):
+    # an index of columns the data base lacks yet is left to the migration adding them
+    for entity in SCHEMA:
+        existing = _columns(con, entity.name)
+        for index in entity.indexes:
+            if all(x in existing for x in index.columns):
+                con.execute(index.create_statement(entity.name))
+
+
+def _complete(con: sqlite3.Connection):
+    # everything the entities declare, whatever the version of the data base says
+    _create_tables(con)
+    for entity in SCHEMA:
+        _add_columns(con, entity, [x.name for x in entity.columns])
+    _create_indexes(con)
+
+
+# version, description and function of a migration, in the order of their versions
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, 'tables of the entities', _create_tables),
+    (2, 'idempotency key of the tasks', _extend('TASKS', ('IDEMPOTENCY_KEY',), ('TASK_IDEMPOTENCY_KEY',))),
+    (3, 'retries of the processing steps',
+     _extend('PROCESSING_STEPS', ('ATTEMPTS', 'NEXT_ATTEMPT_AT'), ('PROCESS_DUE',))),
+    (4, 'codec of the partners', _extend('PARTNERS', ('FORMAT',))),
+    (5, 'batch size of the partners', _extend('PARTNERS', ('BATCH_SIZE',))),
+    (6, 'defaults of the events', _conform('EVENTS')),
+    (7, 'indexes of the queries of the data access', _create_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def version(con: sqlite3.Connection) -> int:
+    return con.execute('PRAGMA user_version').fetchone()['USER_VERSION']
+
+
+def missing(con: sqlite3.Connection) -> List[str]:
+    """
+    Tables, columns and indexes of the entities which the data base lacks
+    :return: their names, TABLE, TABLE.COLUMN or the name of the index
+    """
+    result = []
+    indexes = {row['NAME'] for row in con.execute("SELECT NAME FROM sqlite_master WHERE TYPE = 'index'")}
+    for entity in SCHEMA:
+        existing = _columns(con, entity.name)
+        if len(existing) == 0:
+            result.append(entity.name)
+        else:
+            result.extend(f"{entity.name}.{x.name}" for x in entity.columns if x.name not in existing)
+        result.extend(x.name for x in entity.indexes if x.name not in indexes)
+    return result
+
+
+def migrate(con: sqlite3.Connection) -> int:
+    """
+    Run the migrations above the version of the data base, runs on the writer thread. A schema which is at the
+    latest version but lacks something of the entities, e.g. an index dropped by hand, is completed as well.
+    :return: the version of the data base afterwards
+    """
+    current = version(con)
+    if current > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(f"schema version {current} is newer than {SCHEMA_VERSION} of this release")
+    foreign_keys = con.execute('PRAGMA foreign_keys').fetchone()['FOREIGN_KEYS']
+    con.execute('PRAGMA foreign_keys = OFF')  # a table created again keeps its rows as they are
+    try:
+        for number, description, function in MIGRATIONS:
+            if number <= current:
+                continue
+            con.execute('BEGIN')
+            with con:
+                function(con)
+                con.execute(f'PRAGMA user_version = {number}')
+            log.info(f"migrated the data base to version {number}: {description}")
+            current = number
+        lacking = missing(con)
+        if len(lacking) > 0:
+            log.warning(f"data base lacks {', '.join(lacking)}, they are created again")
+            con.execute('BEGIN')
+            with con:
+                _complete(con)
+    finally:
+        con.execute(f'PRAGMA foreign_keys = {foreign_keys}')
+    return current
+
+
+async def upgrade(con: DbConnection) -> int:
+    """
+    Bring the data base to the latest version, at startup before anything else uses it
+    :return: the version of the data base afterwards
+    """
+    return await con.executor.write(migrate)
+
+
+def _columns(con: sqlite3.Connection, table: str) -> List[str]:
+    return [row['NAME'] for row in con.execute(f"PRAGMA table_info({table})")]
+
+
+def main(argv: List[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print('usage: python -m asynctransaction.data.access.migration <data base file>', file=sys.stderr)
+        return 2
+    con = connect(argv[0])
+    try:
+        print(f"{argv[0]}: schema version {migrate(con)}")
+    finally:
+        con.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
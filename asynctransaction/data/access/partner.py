@@ -2,9 +2,9 @@ import sqlite3
 import asyncio
 import logging
 from ipaddress import IPv4Address
-from typing import cast
+from typing import cast, Dict, List
 
-from asynctransaction.data.access.base import DataAccessBase
+from asynctransaction.data.access.base import DataAccessBase, select_tuples
 from asynctransaction.data.access.transaction_if import IPartnerAccess
 from asynctransaction.data.entity.partner import Partner as PartnerEntity
 
@@ -20,19 +20,21 @@ class Partner(DataAccessBase, IPartnerAccess):
         partner = PartnerEntity(**kwargs)
         self.data.clear()
         future: asyncio.Future = self.loop.create_future()
-        asyncio.ensure_future(self._read_partner_by_address(
-            ip_address=partner.ip_address, port=partner.port, future=future))
-        await future
+        await self._read_partner_by_address(ip_address=partner.ip_address, port=partner.port, future=future)
+        future.result()
         return cast(PartnerEntity, self.get_result())
 
     async def _read_partner_by_address(self, ip_address: IPv4Address, port: int, future: asyncio.Future):
         parameters = {'IP_ADDRESS': str(ip_address), 'PORT': port}
         log.debug(parameters)
         sql = f'SELECT * FROM {self.name} WHERE ip_address = :IP_ADDRESS AND port = :PORT AND DELETED = 0'
-        for row in self.connection.execute(sql, parameters):
-            self.data.append(PartnerEntity(**row))
+        self.data.extend(await self.executor.read(self._select_partners, sql, parameters))
         future.set_result(len(self.data))
 
+    @staticmethod
+    def _select_partners(con: sqlite3.Connection, sql: str, parameters: Dict) -> List[PartnerEntity]:
+        return PartnerEntity.from_rows(*select_tuples(con, sql, parameters))
+
     async def change_partner_data(self, **kwargs) -> PartnerEntity:
         await super().change_partner_data(**kwargs)
         partner = PartnerEntity(**kwargs)
@@ -44,7 +46,7 @@ class Partner(DataAccessBase, IPartnerAccess):
         else:  # update
             sql = self.get_result().create_update_statement(**partner.to_dict())
             future: asyncio.Future = self.loop.create_future()
-            asyncio.ensure_future(self._execute_one(sql, [x.to_dict() for x in self.data], future))
-            await future
+            await self._execute_one(sql, [x.to_dict() for x in self.data], future)
+            future.result()
             await self.read(entity_id=partner.id)
         return cast(PartnerEntity, self.get_result())
@@ -1,7 +1,10 @@
 import sqlite3
-from typing import List, cast
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, cast
 
 from asynctransaction.data.entity.state import *
+from asynctransaction.data.entity.processing_step import ProcessingStep as ProcessingStepEntity
 from asynctransaction.data.access.base import DataAccessBase
 from asynctransaction.data.access.transaction_if import IProcessingStepsAccess
 
@@ -12,9 +15,68 @@ class ProcessingStep(DataAccessBase, IProcessingStepsAccess):
 
     async def read_processing_steps(self, state: int) -> State:
         await super().read_processing_steps(state)
-        await self.read(entity_id=state, no_join=False, by_state=True)
+        # event and partner data come from the registry, only the task data are joined
+        sql = """SELECT PROCESSING_STEPS.*, TASKS.EVENT_ID, TASKS.LOCAL_ID, TASKS.DATA
+                   FROM PROCESSING_STEPS, TASKS
+                  WHERE PROCESSING_STEPS.STATE = ? AND TASKS.ID = PROCESSING_STEPS.TASK_ID"""
+        future: asyncio.Future = self.loop.create_future()
+        await self._execute_select(sql, [state], future)
+        future.result()
+        for step in self.data:
+            await self.complete(cast(ProcessingStepEntity, step))
         return State.RequestStored
 
+    async def iter_by_state(self, state: int, batch_size: int = 500) -> AsyncIterator[List[ProcessingStepEntity]]:
+        async for batch in super().iter_by_state(state, batch_size):
+            for step in batch:
+                await self.complete(cast(ProcessingStepEntity, step))
+            yield batch
+
+    async def seconds_to_next_attempt(self, state: int = State.InProgress.code) -> Optional[float]:
+        """
+        :param state: Optional: state of the steps waiting for a retry. Default is in progress [int]
+        :return: seconds until the next step of the state is due, None if there is no such step
+        """
+        return await self.executor.read(self._seconds_to_next_attempt, state)
+
+    @staticmethod
+    def _seconds_to_next_attempt(con: sqlite3.Connection, state: int) -> Optional[float]:
+        sql = """SELECT MIN(NEXT_ATTEMPT_AT) AS "NEXT_ATTEMPT_AT [timestamp]" FROM PROCESSING_STEPS
+                  WHERE STATE = ? AND NEXT_ATTEMPT_AT > ?"""
+        now = datetime.now()
+        next_attempt_at: Optional[datetime] = con.execute(sql, [state, now]).fetchone()['NEXT_ATTEMPT_AT']
+        return None if next_attempt_at is None else (next_attempt_at - now).total_seconds()
+
+    def _state_page_statement(self) -> str:
+        # only steps which are due, in the order of the index on state and next attempt
+        return """SELECT PROCESSING_STEPS.*, TASKS.EVENT_ID, TASKS.LOCAL_ID, TASKS.DATA
+                    FROM PROCESSING_STEPS, TASKS
+                   WHERE PROCESSING_STEPS.STATE = :STATE AND PROCESSING_STEPS.NEXT_ATTEMPT_AT <= :NOW
+                     AND (PROCESSING_STEPS.NEXT_ATTEMPT_AT, PROCESSING_STEPS.ID) > (:LAST_AT, :LAST_ID)
+                     AND TASKS.ID = PROCESSING_STEPS.TASK_ID
+                   ORDER BY PROCESSING_STEPS.NEXT_ATTEMPT_AT, PROCESSING_STEPS.ID LIMIT :LIMIT"""
+
+    def _first_page(self) -> Dict:
+        return {'NOW': datetime.now(), 'LAST_AT': '', 'LAST_ID': 0}
+
+    def _next_page(self, last: ProcessingStepEntity) -> Dict:
+        return {'LAST_AT': last.next_attempt_at, 'LAST_ID': last.id}
+
+    async def complete(self, step: ProcessingStepEntity) -> ProcessingStepEntity:
+        """
+        Set the event and partner data of a processing step from the registry
+        :param step: processing step with event and partner id
+        :return: the same processing step
+        """
+        event = await self.registry.get_event_by_id(step.event_id)
+        if event is not None:
+            step.url, step.method = event.url, event.method
+        partner = await self.registry.get_partner(step.partner_id)
+        if partner is not None:
+            step.ip_address, step.port, step.format = str(partner.ip_address), partner.port, partner.format
+            step.batch_size = partner.batch_size
+        return step
+
     def get_data(self) -> List:
         super().get_data()
         return self.data
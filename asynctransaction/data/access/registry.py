@@ -0,0 +1,88 @@
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from asynctransaction.data.access.executor import DbExecutor
+from asynctransaction.data.entity.event import Event
+from asynctransaction.data.entity.partner import Partner
+
+log = logging.getLogger('asynctransaction.data.access.registry')
+
+
+class MetadataRegistry(object):
+    """
+    In memory copy of the reference data EVENTS, PARTNERS and SUBSCRIBERS of one data base. The hot paths look up
+    events, subscribed partners and partner addresses here instead of querying them for every request. Each write
+    to one of the tables bumps the version, the next lookup reloads all of them.
+    """
+    TABLES = {'EVENTS', 'PARTNERS', 'SUBSCRIBERS'}
+
+    def __init__(self, executor: DbExecutor):
+        self._executor = executor
+        self.version: int = 0
+        self._loaded_version: int = -1
+        self._events: Dict[int, Event] = {}
+        self._events_by_url: Dict[Tuple[str, str], Event] = {}
+        self._partners: Dict[int, Partner] = {}
+        self._netlocs: Dict[int, str] = {}
+        self._subscribed: Dict[int, List[Partner]] = {}
+
+    def invalidate(self):
+        self.version += 1
+
+    @property
+    def is_current(self) -> bool:
+        return self._loaded_version == self.version
+
+    async def refresh(self) -> bool:
+        """
+        Reload the reference data if a write happened since the last load
+        :return: True if the data were reloaded
+        """
+        if self.is_current:
+            return False
+        version = self.version
+        events, partners, subscribers = await self._executor.read(self._load)
+        self._events = {x.id: x for x in events}
+        self._events_by_url = {(x.url, x.method): x for x in events}
+        self._partners = {x.id: x for x in partners}
+        self._netlocs = {x.id: f'{x.ip_address}:{x.port}' for x in partners}
+        self._subscribed = {}
+        for event_id, partner_id in subscribers:
+            if partner_id in self._partners and self._partners[partner_id].deleted == 0:
+                self._subscribed.setdefault(event_id, []).append(self._partners[partner_id])
+        # a write during the load keeps the registry outdated, the next lookup loads again
+        self._loaded_version = version
+        log.info(f"registry version {version}: {len(events)} events, {len(partners)} partners, "
+                 f"{len(subscribers)} subscriptions")
+        return True
+
+    async def get_event(self, url: str, method: str = 'POST') -> Optional[Event]:
+        await self.refresh()
+        return self._events_by_url.get((url, method))
+
+    async def get_event_by_id(self, event_id: int) -> Optional[Event]:
+        await self.refresh()
+        return self._events.get(event_id)
+
+    async def get_partner(self, partner_id: int) -> Optional[Partner]:
+        await self.refresh()
+        return self._partners.get(partner_id)
+
+    async def get_partners(self, event_id: int) -> List[Partner]:
+        await self.refresh()
+        return self._subscribed.get(event_id, [])
+
+    async def get_netloc(self, partner_id: int) -> Optional[str]:
+        await self.refresh()
+        return self._netlocs.get(partner_id)
+
+    @staticmethod
+    def _load(con: sqlite3.Connection) -> Tuple[List[Event], List[Partner], List[Tuple[int, int]]]:
+        # runs on a data base thread
+        from asynctransaction.data.access.base import select_tuples  # base imports the registry
+        events = Event.from_rows(*select_tuples(con, 'SELECT * FROM EVENTS WHERE DELETED = 0'))
+        partners = Partner.from_rows(*select_tuples(con, 'SELECT * FROM PARTNERS'))
+        __, rows = select_tuples(con, 'SELECT EVENT_ID, PARTNER_ID FROM SUBSCRIBERS WHERE DELETED = 0')
+        subscribers = [(event_id, partner_id) for event_id, partner_id in rows]
+        return events, partners, subscribers
@@ -0,0 +1,58 @@
+import random
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff for failed deliveries. The n-th retry waits base_delay * factor ** (n - 1) seconds, at most
+    max_delay, shortened by a random part of up to jitter so the retries of many steps don't come at once. After
+    max_attempts failed deliveries a step is given up.
+    """
+
+    def __init__(self, base_delay: float = 1.0, factor: float = 2.0, max_delay: float = 300.0, jitter: float = 0.5,
+                 max_attempts: int = 10):
+        """
+        Constructor of RetryPolicy
+        :param base_delay: Optional: Seconds before the first retry. Default is 1.0 [float]
+        :param factor: Optional: Growth of the delay per attempt. Default is 2.0 [float]
+        :param max_delay: Optional: Maximal seconds between two attempts. Default is 300.0 [float]
+        :param jitter: Optional: Maximal random part of a delay, between 0 and 1. Default is 0.5 [float]
+        :param max_attempts: Optional: Number of failed deliveries until a step is given up. Default is 10 [int]
+        """
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError(f"jitter {jitter} is not between 0 and 1")
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> 'RetryPolicy':
+        """
+        Policy of the optional [RETRY] section of the config file
+        """
+        return cls(base_delay=config.getfloat('RETRY', 'base_delay', fallback=1.0),
+                   factor=config.getfloat('RETRY', 'factor', fallback=2.0),
+                   max_delay=config.getfloat('RETRY', 'max_delay', fallback=300.0),
+                   jitter=config.getfloat('RETRY', 'jitter', fallback=0.5),
+                   max_attempts=config.getint('RETRY', 'max_attempts', fallback=10))
+
+    def gives_up(self, attempts: int) -> bool:
+        """
+        :param attempts: failed deliveries so far [int]
+        :return: True if the step is not tried again
+        """
+        return attempts >= self.max_attempts
+
+    def delay(self, attempts: int) -> float:
+        """
+        :param attempts: failed deliveries so far, at least 1 [int]
+        :return: seconds until the next attempt
+        """
+        delay = min(self.max_delay, self.base_delay * self.factor ** (attempts - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def next_attempt_at(self, attempts: int) -> datetime:
+        return datetime.now() + timedelta(seconds=self.delay(attempts))
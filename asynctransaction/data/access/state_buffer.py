@@ -0,0 +1,110 @@
+import sqlite3
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Type
+
+from asynctransaction.data.access.executor import DbExecutor
+from asynctransaction.data.entity.base import EntityBaseWithState
+from asynctransaction.data.entity.processing_step import ProcessingStep
+
+log = logging.getLogger('asynctransaction.data.access.state_buffer')
+
+
+class StateBuffer(object):
+    """
+    Write buffer for state transitions. set_state() only records the new state, the buffer is written with one
+    executemany per state and set of columns in one transaction as soon as max_items states are recorded or
+    max_delay seconds after the first one. For an entity only the last recorded state is written.
+    """
+
+    def __init__(self, executor: DbExecutor, entity_class: Type[EntityBaseWithState] = ProcessingStep,
+                 max_items: int = 500, max_delay: float = 0.05):
+        """
+        Constructor of StateBuffer
+        :param executor: executor of the data base
+        :param entity_class: Optional: Entity of the table to be updated. Default is ProcessingStep
+        :param max_items: Optional: Number of recorded states which triggers a flush. Default is 500 [int]
+        :param max_delay: Optional: Maximal seconds a state is kept in the buffer. Default is 0.05 [float]
+        """
+        self._executor = executor
+        self._entity = entity_class()
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._states: Dict[int, Dict] = {}
+        self._full: asyncio.Event = None
+        self._flusher: asyncio.Task = None
+        self.flushes = 0
+        self.flushed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._states)
+
+    def stats(self) -> Dict:
+        return {'pending': self.pending, 'flushes': self.flushes, 'flushed': self.flushed}
+
+    def set_state(self, entity_id: int, state: int, **kwargs):
+        """
+        Record a new state
+        :param entity_id: id of the entity [int]
+        :param state: new state [int]
+        :param kwargs: Optional: more columns to be written with the state, e.g. ATTEMPTS=2
+        """
+        self._states[entity_id] = {'ID': entity_id, 'STATE': state, **kwargs}
+        if self._full is None:
+            self._full = asyncio.Event()
+        if len(self._states) >= self.max_items:
+            self._full.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._run())
+
+    async def flush(self) -> int:
+        """
+        Write all recorded states now
+        :return: number of written states
+        """
+        if len(self._states) == 0:
+            return 0
+        states, self._states = self._states, {}
+        groups: Dict[Tuple, List[Dict]] = {}
+        for values in states.values():
+            groups.setdefault((values['STATE'], *sorted(values.keys())), []).append(values)
+        updates = [(self._entity.create_update_statement(**values[0]), values) for values in groups.values()]
+        try:
+            await self._executor.write(self._write, updates)
+        except sqlite3.Error:
+            for entity_id, values in states.items():  # newer states recorded meanwhile win
+                self._states.setdefault(entity_id, values)
+            raise
+        self.flushes += 1
+        self.flushed += len(states)
+        return len(states)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self):
+        while len(self._states) > 0:
+            waiter = asyncio.ensure_future(self._full.wait())
+            try:  # unlike wait_for, wait never loses a cancel of close() which comes with a full buffer
+                await asyncio.wait({waiter}, timeout=self.max_delay)
+            finally:
+                waiter.cancel()
+            self._full.clear()
+            try:
+                await self.flush()
+            except sqlite3.Error as error:
+                log.error(error)
+                await asyncio.sleep(self.max_delay)
+
+    @staticmethod
+    def _write(con: sqlite3.Connection, updates: List[Tuple[str, List[Dict]]]) -> int:
+        # runs on the writer thread, one transaction for all states
+        with con:
+            return sum(con.executemany(sql, parameters).rowcount for sql, parameters in updates)
@@ -1,48 +1,134 @@
 import sqlite3
 import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import List, cast
+from typing import Dict, Iterable, List, Optional, Tuple, cast
 import logging
 
 from asynctransaction.data.access.transaction_if import ITaskAccess
 from asynctransaction.data.access.base import DataAccessBase
 from asynctransaction.data.entity.state import *
 from asynctransaction.data.entity.task import Task as TaskEntity
+from asynctransaction.metrics import STAGE_SECONDS
 
 log = logging.getLogger('asynctransaction.data.access.task')
 
+# a PUT of a task which was stored less than this ago and is not processed yet is rated as possible duplicate
+DEDUP_WINDOW = timedelta(minutes=2)
+
 
 class Task(DataAccessBase, ITaskAccess):
     def __init__(self, con: sqlite3.Connection):
         DataAccessBase.__init__(self, con=con, name='TASKS')
+        self.timings: Dict[str, float] = {}  # seconds of the last store_unique per part, see there
 
     async def duplicate_check(self, task: TaskEntity, future: asyncio.Future):
-        credibly = 0
+        future.set_result(await self.executor.read(self._rate_duplicates, task.to_dict()))
+
+    async def store_unique(self, tasks: List[TaskEntity]) -> List[State]:
+        """
+        Insert tasks which are no duplicates. The decision is made on the writer thread in the transaction of the
+        insert, so no other write can come in between: a task with a known idempotency key is replayed, a PUT is
+        rated like duplicate_check and the insert itself skips a task of a POST event which is already stored.
+        The id of a stored or replayed task is set, a replayed task gets the local id of the stored one.
+        Afterwards timings holds the seconds spent waiting for the writer thread (queue), checking for duplicates
+        (duplicate_check), inserting (insert) and committing (commit).
+        :param tasks: tasks to be stored [List[Task]]
+        :return: per task RequestStored, RequestReplayed, ConflictRequest or BadRequestDBError
+        """
+        self.timings = {'queue': 0.0, 'duplicate_check': 0.0, 'insert': 0.0, 'commit': 0.0}
+        start = time.perf_counter()
+        with STAGE_SECONDS.time('store'):
+            results = await self.executor.write(self._store_unique, [x.to_dict() for x in tasks], self.timings)
+        self.timings['queue'] = max(0.0, time.perf_counter() - start - self.timings.pop('execute'))
+        states: List[State] = []
+        for task, (state, task_id, local_id) in zip(tasks, results):
+            if task_id is not None:
+                task.id, task.local_id = task_id, local_id
+            states.append(state)
+        return states
+
+    @staticmethod
+    def _store_unique(con: sqlite3.Connection, tasks: List[Dict],
+                      timings: Dict[str, float] = None) -> List[Tuple[State, Optional[int], int]]:
+        # runs on the writer thread, one transaction for all tasks; adds its seconds per part to timings
+        timings = {'duplicate_check': 0.0, 'insert': 0.0} if timings is None else timings
+        execute_start = time.perf_counter()
+        replay_sql = "SELECT ID, LOCAL_ID FROM TASKS WHERE IDEMPOTENCY_KEY = ?"
+        insert_sql = """INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID, DATA, IDEMPOTENCY_KEY)
+                        SELECT :LOCAL_ID, :PARTNER_ID, :EVENT_ID, :DATA, :IDEMPOTENCY_KEY
+                         WHERE NOT EXISTS (SELECT 1 FROM TASKS, EVENTS EV
+                                            WHERE TASKS.EVENT_ID = :EVENT_ID AND TASKS.PARTNER_ID = :PARTNER_ID
+                                              AND TASKS.LOCAL_ID = :LOCAL_ID AND EV.ID = TASKS.EVENT_ID
+                                              AND EV.METHOD = 'POST')
+                        ON CONFLICT(IDEMPOTENCY_KEY) DO NOTHING"""
+        results: List[Tuple[State, Optional[int], int]] = []
+        with con:
+            for task in tasks:
+                start = time.perf_counter()  # the check of a POST is part of the insert and not measured apart
+                if task['IDEMPOTENCY_KEY'] is not None:
+                    row = con.execute(replay_sql, [task['IDEMPOTENCY_KEY']]).fetchone()
+                    if row is not None:
+                        STAGE_SECONDS.observe(time.perf_counter() - start, 'duplicate_check')
+                        timings['duplicate_check'] += time.perf_counter() - start
+                        results.append((State.RequestReplayed, row['ID'], row['LOCAL_ID']))
+                        continue
+                duplicate = task['METHOD'] != 'POST' and Task._rate_duplicates(con, task) > 5
+                insert_start = time.perf_counter()
+                STAGE_SECONDS.observe(insert_start - start, 'duplicate_check')
+                timings['duplicate_check'] += insert_start - start
+                if duplicate:
+                    results.append((State.ConflictRequest, None, task['LOCAL_ID']))
+                    continue
+                try:
+                    cursor = con.execute(insert_sql, task)
+                except sqlite3.IntegrityError as error:  # unknown partner or event
+                    log.error(error)
+                    results.append((State.BadRequestDBError, None, task['LOCAL_ID']))
+                    continue
+                finally:
+                    timings['insert'] += time.perf_counter() - insert_start
+                if cursor.rowcount == 0:
+                    results.append((State.ConflictRequest, None, task['LOCAL_ID']))
+                    continue
+                results.append((State.RequestStored, cursor.lastrowid, task['LOCAL_ID']))
+            commit_start = time.perf_counter()
+        timings['commit'] = time.perf_counter() - commit_start
+        timings['execute'] = time.perf_counter() - execute_start
+        return results
+
+    @staticmethod
+    def _rate_duplicates(con: sqlite3.Connection, parameters: Dict) -> int:
         sql = """SELECT TASKS.ID, TASKS.STATE, TASKS.UPDATED_ON, EV.METHOD 
                    FROM TASKS, EVENTS EV  
                   WHERE TASKS.EVENT_ID = :EVENT_ID AND PARTNER_ID = :PARTNER_ID  
                     AND TASKS.EVENT_ID = EV.ID AND LOCAL_ID = :LOCAL_ID"""
-        for row in self.connection.execute(sql, task.to_dict()):
+        return Task._rate(con.execute(sql, parameters))
+
+    @staticmethod
+    def _rate(rows: Iterable[Dict]) -> int:
+        credibly = 0
+        for row in rows:
             if row['METHOD'] == 'POST':
-                return future.set_result(100)
+                return 100
             if row['STATE'] in {3, 4}:  # already processed, no problem also if it's a duplicate
                 continue
             if row['STATE'] == 5:  # same data once on error, could be a problem
                 log.error("Error in the last put")
                 credibly += 1
                 continue
-            if datetime.now() - row['UPDATED_ON'] < timedelta(minutes=2):
+            if datetime.now() - row['UPDATED_ON'] < DEDUP_WINDOW:
                 log.warning(f"{row['ID']} could be a duplicate")
                 credibly += 2
                 continue
-        future.set_result(credibly)
+        return credibly
 
     async def read_tasks(self, state: int) -> State:
         await super().read_tasks(state)
         sql = f"SELECT * FROM {self.name} WHERE STATE = ?"
         future: asyncio.Future = self.loop.create_future()
-        asyncio.ensure_future(self._execute_select(sql, [state], future))
-        await future
+        await self._execute_select(sql, [state], future)
+        future.result()
         return State.RequestStored
 
     def get_data(self) -> List:
@@ -1,111 +1,349 @@
 import json
+import re
+import time
 import sqlite3
 import asyncio
 import logging
-from typing import cast
+from typing import cast, List, Optional, Tuple
 
 import aiohttp
 from aiohttp.web import BaseRequest
 
 from asynctransaction.data.entity import *
+from asynctransaction.data import codec
 from asynctransaction.data.access.transaction_if import ITransaction
 from asynctransaction.data.access.base import DataAccessBase
 from asynctransaction.data.access.task import Task as TaskAccess
+from asynctransaction.data.access.state_buffer import StateBuffer
+from asynctransaction.data.access.retry import RetryPolicy
+from asynctransaction.data.access.circuit_breaker import CircuitBreakers
+from asynctransaction.tracing import Tracer, DISABLED, TRACE_HEADER
 
 log = logging.getLogger('asynctransaction.data.access.transaction')
 
 
 class Transaction(ITransaction, DataAccessBase):
-    def __init__(self, con: sqlite3.Connection):
+    def __init__(self, con: sqlite3.Connection, state_buffer: StateBuffer = None, retry_policy: RetryPolicy = None,
+                 circuit_breakers: CircuitBreakers = None, tracer: Tracer = None, trace_id: str = None):
         ITransaction.__init__(self)
         DataAccessBase.__init__(self, con=con, name='TASKS')
+        self.state_buffer: StateBuffer = state_buffer  # if set, process() doesn't write the states itself
+        self.retry_policy: RetryPolicy = RetryPolicy() if retry_policy is None else retry_policy
+        self.circuit_breakers: CircuitBreakers = circuit_breakers  # if set, process() reports each delivery
+        self.tracer: Tracer = DISABLED if tracer is None else tracer
+        self.trace_id: Optional[str] = trace_id  # trace of the request, the deliveries use the one of their task
+        self.batch: List[List] = []  # [state, task or None] per item of a batch request
 
     async def receive(self, request: BaseRequest, this_event: Event = None) -> State:
         await super().receive(request)
+        payload_codec = codec.by_content_type(request.content_type)
+        if payload_codec is None:
+            return State.UnsupportedMediaType
+        with self.tracer.span(self.trace_id, 'receive.read') as span:
+            body = await request.read()
+            span.set(BYTES=len(body))
         try:
-            received_data: Dict = await request.json()
-        except json.JSONDecodeError:
+            with self.tracer.span(self.trace_id, 'receive.decode', FORMAT=payload_codec.name):
+                if payload_codec is codec.JSON:  # DATA is kept as it was sent
+                    received_data, raw_values = decode_payload(body.decode('utf-8'))
+                else:
+                    received_data, raw_values = payload_codec.loads(body), {}
+        except ValueError:
             return State.BadRequestJsonDecode
+        if isinstance(received_data, dict) is False:  # e.g. an array or a number
+            return State.BadRequestMandatoryKey
+        state, task = self._create_task(received_data, this_event, raw_values.get('DATA'))
+        if task is not None:
+            idempotency_key = request.headers.get('Idempotency-Key')
+            if idempotency_key is not None:  # unique per event and partner only
+                task.idempotency_key = f"{task.event_id}/{task.partner_id}/{idempotency_key}"
+            self.data.append(task)
+        return state
+
+    async def receive_batch(self, request: BaseRequest, this_event: Event = None) -> State:
+        await super().receive_batch(request, this_event)
+        payload_codec = codec.by_content_type(request.content_type)
+        if payload_codec is None:
+            return State.UnsupportedMediaType
+        with self.tracer.span(self.trace_id, 'receive.read') as span:
+            body = await request.read()
+            span.set(BYTES=len(body))
+        try:
+            with self.tracer.span(self.trace_id, 'receive.decode', FORMAT=payload_codec.name) as span:
+                if payload_codec is codec.JSON:  # json array or newline delimited json
+                    items = parse_batch(body.decode('utf-8'), request.content_type)
+                else:
+                    items = payload_codec.loads(body)
+                    items = items if isinstance(items, list) else [items]
+                span.set(ITEMS=len(items))
+        except ValueError:
+            return State.BadRequestJsonDecode
+        self.data.clear()
+        self.batch.clear()
+        for item in items:
+            if isinstance(item, State):
+                self.batch.append([item, None])
+                continue
+            if isinstance(item, dict) is False:
+                self.batch.append([State.BadRequestMandatoryKey, None])
+                continue
+            state, task = self._create_task(item, this_event)
+            self.batch.append([state, task])
+        return State.RequestReceived
+
+    @staticmethod
+    def _create_task(received_data: Dict, this_event: Event = None,
+                     raw_data: str = None) -> Tuple[State, Optional[Task]]:
+        # raw_data is the text DATA was sent with, it is stored as it is instead of being encoded again
         # check for necessary data fields
         if {'PARTNER_ID', 'DATA'}.issubset(received_data.keys()) is False:
-            return State.BadRequestMandatoryKey
+            return State.BadRequestMandatoryKey, None
+        if isinstance(received_data['PARTNER_ID'], (int, str)) is False:
+            return State.BadRequestNotStoreAble, None
         if this_event is None:
             if 'EVENT_ID' not in received_data:
-                return State.BadRequestMandatoryKey
+                return State.BadRequestMandatoryKey, None
         else:
             received_data['EVENT_ID'] = this_event.id
             received_data['URL'] = this_event.url
             received_data['METHOD'] = this_event.method
         if isinstance(received_data['DATA'], dict):
             if 'ID' not in received_data['DATA']:
-                return State.BadRequestMandatoryKey
+                return State.BadRequestMandatoryKey, None
+            if isinstance(received_data['DATA']['ID'], (int, str)) is False:
+                return State.BadRequestNotStoreAble, None
             received_data['LOCAL_ID'] = received_data['DATA']['ID']
-            received_data['DATA'] = json.dumps(received_data['DATA'])
+            if raw_data is None:
+                try:
+                    raw_data = codec.JSON.dumps(received_data['DATA']).decode('utf-8')
+                except TypeError:  # e.g. binary values of msgpack
+                    return State.BadRequestNotStoreAble, None
+            received_data['DATA'] = raw_data
         elif isinstance(received_data['DATA'], str) is False:
-            return State.BadRequestNotStoreAble
+            return State.BadRequestNotStoreAble, None
         received_data['ID'] = 0
         try:
-            self.data.append(Task(**received_data))
+            return State.RequestReceived, Task(**received_data)
         except TaskException:
-            return State.BadRequestNotStoreAble
-        return State.RequestReceived
+            return State.BadRequestNotStoreAble, None
 
     async def store(self) -> State:
         await super().store()
         ta = TaskAccess(self.connection)
-        future: asyncio.Future = self._loop.create_future()
-        asyncio.ensure_future(ta.duplicate_check(task=self.task, future=future))
-        await future
-        if future.result() > 5:
-            return State.ConflictRequest
         try:
-            record_id = await self.insert()
+            with self.tracer.span(self.trace_id, 'store') as span:
+                states = await ta.store_unique([self.task])
+                span.set(STATE=states[0].name, **self._timings_ms(ta))
+        except sqlite3.Error as error:
+            log.error(error)
+            return State.BadRequestDBError
+        if states[0] == State.RequestStored:
+            self.tracer.follow(self.task.id, self.trace_id)
+        return states[0]
+
+    async def store_batch(self) -> State:
+        await super().store_batch()
+        received = [entry for entry in self.batch if entry[0] == State.RequestReceived]
+        if len(received) == 0:
+            return State.RequestStored
+        ta = TaskAccess(self.connection)
+        try:
+            with self.tracer.span(self.trace_id, 'store', ITEMS=len(received)) as span:
+                states = await ta.store_unique([task for __, task in received])
+                span.set(**self._timings_ms(ta))
         except sqlite3.Error as error:
             log.error(error)
+            for entry in received:
+                entry[0] = State.BadRequestDBError
             return State.BadRequestDBError
-        for data in self.data:
-            data.id = record_id
+        for entry, state in zip(received, states):
+            entry[0] = state
+            if state == State.RequestStored:
+                self.tracer.follow(entry[1].id, self.trace_id)
+        self.data = [task for state, task in self.batch if state == State.RequestStored]
         return State.RequestStored
 
     async def spread(self, task_id: int) -> State:
         await super().spread(task_id)
         future: asyncio.Future = self._loop.create_future()
-        asyncio.ensure_future(self._spread_task(task_id=task_id, future=future))
-        await future
+        with self.tracer.span(self.trace_id, 'spread', TASK_ID=task_id):
+            await self._spread_task(task_id=task_id, future=future)
+        future.result()
         return State.RequestStored
 
+    async def spread_all(self, limit: int = 0) -> int:
+        """
+        Spread the new tasks to their subscribers with one insert and one update in one transaction, no task is
+        read into python
+        :param limit: Optional: spread only the oldest limit tasks, default 0 spreads all new tasks [int]
+        :return: number of spread tasks
+        """
+        await super().spread_all(limit)
+        with self.tracer.span(self.trace_id, 'spread') as span:
+            spread_tasks = await self.executor.write(self._spread_all_in_db, limit)
+            span.set(TASKS=spread_tasks)
+        return spread_tasks
+
     async def process(self, process: ProcessingStep,
                       client: aiohttp.ClientSession) -> State:
         await super().process(process, client)
         ba = DataAccessBase(self.connection)
         ba.data.append(process)
-        await ba.update_state(to_state=State.InProgress.code)
+        await self._set_state(ba, State.InProgress)
+        trace_id = self.tracer.trace_of(process.task_id)
         try:
 
             url = ['http://', process.ip_address, ':',
                    str(process.port), '/transactions/', process.url]
             log.info(''.join(url))
-            resp = await client.request(method=process.method, url=''.join(url),
-                                        data=process.data, timeout=1.01)
+            body, content_type = encode_step(process)
+            headers = {'Content-Type': content_type}
+            if trace_id is not None:
+                headers[TRACE_HEADER] = trace_id
+            with self.tracer.span(trace_id, 'process', PARTNER_ID=process.partner_id, STEP_ID=process.id,
+                                  ATTEMPT=process.attempts + 1) as span:
+                resp = await client.request(method=process.method, url=''.join(url), data=body,
+                                            headers=headers, timeout=1.01)
+                if isinstance(resp, aiohttp.ClientResponse):
+                    resp.release()  # hand the connection back to the pool for the next delivery
+                span.set(STATUS=resp.status)
 
+            self._report(process.partner_id, resp.status < 500)
             if resp.status in {200, 201}:
-                await ba.update_state(to_state=State.Processed.code)
+                await self._set_state(ba, State.Processed)
                 return State.RequestStored
             else:
-                await ba.update_state(to_state=State.Error.code)
+                await self._set_state(ba, State.Error)
                 return State.BadRequest
 
-        except aiohttp.ClientError as error:
-            log.error(error)
-            await ba.update_state(to_state=State.InProgress.code)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            log.error(f"delivery of step {process.id} failed: {error!r}")
+            self._report(process.partner_id, False)
+            await self._retry_later(ba)
             return State.BadRequest
 
+    async def process_batch(self, steps: List[ProcessingStep], client: aiohttp.ClientSession) -> List[State]:
+        """
+        Deliver the processing steps of one partner and event with one request to the batch route of the partner.
+        The answer is a list with a {"STATUS": ..} per step in the same order, which is applied step by step. An
+        answer without such a list applies its own status to all steps.
+        :return: result per step, in the order of the steps
+        """
+        await super().process_batch(steps, client)
+        accesses = []
+        for step in steps:
+            ba = DataAccessBase(self.connection)
+            ba.data.append(step)
+            accesses.append(ba)
+            await self._set_state(ba, State.InProgress)
+        first = steps[0]
+        trace_ids: List[str] = []  # the traces of all sampled tasks of the batch
+        for step in steps:
+            trace_id = self.tracer.trace_of(step.task_id)
+            if trace_id is not None and trace_id not in trace_ids:
+                trace_ids.append(trace_id)
+        start, started = time.time(), time.perf_counter()
+        try:
+            url = ['http://', first.ip_address, ':', str(first.port), '/transactions/', first.url, '/batch']
+            log.info(f"{''.join(url)} with {len(steps)} steps")
+            body, content_type = encode_batch(steps)
+            headers = {'Content-Type': content_type, 'Accept': content_type}
+            if trace_ids:
+                headers[TRACE_HEADER] = ','.join(trace_ids)
+            resp = await client.request(method=first.method, url=''.join(url), data=body, headers=headers,
+                                        timeout=1.01)
+            statuses = await self._read_statuses(resp, len(steps))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            log.error(f"delivery of {len(steps)} steps to partner {first.partner_id} failed: {error!r}")
+            for trace_id in trace_ids:
+                self.tracer.record(trace_id, 'process_batch', start, time.perf_counter() - started,
+                                   PARTNER_ID=first.partner_id, STEPS=len(steps), ERROR=type(error).__name__)
+            self._report(first.partner_id, False)
+            for ba in accesses:
+                await self._retry_later(ba)
+            return [State.BadRequest] * len(steps)
+
+        for trace_id in trace_ids:  # one span per trace, each one covers the whole batch
+            self.tracer.record(trace_id, 'process_batch', start, time.perf_counter() - started,
+                               PARTNER_ID=first.partner_id, STEPS=len(steps), STATUS=resp.status)
+        self._report(first.partner_id, resp.status < 500)
+        results = []
+        for ba, status in zip(accesses, statuses):
+            if status in {200, 201}:
+                await self._set_state(ba, State.Processed)
+                results.append(State.RequestStored)
+            else:
+                await self._set_state(ba, State.Error)
+                results.append(State.BadRequest)
+        return results
+
+    @staticmethod
+    async def _read_statuses(resp, count: int) -> List[int]:
+        # status per step from the answer of a batch delivery, the status of the answer if it has no list
+        if isinstance(resp, aiohttp.ClientResponse):
+            body, content_type = await resp.read(), resp.content_type  # reading hands the connection back
+        else:
+            body, content_type = resp.body, resp.content_type
+        answer_codec = codec.by_content_type(content_type)
+        try:
+            answer = answer_codec.loads(body) if answer_codec is not None and body else None
+        except ValueError:
+            answer = None
+        if isinstance(answer, list) and len(answer) == count:
+            statuses = [x.get('STATUS') if isinstance(x, dict) else x for x in answer]
+            return [x if isinstance(x, int) else 0 for x in statuses]
+        if resp.status == 207:  # the items were processed one by one, but the answer can't be matched to them
+            log.error(f"answer of a batch of {count} steps could not be read")
+            return [0] * count
+        return [resp.status] * count
+
+    @staticmethod
+    def _timings_ms(task_access: TaskAccess) -> Dict[str, float]:
+        return {f"{key.upper()}_MS": round(value * 1000, 3) for key, value in task_access.timings.items()}
+
+    def _report(self, partner_id: int, reachable: bool):
+        # a partner which answers is reachable, even with a client error; server errors count as failures
+        if self.circuit_breakers is None:
+            return
+        if reachable:
+            self.circuit_breakers.success(partner_id)
+        else:
+            self.circuit_breakers.failure(partner_id)
+
+    async def _retry_later(self, access: DataAccessBase):
+        # count the failed attempt, the step stays in progress until it is due again or is given up
+        step = cast(ProcessingStep, access.get_result())
+        step.attempts += 1
+        if self.retry_policy.gives_up(step.attempts):
+            log.error(f"step {step.id} to partner {step.partner_id} given up after {step.attempts} attempts")
+            await self._set_state(access, State.DeadLetter, ATTEMPTS=step.attempts)
+            return
+        step.next_attempt_at = self.retry_policy.next_attempt_at(step.attempts)
+        await self._set_state(access, State.InProgress, ATTEMPTS=step.attempts, NEXT_ATTEMPT_AT=step.next_attempt_at)
+
+    async def _set_state(self, access: DataAccessBase, state: State, **kwargs):
+        if self.state_buffer is None:
+            await access.update_state(to_state=state.code, **kwargs)
+        else:
+            self.state_buffer.set_state(access.get_result().id, state.code, **kwargs)
+
     @property
     def message(self) -> str:
         super().message()
         stored_task: Task = self.get_result()
         return f"/{stored_task.url}/{stored_task.local_id}/{stored_task.id}"
 
+    @property
+    def messages(self) -> List[Dict]:
+        super().messages()
+        result: List[Dict] = []
+        for state, task in self.batch:
+            if state == State.RequestStored:
+                result.append({'STATUS': state.code, 'PATH': f"/{task.url}/{task.local_id}/{task.id}"})
+            else:
+                result.append({'STATUS': state.code, 'REASON': state.reason})
+        return result
+
     @property
     def task(self) -> Task:
         super().task()
@@ -116,9 +354,124 @@ class Transaction(ITransaction, DataAccessBase):
                         FROM TASKS, SUBSCRIBERS WHERE TASKS.ID = :ID AND TASKS.EVENT_ID = SUBSCRIBERS.EVENT_ID"""
         update_sql = """UPDATE TASKS SET STATE = 3, UPDATED_ON = datetime('now','localtime') WHERE ID = :ID"""
         try:
-            with self.connection as con:
-                con.execute(sql, {'ID': task_id})
-                con.execute(update_sql, {'ID': task_id})
-                future.set_result(True)
+            future.set_result(await self.executor.write(self._spread_in_db, sql, update_sql, task_id))
         except sqlite3.Error as error:
             future.set_exception(error)
+
+    @staticmethod
+    def _spread_all_in_db(con: sqlite3.Connection, limit: int) -> int:
+        # runs on the writer thread, no other write can come in between the statements
+        bound_sql = """SELECT MAX(ID) MAX_ID FROM (SELECT ID FROM TASKS WHERE STATE = 1 ORDER BY ID LIMIT :LIMIT)"""
+        sql = """INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID) SELECT TASKS.ID, SUBSCRIBERS.PARTNER_ID
+                   FROM TASKS, SUBSCRIBERS WHERE TASKS.STATE = 1 AND TASKS.ID <= :MAX_ID
+                    AND TASKS.EVENT_ID = SUBSCRIBERS.EVENT_ID"""
+        update_sql = """UPDATE TASKS SET STATE = 3, UPDATED_ON = datetime('now','localtime')
+                         WHERE STATE = 1 AND ID <= :MAX_ID"""
+        with con:
+            max_id = con.execute(bound_sql, {'LIMIT': limit if limit > 0 else -1}).fetchone()['MAX_ID']
+            if max_id is None:
+                return 0
+            con.execute(sql, {'MAX_ID': max_id})
+            return con.execute(update_sql, {'MAX_ID': max_id}).rowcount
+
+    @staticmethod
+    def _spread_in_db(con: sqlite3.Connection, sql: str, update_sql: str, task_id: int) -> bool:
+        # runs on the writer thread
+        with con:
+            con.execute(sql, {'ID': task_id})
+            con.execute(update_sql, {'ID': task_id})
+        return True
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def decode_payload(body: str) -> Tuple[object, Dict[str, str]]:
+    """
+    Decode a json object with one pass over the text and keep the text of each of its values, so a value can be
+    stored and sent on exactly as it was received without encoding it again
+    :param body: text of the request
+    :return: decoded payload and the text per key of the top level object, no texts if the payload is no object
+    """
+    index = _whitespace.match(body, 0).end()
+    if body.startswith('{', index) is False:
+        return json.loads(body), {}
+    values: Dict = {}
+    texts: Dict[str, str] = {}
+    index = _whitespace.match(body, index + 1).end()
+    if body.startswith('}', index):
+        index += 1
+    else:
+        while True:
+            if body.startswith('"', index) is False:
+                raise json.JSONDecodeError('Expecting property name enclosed in double quotes', body, index)
+            key, index = json.decoder.scanstring(body, index + 1)
+            index = _whitespace.match(body, index).end()
+            if body.startswith(':', index) is False:
+                raise json.JSONDecodeError("Expecting ':' delimiter", body, index)
+            index = _whitespace.match(body, index + 1).end()
+            values[key], end = _decoder.raw_decode(body, index)
+            texts[key] = body[index:end]
+            index = _whitespace.match(body, end).end()
+            if body.startswith('}', index):
+                index += 1
+                break
+            if body.startswith(',', index) is False:
+                raise json.JSONDecodeError("Expecting ',' delimiter", body, index)
+            index = _whitespace.match(body, index + 1).end()
+    if _whitespace.match(body, index).end() != len(body):
+        raise json.JSONDecodeError('Extra data', body, index)
+    return values, texts
+
+
+def encode_step(step: ProcessingStep) -> Tuple[Optional[bytes], str]:
+    """
+    Encode the data of a processing step in the format of its partner
+    :return: body and content type of the delivery, json data are sent as they were received
+    """
+    step_codec = codec.by_name(step.format)
+    if step_codec is not codec.JSON:
+        try:
+            return step_codec.dumps(codec.JSON.loads(step.data)), step_codec.content_type
+        except (ValueError, TypeError) as error:
+            log.error(f"data of step {step.id} sent as json, not as {step_codec.name}: {error!r}")
+    return None if step.data is None else step.data.encode('utf-8'), codec.JSON.content_type
+
+
+def encode_batch(steps: List[ProcessingStep]) -> Tuple[bytes, str]:
+    """
+    Encode the data of processing steps of one partner as one array in the format of the partner
+    :return: body and content type of the delivery, json data are joined as they were received
+    """
+    step_codec = codec.by_name(steps[0].format)
+    if step_codec is not codec.JSON:
+        try:
+            return step_codec.dumps([codec.JSON.loads(x.data) for x in steps]), step_codec.content_type
+        except (ValueError, TypeError) as error:
+            log.error(f"data of {len(steps)} steps sent as json, not as {step_codec.name}: {error!r}")
+    return ''.join(['[', ','.join(x.data or 'null' for x in steps), ']']).encode('utf-8'), codec.JSON.content_type
+
+
+def parse_batch(body: str, content_type: str = 'application/json') -> List:
+    """
+    Split the body of a batch request into its items. The body is a json array or newline delimited json, a line
+    which couldn't be decoded becomes State.BadRequestJsonDecode.
+    :param body: text of the request
+    :param content_type: application/x-ndjson forces newline delimited json
+    :return: list of decoded items
+    """
+    if content_type != 'application/x-ndjson':
+        try:
+            items = codec.JSON.loads(body)
+            return items if isinstance(items, list) else [items]
+        except json.JSONDecodeError:
+            if '\n' not in body.strip():
+                raise
+    items = []
+    for line in filter(None, (x.strip() for x in body.splitlines())):
+        try:
+            items.append(codec.JSON.loads(line))
+        except json.JSONDecodeError:
+            items.append(State.BadRequestJsonDecode)
+    return items
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import AsyncIterator, Dict, List
 
 from aiohttp.web import BaseRequest
 import aiohttp
@@ -16,22 +16,42 @@ class ITransaction(ABC):
     async def receive(self, request: BaseRequest, event: Event = None) -> State:
         ...
 
+    @abstractmethod
+    async def receive_batch(self, request: BaseRequest, event: Event = None) -> State:
+        ...
+
     @abstractmethod
     async def store(self) -> State:
         ...
 
+    @abstractmethod
+    async def store_batch(self) -> State:
+        ...
+
     @abstractmethod
     async def spread(self, task_id: int) -> State:
         ...
 
+    @abstractmethod
+    async def spread_all(self, limit: int = 0) -> int:
+        ...
+
     @abstractmethod
     async def process(self, process: ProcessingStep, client: aiohttp.ClientSession) -> State:
         ...
 
+    @abstractmethod
+    async def process_batch(self, steps: List[ProcessingStep], client: aiohttp.ClientSession) -> List[State]:
+        ...
+
     @abstractmethod
     def message(self) -> str:
         ...
 
+    @abstractmethod
+    def messages(self) -> List[Dict]:
+        ...
+
     @abstractmethod
     def task(self) -> Task:
         ...
@@ -64,6 +84,14 @@ class ITaskAccess(ABC):
     async def read_tasks(self, state: int) -> State:
         ...
 
+    @abstractmethod
+    def iter_by_state(self, state: int, batch_size: int = 500) -> AsyncIterator[List[Task]]:
+        ...
+
+    @abstractmethod
+    async def count_by_state(self) -> Dict[int, int]:
+        ...
+
     @abstractmethod
     def get_data(self) -> List:
         ...
@@ -74,6 +102,14 @@ class IProcessingStepsAccess(ABC):
     async def read_processing_steps(self, state: int) -> State:
         ...
 
+    @abstractmethod
+    def iter_by_state(self, state: int, batch_size: int = 500) -> AsyncIterator[List[ProcessingStep]]:
+        ...
+
+    @abstractmethod
+    async def count_by_state(self) -> Dict[int, int]:
+        ...
+
     @abstractmethod
     def get_data(self) -> List:
         ...
@@ -0,0 +1,124 @@
+"""
+Codecs of the payloads. A request is decoded by the codec of its Content-Type, an answer is encoded by the codec
+its Accept header asks for and a delivery by the codec of the FORMAT of the partner. Unknown types fall back to
+json, so clients which don't send a Content-Type keep working.
+
+orjson is used for json and msgpack for msgpack if they are installed, both are optional::
+
+    pip install orjson msgpack
+
+The decode errors of all codecs are ValueErrors, the encode errors TypeErrors.
+"""
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # the json module is used instead
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # msgpack is not offered then
+    msgpack = None
+
+log = logging.getLogger('asynctransaction.data.codec')
+
+
+class Codec(ABC):
+    name: str = ''
+    content_type: str = ''
+    content_types: frozenset = frozenset()
+
+    @abstractmethod
+    def loads(self, body):
+        """
+        :param body: encoded payload [bytes or str]
+        :return: decoded payload
+        """
+        ...
+
+    @abstractmethod
+    def dumps(self, value) -> bytes:
+        ...
+
+
+class JsonCodec(Codec):
+    name = 'json'
+    content_type = 'application/json'
+    content_types = frozenset({'application/json'})
+
+    def loads(self, body):
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+
+    def dumps(self, value) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(value)
+        return json.dumps(value).encode('utf-8')
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+    content_types = frozenset({'application/msgpack', 'application/x-msgpack'})
+
+    def loads(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+    def dumps(self, value) -> bytes:
+        return msgpack.packb(value)
+
+
+JSON = JsonCodec()
+CODECS: Dict[str, Codec] = {x.name: x for x in (JSON, MsgpackCodec() if msgpack is not None else None) if x}
+_by_content_type: Dict[str, Codec] = {t: x for x in CODECS.values() for t in x.content_types}
+
+
+def by_name(name: str) -> Codec:
+    """
+    :param name: FORMAT of a partner, e.g. json or msgpack
+    :return: the codec, json if the format is unknown or its package is not installed
+    """
+    codec = CODECS.get(name or JSON.name)
+    if codec is None:
+        log.warning(f"format {name} is not available, json is used")
+        return JSON
+    return codec
+
+
+def by_content_type(content_type: str) -> Optional[Codec]:
+    """
+    :param content_type: mime type of a request without parameters
+    :return: the codec, json for an unknown type, None for msgpack if it is not installed
+    """
+    codec = _by_content_type.get(content_type)
+    if codec is None and content_type in MsgpackCodec.content_types:
+        return None
+    return JSON if codec is None else codec
+
+
+def by_accept(accept: str) -> Codec:
+    """
+    :param accept: Accept header of a request, e.g. 'application/msgpack, application/json;q=0.5'
+    :return: the offered codec with the highest quality, json if none of them is offered
+    """
+    best, best_quality = JSON, 0.0
+    for entry in (accept or '').split(','):
+        media_type, *parameters = [x.strip() for x in entry.split(';')]
+        codec = _by_content_type.get(media_type.lower())
+        if codec is None:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            key, __, value = parameter.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
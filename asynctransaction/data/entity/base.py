@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Dict, List
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from asynctransaction.data.entity.state import State
 
@@ -10,7 +10,8 @@ class DbColumn(object):
     DbColumn class to administrate the entity - data base relationship
     """
 
-    def __init__(self, name: str, index: int, fk: str = None, data_type: str = 'TEXT', default=None):
+    def __init__(self, name: str, index: int, fk: str = None, data_type: str = 'TEXT', default=None,
+                 inserted: bool = False):
         """
         Constructor of DbColumn
         :param name: Name of the column [str]
@@ -20,11 +21,14 @@ class DbColumn(object):
             TIMESTAMP [str]
         :param default: Optional: Default value of the column. If set to 'default' INTEGER and FLOAT take 0 as
             default, TIMESTAMP datetime('now','localtime') [str]
+        :param inserted: Optional: If true, the insert statement sets a column with default as well, else it is
+            left to the data base. Default is False [bool]
         """
         self.name = name
         self.data_type = data_type.upper()
         self.index = index
         self.fk = fk
+        self.inserted = inserted
         if default is None:
             self.default = ''
             return
@@ -39,6 +43,27 @@ class DbColumn(object):
             self.default = f'DEFAULT({default})'
 
 
+class DbIndex(object):
+    """
+    DbIndex class to administrate an index of a table, each one serves a query of the data access
+    """
+
+    def __init__(self, name: str, columns: Tuple[str, ...], unique: bool = False):
+        """
+        Constructor of DbIndex
+        :param name: Name of the index, unique in the data base [str]
+        :param columns: Names of the indexed columns in their order [tuple of str]
+        :param unique: Optional: If true, a value may occur only once. Default is False [bool]
+        """
+        self.name = name
+        self.columns = tuple(columns)
+        self.unique = unique
+
+    def create_statement(self, table: str) -> str:
+        return (f"CREATE {'UNIQUE ' if self.unique else ''}INDEX IF NOT EXISTS {self.name} "
+                f"ON {table}({', '.join(self.columns)});")
+
+
 class NoValidEntity(Exception):
     """
     No valid entity exception. Occurs if no entity is implemented fro the given name.
@@ -51,26 +76,102 @@ class NoValidEntity(Exception):
 class EntityBase(ABC):
     """
     All entities are derived from this base class. Each table has a couple of basic columns like created_on and
-    deleted flag.
+    deleted flag. The generated sql statements are kept per entity class and variant, so every call of the same
+    variant returns the identical string.
+    The table name and the columns belong to the class, the instances only hold the values of a row in slots.
     """
+    __slots__ = ('id', '_updated_on', '_created_on', 'deleted')
+    _statements: Dict[Tuple, str] = {}
+    name: str = ''  # name of the table, in upper letters and plural
+    columns: List[DbColumn] = [
+        DbColumn('UPDATED_ON', 101, None, 'TIMESTAMP', 'default'),
+        DbColumn('CREATED_ON', 102, None, 'TIMESTAMP', 'default'),
+        DbColumn('DELETED', 103, None, 'INTEGER', 'default')]
+    indexes: List[DbIndex] = []  # indexes of the queries of the data access, see data/access/migration.py
 
-    def __init__(self, name: str, **kwargs):
+    # slot and default per column of a result row, the subclasses add their columns and those of the joins
+    row_slots: Dict[str, Tuple[str, Any]] = {
+        'ID': ('id', 0), 'UPDATED_ON': ('_updated_on', None), 'CREATED_ON': ('_created_on', None),
+        'DELETED': ('deleted', False)}
+    _row_layouts: Dict[Tuple, Tuple] = {}
+
+    def __init__(self, **kwargs):
         """
         Constructor
-        :param name: Name of the entity class related to the table name. Should be in upper letters and plural.
-        :param kwargs: Expect a data base result row as dictionary. ID, UPDATED_ON, CREATED_ON, STATE and DELETED
-            are linked to the class attributes id, updated_on, created_on, state and deleted. The columns
-            attribute of type List[DbColumns] is initialized with the columns UPDATED_ON, CREATED_ON, STATE and DELETED
+        :param kwargs: Expect a data base result row as dictionary, the columns of row_slots are linked to their
+            slots and a missing column takes the default. A missing UPDATED_ON or CREATED_ON is set to the current
+            time on first access
         """
-        self.name = name
-        self.id = int(kwargs.get('ID', 0))
-        self.updated_on = kwargs.get('UPDATED_ON', datetime.now())
-        self.created_on = kwargs.get('CREATED_ON', datetime.now())
-        self.deleted = kwargs.get('DELETED', False)
-        self.columns: List[DbColumn] = [
-            DbColumn('UPDATED_ON', 101, None, 'TIMESTAMP', 'default'),
-            DbColumn('CREATED_ON', 102, None, 'TIMESTAMP', 'default'),
-            DbColumn('DELETED', 103, None, 'INTEGER', 'default')]
+        for column, (slot, default) in self.row_slots.items():
+            setattr(self, slot, kwargs.get(column, default))
+        self.id = int(self.id)
+        self._convert()
+
+    def _convert(self):
+        """
+        Conversion of the values after the slots are filled, by the constructor or from_row()
+        """
+        pass
+
+    @classmethod
+    def row_layout(cls, keys: Tuple[str, ...]) -> Tuple[Tuple[str, Optional[int], Any], ...]:
+        """
+        Position of the value of each slot in the rows of a result, computed once per entity class and column names
+        :param keys: column names in upper letters, in the order of the values of a row
+        :return: slot, position in the row or None for a missing column, default
+        """
+        layout = EntityBase._row_layouts.get((cls, keys))
+        if layout is None:
+            positions = {key: position for position, key in enumerate(keys)}
+            layout = EntityBase._row_layouts[(cls, keys)] = tuple(
+                (slot, positions.get(column), default) for column, (slot, default) in cls.row_slots.items())
+        return layout
+
+    @classmethod
+    def from_row(cls, layout: Tuple[Tuple[str, Optional[int], Any], ...], row: Tuple) -> 'EntityBase':
+        """
+        Positional constructor, fills the slots straight from the tuple of a data base result
+        :param layout: see row_layout()
+        :param row: tuple of values
+        :return: entity of the row
+        """
+        entity = cls.__new__(cls)
+        for slot, position, default in layout:
+            setattr(entity, slot, default if position is None else row[position])
+        entity._convert()
+        return entity
+
+    @classmethod
+    def from_rows(cls, keys: Tuple[str, ...], rows: Iterable[Tuple]) -> List['EntityBase']:
+        """
+        Build entities from positional rows of a data base result
+        :param keys: column names in upper letters, in the order of the values of a row
+        :param rows: tuples of values
+        :return: one entity per row
+        """
+        layout = cls.row_layout(keys)
+        from_row = cls.from_row
+        return [from_row(layout, row) for row in rows]
+
+    @property
+    def updated_on(self) -> datetime:
+        if self._updated_on is None:
+            self._updated_on = datetime.now()
+        return self._updated_on
+
+    @updated_on.setter
+    def updated_on(self, value: datetime):
+        self._updated_on = value
+
+    @property
+    def created_on(self) -> datetime:
+        if self._created_on is None:
+            self._created_on = datetime.now()
+        return self._created_on
+
+    @created_on.setter
+    def created_on(self, value: datetime):
+        self._created_on = value
 
     @abstractmethod
     def to_dict(self) -> Dict:
@@ -100,16 +201,28 @@ class EntityBase(ABC):
         statement.append(');')
         return ''.join(statement)
 
+    @classmethod
+    def create_index_statements(cls) -> List[str]:
+        return [x.create_statement(cls.name) for x in cls.indexes]
+
     def create_insert_statement(self) -> str:
+        key = (type(self), 'INSERT')
+        sql = EntityBase._statements.get(key)
+        if sql is None:
+            sql = EntityBase._statements[key] = self._build_insert_statement()
+        return sql
+
+    def _build_insert_statement(self) -> str:
+        columns = sorted(self.columns, key=lambda x: x.index)
         sql: List[str] = [f'INSERT INTO {self.name} (']
-        for column in self.columns:
-            if column.default == '':
+        for column in columns:
+            if column.default == '' or column.inserted:
                 sql.append(column.name)
                 sql.append(', ')
         sql.pop()
         sql.append(') VALUES (')
-        for column in self.columns:
-            if column.default == '':
+        for column in columns:
+            if column.default == '' or column.inserted:
                 sql.append(':')
                 sql.append(column.name)
                 sql.append(', ')
@@ -117,7 +230,25 @@ class EntityBase(ABC):
         sql.append(');')
         return ''.join(sql)
 
+    @classmethod
+    def select_statement(cls, read_all: bool = True, by_state: bool = False, no_joins: bool = False) -> str:
+        """
+        Select statement of the entity class without an instance at hand, see create_select_statement()
+        """
+        key = (cls, 'SELECT', read_all, by_state, no_joins)
+        sql = EntityBase._statements.get(key)
+        if sql is None:
+            sql = cls().create_select_statement(read_all=read_all, by_state=by_state, no_joins=no_joins)
+        return sql
+
     def create_select_statement(self, read_all: bool = True, by_state: bool = False, no_joins: bool = False) -> str:
+        key = (type(self), 'SELECT', read_all, by_state, no_joins)
+        sql = EntityBase._statements.get(key)
+        if sql is None:
+            sql = EntityBase._statements[key] = self._build_select_statement(read_all, by_state, no_joins)
+        return sql
+
+    def _build_select_statement(self, read_all: bool, by_state: bool, no_joins: bool) -> str:
         sql: List[str] = [f"SELECT *, '{self.name}' name FROM "]
         if no_joins:
             join_list = []
@@ -141,9 +272,16 @@ class EntityBase(ABC):
         return ''.join(sql)
 
     def create_update_statement(self, **kwargs) -> str:
+        key = (type(self), 'UPDATE', frozenset(kwargs.keys()))
+        sql = EntityBase._statements.get(key)
+        if sql is None:
+            sql = EntityBase._statements[key] = self._build_update_statement(key[2])
+        return sql
+
+    def _build_update_statement(self, names: frozenset) -> str:
         sql: List[str] = [f'UPDATE {self.name} SET ']
-        for column in self.columns:
-            if column.name in kwargs.keys() and column.name not in {'ID', 'UPDATED_ON', 'CREATED_ON'}:
+        for column in sorted(self.columns, key=lambda x: x.index):
+            if column.name in names and column.name not in {'ID', 'UPDATED_ON', 'CREATED_ON'}:
                 sql.append(column.name)
                 sql.append('= :')
                 sql.append(column.name)
@@ -153,10 +291,11 @@ class EntityBase(ABC):
 
 
 class EntityBaseWithState(EntityBase):
-    def __init__(self, name: str, **kwargs):
-        super().__init__(name=name, **kwargs)
-        self.state = kwargs.get('STATE', State.New.code)
-        self.columns.append(DbColumn(name='STATE', index=99, fk=None, data_type='INTEGER', default=1))
+    __slots__ = ('state',)
+    columns: List[DbColumn] = EntityBase.columns + [
+        DbColumn(name='STATE', index=99, fk=None, data_type='INTEGER', default=1)]
+
+    row_slots = {**EntityBase.row_slots, 'STATE': ('state', State.New.code)}
 
     def to_dict(self):
         return {**{'STATE': self.state}, **super().to_dict()}
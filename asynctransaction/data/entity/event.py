@@ -4,16 +4,15 @@ from asynctransaction.data.entity.base import DbColumn, EntityBase
 
 
 class Event(EntityBase):
-    def __init__(self, **kwargs):
-        kwargs['name'] = 'EVENTS'
-        super().__init__(**kwargs)
-        self.url = kwargs.get('URL', '')
-        self.method = kwargs.get('METHOD', 'POST')
-        self.description = kwargs.get('DESCRIPTION', '')
-        self.columns.extend(
-            {DbColumn(name='URL', index=1),
-             DbColumn(name='METHOD', index=2, default='POST'),
-             DbColumn(name='DESCRIPTION', index=3, default='default')})
+    __slots__ = ('url', 'method', 'description')
+    name = 'EVENTS'
+    columns = EntityBase.columns + [
+        DbColumn(name='URL', index=1),
+        DbColumn(name='METHOD', index=2, default="'POST'"),
+        DbColumn(name='DESCRIPTION', index=3, default='default')]
+
+    row_slots = {**EntityBase.row_slots, 'URL': ('url', ''), 'METHOD': ('method', 'POST'),
+                 'DESCRIPTION': ('description', '')}
 
     def to_dict(self) -> Dict:
         return {**{'METHOD': self.method, 'URL': self.url, 'DESCRIPTION': self.description},
@@ -3,31 +3,43 @@ from urllib.parse import urlparse
 from typing import Dict
 import logging
 
-from asynctransaction.data.entity.base import EntityBase, DbColumn
+from asynctransaction.data.entity.base import EntityBase, DbColumn, DbIndex
 
 log = logging.getLogger('asynctransaction.data.entity.partner')
 
 
 class Partner(EntityBase):
     """Partner entity class for all partners in the transaction process."""
+    __slots__ = ('ip_address', 'port', 'description', 'format', 'batch_size')
+    name = 'PARTNERS'
+    columns = EntityBase.columns + [
+        DbColumn(name='IP_ADDRESS', index=1),
+        DbColumn(name='PORT', index=2, data_type='integer'),
+        DbColumn(name='DESCRIPTION', index=3),
+        DbColumn(name='FORMAT', index=4, default="'json'", inserted=True),
+        DbColumn(name='BATCH_SIZE', index=5, data_type='integer', default='default', inserted=True)]
+    indexes = [DbIndex('PARTNER_ADDRESS', ('IP_ADDRESS', 'PORT'))]  # lookup of a partner by its address
+
+    row_slots = {**EntityBase.row_slots, 'IP_ADDRESS': ('ip_address', '127.0.0.1'), 'PORT': ('port', '80'),
+                 'DESCRIPTION': ('description', ''),
+                 'FORMAT': ('format', None),  # codec of the deliveries to the partner
+                 'BATCH_SIZE': ('batch_size', None)}  # steps per delivery, 0 delivers them one by one
 
     def __init__(self, **kwargs):
-        kwargs['name'] = 'PARTNERS'
         super().__init__(**kwargs)
         if 'netloc' in kwargs:
             self.ip_address, self.port = self.parse_ip_port(kwargs['netloc'].replace('localhost', '127.0.0.1'))
-        else:
-            try:
-                self.ip_address = ip_address(kwargs.get('IP_ADDRESS', '127.0.0.1').replace('localhost', '127.0.0.1'))
-            except ValueError:
-                log.error(f"No valid ip address at {kwargs.get('IP_ADDRESS','')}")
-                self.ip_address = ip_address('127.0.0.1')
-            self.port = kwargs.get('PORT', '80')
-        self.description = kwargs.get('DESCRIPTION', '')
-        self.columns.extend(
-            {DbColumn(name='IP_ADDRESS', index=1),
-             DbColumn(name='PORT', index=2, data_type='integer'),
-             DbColumn(name='DESCRIPTION', index=3)})
+
+    def _convert(self):
+        try:
+            self.ip_address = ip_address(self.ip_address.replace('localhost', '127.0.0.1'))
+        except ValueError:
+            log.error(f"No valid ip address at {self.ip_address}")
+            self.ip_address = ip_address('127.0.0.1')
+        self.format = self.format or 'json'
+        self.batch_size = int(self.batch_size or 0)
+        if self.batch_size < 0:
+            raise ValueError(f"batch size {self.batch_size} is less than 0")
 
     def is_local(self) -> bool:
         return self.ip_address.is_loopback
@@ -44,5 +56,7 @@ class Partner(EntityBase):
         return ip, s_port
 
     def to_dict(self) -> Dict:
-        return {**{'IP_ADDRESS': str(self.ip_address), 'PORT': self.port, 'DESCRIPTION': self.description},
+        return {**{'IP_ADDRESS': str(self.ip_address), 'PORT': self.port, 'DESCRIPTION': self.description,
+                   'FORMAT': self.format,
+                   'BATCH_SIZE': self.batch_size},
                 **super().to_dict()}
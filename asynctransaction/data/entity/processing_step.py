@@ -1,46 +1,41 @@
 from typing import Dict
-import json
 
-from asynctransaction.data.entity.base import DbColumn, EntityBaseWithState
+from asynctransaction.data.entity.base import DbColumn, DbIndex, EntityBaseWithState
 
 
 class ProcessingStep(EntityBaseWithState):
     """
     Entity class for a processing of a transaction
     """
-
-    def __init__(self, **kwargs):
-        kwargs['name'] = 'PROCESSING_STEPS'
-        super().__init__(**kwargs)
-        self.task_id = kwargs.get('TASK_ID', 0)
-        self.partner_id = kwargs.get('PARTNER_ID', 0)
-        self.local_id = kwargs.get('LOCAL_ID', 0)
-        self.partner_id = kwargs.get('PARTNER_ID', 0)
-        self.event_id = kwargs.get('EVENT_ID', 0)
-        self.data = kwargs.get('DATA', json.dumps({}))
-        self.ip_address = kwargs.get('IP_ADDRESS', 'localhost')
-        self.port = kwargs.get('PORT', '80')
-        self.description = kwargs.get('DESCRIPTION', '')
-        self.columns.extend(
-            {DbColumn(name='TASK_ID', index=1, fk='TASKS(ID)', data_type='integer'),
-             DbColumn(name='PARTNER_ID', index=2, fk='PARTNERS(ID)', data_type='integer')})
-
-        self._method = 'POST'
-        self._url = 'orders'
-
-    @property
-    def method(self):
-        #  todo: get from the event cache
-        return self._method
-
-    @property
-    def url(self):
-        #  todo: get from the event cache
-        return self._url
+    __slots__ = ('task_id', 'partner_id', 'attempts', 'next_attempt_at', 'local_id', 'event_id', 'data', 'ip_address',
+                 'port', 'description', 'format', 'batch_size', 'method', 'url')
+    name = 'PROCESSING_STEPS'
+    columns = EntityBaseWithState.columns + [
+        DbColumn(name='TASK_ID', index=1, fk='TASKS(ID)', data_type='integer'),
+        DbColumn(name='PARTNER_ID', index=2, fk='PARTNERS(ID)', data_type='integer'),
+        DbColumn(name='ATTEMPTS', index=3, data_type='integer', default='default'),
+        DbColumn(name='NEXT_ATTEMPT_AT', index=4, data_type='timestamp', default='default')]
+    indexes = [
+        DbIndex('PROCESS_STATUS_FK', ('STATE',)),
+        DbIndex('PROCESS_PARTNER_FK', ('PARTNER_ID',)),
+        DbIndex('PROCESS_TASK_FK', ('TASK_ID',)),  # steps of a task, spread and archiver
+        DbIndex('PROCESS_DUE', ('STATE', 'NEXT_ATTEMPT_AT'))]  # due steps in the order of their next attempt
+
+    row_slots = {
+        **EntityBaseWithState.row_slots, 'TASK_ID': ('task_id', 0),
+        'ATTEMPTS': ('attempts', 0),  # failed deliveries so far
+        'NEXT_ATTEMPT_AT': ('next_attempt_at', None),  # not before this time, None means now
+        'LOCAL_ID': ('local_id', 0), 'PARTNER_ID': ('partner_id', 0), 'EVENT_ID': ('event_id', 0),
+        'DATA': ('data', '{}'), 'IP_ADDRESS': ('ip_address', 'localhost'), 'PORT': ('port', '80'),
+        'DESCRIPTION': ('description', ''), 'FORMAT': ('format', 'json'), 'BATCH_SIZE': ('batch_size', 0),
+        # data of the event, completed from the registry of the data access layer
+        'METHOD': ('method', 'POST'), 'URL': ('url', 'orders')}
 
     def to_dict(self) -> Dict:
         return {**{'TASK_ID': self.task_id,
                    'PARTNER_ID': self.partner_id,
+                   'ATTEMPTS': self.attempts,
+                   'NEXT_ATTEMPT_AT': self.next_attempt_at,
                    'LOCAL_ID': self.local_id,
                    'EVENT_ID': self.event_id,
                    'DATA': self.data,
@@ -9,12 +9,15 @@ class State(Enum):
     BadRequestDBError = (400, 'data base error', '')
     RequestReceived = (200, 'received', '')
     RequestStored = (201, 'stored', '')
+    RequestReplayed = (201, 'stored before with the same idempotency key', '')
     ConflictRequest = (409, 'already stored', '')
+    UnsupportedMediaType = (415, 'content type is not supported', '')
     New = (1, 'new', '')
     InProgress = (2, 'in progress', '')
     Published = (3, 'published', '')
     Processed = (4, 'processed', '')
     Error = (5, 'error', '')
+    DeadLetter = (6, 'given up after too many attempts', '')
 
     def __init__(self, code, message, detail):
         self._code = code
@@ -1,22 +1,21 @@
 from typing import Dict
 
-from asynctransaction.data.entity.base import DbColumn, EntityBase
+from asynctransaction.data.entity.base import DbColumn, DbIndex, EntityBase
 
 
 class Subscriber(EntityBase):
-    def __init__(self, **kwargs):
-        kwargs['name'] = 'SUBSCRIBERS'
-        super().__init__(**kwargs)
-        self.event_id = kwargs.get('EVENT_ID', 0)
-        self.partner_id = kwargs.get('PARTNER_ID', 0)
-        self.url = kwargs.get('URL', '')
-        self.method = kwargs.get('METHOD', 'POST')
-        self.description = kwargs.get('DESCRIPTION', '')
-        self.ip_address = kwargs.get('IP_ADDRESS', '')
-        self.port = kwargs.get('PORT', 0)
-        self.columns.extend(
-            {DbColumn(name='EVENT_ID', index=1, data_type='INTEGER', fk='EVENTS(ID)'),
-             DbColumn(name='PARTNER_ID', index=2, data_type='INTEGER', fk='PARTNERS(ID)')})
+    __slots__ = ('event_id', 'partner_id', 'url', 'method', 'description', 'ip_address', 'port')
+    name = 'SUBSCRIBERS'
+    columns = EntityBase.columns + [
+        DbColumn(name='EVENT_ID', index=1, data_type='INTEGER', fk='EVENTS(ID)'),
+        DbColumn(name='PARTNER_ID', index=2, data_type='INTEGER', fk='PARTNERS(ID)')]
+    indexes = [
+        DbIndex('SUBSCRIBER_EVENT_FK', ('EVENT_ID',)),
+        DbIndex('SUBSCRIBER_PARTNER_FK', ('PARTNER_ID',))]
+
+    row_slots = {**EntityBase.row_slots, 'EVENT_ID': ('event_id', 0), 'PARTNER_ID': ('partner_id', 0),
+                 'URL': ('url', ''), 'METHOD': ('method', 'POST'), 'DESCRIPTION': ('description', ''),
+                 'IP_ADDRESS': ('ip_address', ''), 'PORT': ('port', 0)}
 
     def to_dict(self) -> Dict:
         return {**{'EVENT_ID': self.event_id, 'PARTNER_ID': self.partner_id,
@@ -1,7 +1,7 @@
 from typing import Dict
-import json
 
-from asynctransaction.data.entity.base import DbColumn, EntityBaseWithState
+from asynctransaction.data.entity.base import DbColumn, DbIndex, EntityBaseWithState
+from asynctransaction.data.codec import JSON
 
 
 class TaskException(Exception):
@@ -10,36 +10,44 @@ class TaskException(Exception):
 
 
 class Task(EntityBaseWithState):
-    def __init__(self, **kwargs):
-        kwargs['name'] = 'TASKS'
-        super().__init__(**kwargs)
-        self.local_id = kwargs.get('LOCAL_ID', 0)
-        self.partner_id = kwargs.get('PARTNER_ID', 0)
-        self.event_id = kwargs.get('EVENT_ID', 0)
-        self.data = kwargs.get('DATA', json.dumps({}))
+    __slots__ = ('local_id', 'partner_id', 'event_id', 'data', 'idempotency_key', 'url', 'method', 'description',
+                 'ip_address', 'port')
+    name = 'TASKS'
+    columns = EntityBaseWithState.columns + [
+        DbColumn(name='LOCAL_ID', index=1, data_type='integer'),
+        DbColumn(name='PARTNER_ID', fk='PARTNERS(ID)', index=2, data_type='integer'),
+        DbColumn(name='EVENT_ID', fk='EVENTS(ID)', index=3, data_type='integer'),
+        DbColumn(name='DATA', index=4),
+        DbColumn(name='IDEMPOTENCY_KEY', index=5)]
+    indexes = [
+        DbIndex('TASK_EVENT_FK', ('EVENT_ID',)),
+        DbIndex('TASK_PARTNER_FK', ('PARTNER_ID',)),
+        DbIndex('TASK_LOCAL_KEY', ('EVENT_ID', 'PARTNER_ID', 'LOCAL_ID')),  # duplicate check
+        DbIndex('TASK_IDEMPOTENCY_KEY', ('IDEMPOTENCY_KEY',), unique=True),  # replay and its upsert
+        DbIndex('TASK_STATE', ('STATE',))]  # read_tasks, iter_by_state, spread and count_by_state
+
+    row_slots = {
+        **EntityBaseWithState.row_slots, 'LOCAL_ID': ('local_id', 0), 'PARTNER_ID': ('partner_id', 0),
+        'EVENT_ID': ('event_id', 0), 'DATA': ('data', '{}'), 'IDEMPOTENCY_KEY': ('idempotency_key', None),
+        # data from join
+        'URL': ('url', ''), 'METHOD': ('method', 'POST'), 'DESCRIPTION': ('description', ''),
+        'IP_ADDRESS': ('ip_address', ''), 'PORT': ('port', 0)}
+
+    def _convert(self):
         if self.local_id == 0:
             try:
-                data_dict = json.loads(self.data)
+                data_dict = JSON.loads(self.data)
                 if 'ID' in data_dict:
                     self.local_id = data_dict['ID']
-            except json.JSONDecodeError:
+            except ValueError:
                 raise TaskException
-                # data from join
-        self.url = kwargs.get('URL', '')
-        self.method = kwargs.get('METHOD', 'POST')
-        self.description = kwargs.get('DESCRIPTION', '')
-        self.ip_address = kwargs.get('IP_ADDRESS', '')
-        self.port = kwargs.get('PORT', 0)
-        self.columns.extend({DbColumn(name='LOCAL_ID', index=1, data_type='integer'),
-                             DbColumn(name='PARTNER_ID', fk='PARTNERS(ID)', index=2, data_type='integer'),
-                             DbColumn(name='EVENT_ID', fk='EVENTS(ID)', index=3, data_type='integer'),
-                             DbColumn(name='DATA', index=4)})
 
     def to_dict(self) -> Dict:
         return {**{'LOCAL_ID': self.local_id,
                    'PARTNER_ID': self.partner_id,
                    'EVENT_ID': self.event_id,
                    'DATA': self.data,
+                   'IDEMPOTENCY_KEY': self.idempotency_key,
                    'URL': self.url,
                    'METHOD': self.method,
                    'DESCRIPTION': self.description,
@@ -1,8 +1,8 @@
 CREATE TABLE EVENTS (
     ID integer primary key,
     URL text,
-    METHOD text,
-    DESCRIPTION text,
+    METHOD text DEFAULT('POST'),
+    DESCRIPTION text DEFAULT(''),
     CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     DELETED integer default(0)
@@ -13,11 +13,15 @@ CREATE TABLE PARTNERS (
     IP_ADDRESS TEXT,
     PORT integer,
     DESCRIPTION text,
+    FORMAT TEXT DEFAULT('json'),
+    BATCH_SIZE integer DEFAULT(0),
     CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     DELETED integer default(0)
 );
 
+CREATE INDEX PARTNER_ADDRESS ON PARTNERS(IP_ADDRESS, PORT);
+
 CREATE TABLE SUBSCRIBERS (
     ID integer primary key,
     EVENT_ID integer,
@@ -38,6 +42,7 @@ CREATE TABLE TASKS (
     PARTNER_ID integer,
     EVENT_ID integer,
     DATA TEXT,
+    IDEMPOTENCY_KEY TEXT,
     STATE INTEGER DEFAULT(1),
     CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
@@ -48,11 +53,16 @@ CREATE TABLE TASKS (
 
 CREATE INDEX TASK_EVENT_FK ON TASKS(EVENT_ID);
 CREATE INDEX TASK_PARTNER_FK ON TASKS(PARTNER_ID);
+CREATE INDEX TASK_LOCAL_KEY ON TASKS(EVENT_ID, PARTNER_ID, LOCAL_ID);
+CREATE UNIQUE INDEX TASK_IDEMPOTENCY_KEY ON TASKS(IDEMPOTENCY_KEY);
+CREATE INDEX TASK_STATE ON TASKS(STATE);
 
 CREATE TABLE PROCESSING_STEPS (
     ID integer primary key,
     TASK_ID integer,
     PARTNER_ID integer,
+    ATTEMPTS integer DEFAULT(0),
+    NEXT_ATTEMPT_AT TIMESTAMP DEFAULT(datetime('now','localtime')),
     STATE INTEGER DEFAULT(1),
     CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
@@ -63,3 +73,8 @@ CREATE TABLE PROCESSING_STEPS (
 
 CREATE INDEX PROCESS_STATUS_FK ON PROCESSING_STEPS(STATE);
 CREATE INDEX PROCESS_PARTNER_FK ON PROCESSING_STEPS(PARTNER_ID);
+CREATE INDEX PROCESS_TASK_FK ON PROCESSING_STEPS(TASK_ID);
+CREATE INDEX PROCESS_DUE ON PROCESSING_STEPS(STATE, NEXT_ATTEMPT_AT);
+
+-- the version of asynctransaction/data/access/migration.py this schema corresponds to
+PRAGMA user_version = 7;
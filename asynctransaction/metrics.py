@@ -0,0 +1,177 @@
+"""
+In process metrics in the Prometheus text format. Counters and histograms with fixed buckets are kept in memory,
+an observation is a dictionary lookup, a bisect and two additions. The distributor shows them at /admin/metrics.
+
+Example::
+
+    STAGE_SECONDS.observe(0.0012, 'ingest')
+    with STAGE_SECONDS.time('spread'):
+        ...
+
+"""
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+# upper bounds in seconds, from half a millisecond to ten seconds
+BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ''
+    escaped = (str(x).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for x in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _by_labels(item: Tuple) -> Tuple[str, ...]:
+    # label values may be numbers or strings, they are shown in the order of their text
+    return tuple(str(x) for x in item[0])
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter(object):
+    """
+    Monotonic counter, one value per combination of label values
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._values.items(), key=_by_labels):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {_number(value)}')
+        return lines
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets, one per combination of label values. Observations may come from any thread.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # label values -> [count per bucket + 1 for +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[label_values] = series
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *label_values) -> '_Timer':
+        """
+        Context manager observing the seconds of its block
+        """
+        return _Timer(self, label_values)
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return 0 if series is None else sum(series[0])
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        names = self.label_names + ('le',)
+        for label_values, (counts, total) in sorted(self._series.items(), key=_by_labels):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_labels(names, label_values + (le,))} {cumulative}')
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {repr(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram: Histogram, label_values: Tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+def render_gauge(name: str, documentation: str, label_names: Tuple[str, ...], values: Dict[Tuple, float]) -> List[str]:
+    """
+    Lines of a gauge whose values are computed at the time of the scrape, e.g. queue depths
+    """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+    for label_values, value in sorted(values.items(), key=_by_labels):
+        lines.append(f'{name}{_labels(label_names, label_values)} {_number(value)}')
+    return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(name, lambda: Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> List[str]:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return lines
+
+    def _register(self, name: str, create: Callable):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = create()
+            self._metrics[name] = metric
+        return metric
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'asynctransaction_stage_seconds', 'Seconds per pipeline stage: ingest, ingest_batch, duplicate_check, store, spread',
+    ('stage',))
+DELIVERY_SECONDS = REGISTRY.histogram(
+    'asynctransaction_delivery_seconds', 'Seconds per delivery request to a partner, a batch counts once',
+    ('partner',))
+DELIVERIES = REGISTRY.counter(
+    'asynctransaction_deliveries_total', 'Delivered processing steps per partner and result', ('partner', 'result'))
+DB_EXECUTE_SECONDS = REGISTRY.histogram(
+    'asynctransaction_db_execute_seconds', 'Seconds a data base call runs on its thread, without waiting for it',
+    ('function',))
+TASKS = REGISTRY.counter('asynctransaction_tasks_total', 'Received tasks per result', ('result',))
+ARCHIVED = REGISTRY.counter('asynctransaction_archived_total', 'Finished rows archived or deleted per table',
+                            ('table',))
@@ -1,8 +1,11 @@
 import logging
 
 from aiohttp import web
+from asynctransaction.data import codec
 from asynctransaction.server.distributor import logger_middleware
 
+log = logging.getLogger('asynctransaction.server.client')
+
 
 class Client(web.View):
     async def post(self) -> web.Response:
@@ -13,9 +16,38 @@ class Client(web.View):
         return await self.post()
 
 
+class ClientBatch(web.View):
+    """
+    Reference of the batch route of a partner with a BATCH_SIZE. The body is an array of the data of the
+    processing steps, json or msgpack by its Content-Type. The answer lists the status per item in the same order::
+
+        [{"STATUS": 201}, {"STATUS": 400}]
+
+    """
+
+    async def post(self) -> web.Response:
+        payload_codec = codec.by_content_type(self.request.content_type)
+        if payload_codec is None:
+            return web.Response(text=self.request.content_type, status=415)
+        try:
+            items = payload_codec.loads(await self.request.read())
+        except ValueError:
+            return web.HTTPBadRequest()
+        if isinstance(items, list) is False:
+            return web.HTTPBadRequest()
+        log.info(f"{self.request.method} of {len(items)} items")
+        statuses = [{'STATUS': 201 if isinstance(x, dict) and 'ID' in x else 400} for x in items]
+        status = 200 if all(x['STATUS'] == 201 for x in statuses) else 207
+        answer_codec = codec.by_accept(self.request.headers.get('Accept'))
+        return web.Response(body=answer_codec.dumps(statuses), status=status, content_type=answer_codec.content_type)
+
+    async def put(self) -> web.Response:
+        return await self.post()
+
+
 if __name__ == '__main__':
-    log = logging.getLogger('asynctransaction.server.client')
     app = web.Application()
     app.middlewares.append(logger_middleware)
     app.router.add_route('*', '/transactions/{name}', Client)
+    app.router.add_route('*', '/transactions/{name}/batch', ClientBatch)
     web.run_app(app=app, port=3030)
@@ -0,0 +1,281 @@
+import sqlite3
+import asyncio
+import logging
+from collections import Counter
+from configparser import ConfigParser
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from asynctransaction.data.access.factory import create_transaction
+from asynctransaction.data.access.state_buffer import StateBuffer
+from asynctransaction.data.access.retry import RetryPolicy
+from asynctransaction.data.access.circuit_breaker import CircuitBreakers
+from asynctransaction.data.entity import ProcessingStep, State
+from asynctransaction.metrics import DELIVERY_SECONDS, DELIVERIES
+from asynctransaction.tracing import Tracer
+
+log = logging.getLogger('asynctransaction.server.delivery')
+
+
+class DeliveryEngine(object):
+    """
+    Delivers processing steps concurrently. At most max_in_flight deliveries run at the same time and at most
+    max_per_partner of them for one partner, so a slow partner only uses up its own slots. submit() never waits,
+    the results are collected when a delivery is done. The new states of the steps are written by a StateBuffer.
+    Steps of a partner whose circuit is open are not delivered and stay untouched in the data base.
+
+    The steps of a partner with a BATCH_SIZE are collected per event and delivered together with one request as
+    soon as BATCH_SIZE steps or batch_max_bytes of data are collected, at the latest batch_linger seconds after the
+    first step. A batch counts as one delivery for the limits.
+    """
+
+    def __init__(self, con: sqlite3.Connection, max_in_flight: int = 50, max_per_partner: int = 4,
+                 max_queued_per_partner: int = 0, flush_items: int = 500, flush_delay: float = 0.05,
+                 retry_policy: RetryPolicy = None, circuit_breakers: CircuitBreakers = None,
+                 batch_max_bytes: int = 1 << 20, batch_linger: float = 0.02, tracer: Tracer = None):
+        """
+        Constructor of DeliveryEngine
+        :param con: Connection of the data base the processing steps belong to
+        :param max_in_flight: Optional: Maximal number of concurrent deliveries. Default is 50 [int]
+        :param max_per_partner: Optional: Maximal number of concurrent deliveries per partner. Default is 4 [int]
+        :param max_queued_per_partner: Optional: Maximal number of submitted, not finished deliveries per partner.
+            More steps are left in the data base for a later pass, for a partner with a BATCH_SIZE this many
+            batches. Default 0 means ten times max_per_partner [int]
+        :param flush_items: Optional: Number of results which are written together. Default is 500 [int]
+        :param flush_delay: Optional: Maximal seconds until a result is written. Default is 0.05 [float]
+        :param retry_policy: Optional: Backoff of failed deliveries. Default is RetryPolicy() [RetryPolicy]
+        :param circuit_breakers: Optional: Circuits of the partners. Default is CircuitBreakers() [CircuitBreakers]
+        :param batch_max_bytes: Optional: Data of the steps which fill a batch. Default is 1 MB [int]
+        :param batch_linger: Optional: Maximal seconds a step waits for its batch to fill. Default is 0.02 [float]
+        :param tracer: Optional: Tracer of the ingest, a step of a traced task is delivered with its trace id.
+            Default None traces nothing [Tracer]
+        """
+        self.state_buffer = StateBuffer(con.executor, max_items=flush_items, max_delay=flush_delay)
+        self.circuit_breakers = CircuitBreakers() if circuit_breakers is None else circuit_breakers
+        self.transaction = create_transaction(con, state_buffer=self.state_buffer, retry_policy=retry_policy,
+                                              circuit_breakers=self.circuit_breakers, tracer=tracer)
+        self.max_in_flight = max_in_flight
+        self.max_per_partner = max_per_partner
+        self.max_queued_per_partner = max_queued_per_partner or 10 * max_per_partner
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._partner_slots: Dict[int, asyncio.Semaphore] = {}
+        self._queued: Counter = Counter()
+        self._steps: Set[int] = set()
+        self._finished: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.results: Counter = Counter()
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_linger = batch_linger
+        self._batches: Dict[Tuple[int, int], _Batch] = {}
+        self.batches = 0
+
+    async def begin_pass(self):
+        """
+        Call before the processing steps are read. A step finishing between the read and its submit would be
+        delivered twice otherwise, the buffered states of the steps finished so far are written.
+        """
+        self._finished.clear()
+        await self.state_buffer.flush()
+
+    def submit(self, step: ProcessingStep, client: aiohttp.ClientSession) -> bool:
+        """
+        Schedule the delivery of a processing step
+        :return: False if the step is already on its way, finished during this pass, the circuit of its partner is
+            open or the queue of its partner is full
+        """
+        if step.id in self._steps or step.id in self._finished:
+            return False
+        if self.circuit_breakers.blocks(step.partner_id):
+            self.results['CircuitOpen'] += 1
+            return False
+        if self._queued[step.partner_id] >= self.max_queued_per_partner * max(1, step.batch_size):
+            return False
+        self._steps.add(step.id)
+        self._queued[step.partner_id] += 1
+        if step.batch_size > 1:
+            self._add_to_batch(step, client)
+            return True
+        task = asyncio.ensure_future(self._deliver(step, client))
+        self._tasks.add(task)
+        task.add_done_callback(lambda x: self._done([step], x))
+        return True
+
+    def _add_to_batch(self, step: ProcessingStep, client: aiohttp.ClientSession):
+        key = (step.partner_id, step.event_id)
+        size = len(step.data or '')
+        batch = self._batches.get(key)
+        if batch is not None and batch.size + size > self.batch_max_bytes:
+            self._send_batch(key)
+            batch = None
+        if batch is None:
+            batch = _Batch(client)
+            batch.timer = asyncio.get_event_loop().call_later(self.batch_linger, self._send_batch, key)
+            self._batches[key] = batch
+        batch.steps.append(step)
+        batch.size += size
+        if len(batch.steps) >= step.batch_size or batch.size >= self.batch_max_bytes:
+            self._send_batch(key)
+
+    def _send_batch(self, key: Tuple[int, int]):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        self.batches += 1
+        task = asyncio.ensure_future(self._deliver_batch(batch.steps, batch.client))
+        self._tasks.add(task)
+        task.add_done_callback(lambda x: self._done(batch.steps, x))
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> Dict:
+        return {'pending': self.pending, 'queued_per_partner': dict(self._queued), 'results': dict(self.results),
+                'batches': self.batches, 'states': self.state_buffer.stats(),
+                'circuits': self.circuit_breakers.to_dict()}
+
+    async def join(self):
+        """
+        Wait until all submitted deliveries are done, batches are sent without waiting for more steps
+        """
+        while self._tasks or self._batches:
+            for key in list(self._batches):
+                self._send_batch(key)
+            await asyncio.wait(set(self._tasks))
+        await self.state_buffer.flush()
+
+    async def close(self):
+        """
+        Cancel the running deliveries, their steps stay in progress and are picked up after a restart. The steps
+        of unsent batches stay untouched.
+        """
+        for batch in self._batches.values():
+            batch.timer.cancel()
+            self._done(batch.steps, None)
+        self._batches.clear()
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+        await self.state_buffer.close()
+
+    def _slots(self, partner_id: int) -> asyncio.Semaphore:
+        slots = self._partner_slots.get(partner_id)
+        if slots is None:
+            slots = asyncio.Semaphore(self.max_per_partner)
+            self._partner_slots[partner_id] = slots
+        return slots
+
+    async def _deliver(self, step: ProcessingStep, client: aiohttp.ClientSession) -> Optional[State]:
+        async with self._slots(step.partner_id):
+            # the circuit may have opened while the step waited, a half open one lets only the first step through
+            if self.circuit_breakers.allow(step.partner_id) is False:
+                return None
+            async with self._in_flight:
+                with DELIVERY_SECONDS.time(str(step.partner_id)):
+                    return await self.transaction.process(step, client)
+
+    async def _deliver_batch(self, steps: List[ProcessingStep], client: aiohttp.ClientSession) -> Optional[List]:
+        async with self._slots(steps[0].partner_id):
+            if self.circuit_breakers.allow(steps[0].partner_id) is False:
+                return None
+            async with self._in_flight:
+                with DELIVERY_SECONDS.time(str(steps[0].partner_id)):
+                    return await self.transaction.process_batch(steps, client)
+
+    def _done(self, steps: List[ProcessingStep], task: Optional[asyncio.Task]):
+        self._tasks.discard(task)
+        for step in steps:
+            self._steps.discard(step.id)
+            self._finished.add(step.id)
+            self._queued[step.partner_id] -= 1
+            if self._queued[step.partner_id] <= 0:
+                del self._queued[step.partner_id]
+        if task is None or task.cancelled():
+            return
+        partner = str(steps[0].partner_id)
+        if task.exception() is not None:
+            log.error(f"delivery of steps {[x.id for x in steps]} failed: {task.exception()}")
+            self.results['Exception'] += len(steps)
+            DELIVERIES.inc(partner, 'Exception', amount=len(steps))
+            return
+        if task.result() is None:
+            self.results['CircuitOpen'] += len(steps)
+            DELIVERIES.inc(partner, 'CircuitOpen', amount=len(steps))
+            return
+        results = task.result() if isinstance(task.result(), list) else [task.result()]
+        for step, result in zip(steps, results):
+            self.results[result.name] += 1
+            DELIVERIES.inc(partner, result.name)
+            log.info(f"step {step.id} to partner {step.partner_id}: {result}")
+
+
+class _Batch(object):
+    __slots__ = ('client', 'steps', 'size', 'timer')
+
+    def __init__(self, client: aiohttp.ClientSession):
+        self.client = client
+        self.steps: List[ProcessingStep] = []
+        self.size = 0
+        self.timer: asyncio.TimerHandle = None
+
+
+class ConnectionStats(object):
+    """
+    Counts new and reused connections and dns cache hits of a client session via aiohttp tracing
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_created)
+        trace_config.on_connection_reuseconn.append(self._on_reused)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+        return trace_config
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.created + self.reused
+        return self.reused / total if total > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {'created': self.created, 'reused': self.reused, 'reuse_ratio': round(self.reuse_ratio, 3),
+                'dns_cache_hits': self.dns_cache_hits, 'dns_cache_misses': self.dns_cache_misses}
+
+    async def _on_created(self, session, context, params):
+        self.created += 1
+
+    async def _on_reused(self, session, context, params):
+        self.reused += 1
+
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_cache_hits += 1
+
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.dns_cache_misses += 1
+
+
+def create_client_session(config: ConfigParser, stats: ConnectionStats = None) -> aiohttp.ClientSession:
+    """
+    Create the session all deliveries share, so connections to the partners are kept alive between the passes.
+    The connector is set up by the optional [CLIENT] section of the config file.
+    :param config: config of the distributor
+    :param stats: Optional: connection statistics to be filled by the session
+    :return: the session, to be closed by the caller
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.getint('CLIENT', 'limit', fallback=100),
+        limit_per_host=config.getint('CLIENT', 'limit_per_host', fallback=8),
+        keepalive_timeout=config.getfloat('CLIENT', 'keepalive_timeout', fallback=30.0),
+        ttl_dns_cache=config.getint('CLIENT', 'ttl_dns_cache', fallback=300))
+    timeout = aiohttp.ClientTimeout(connect=config.getfloat('CLIENT', 'connect_timeout', fallback=1.0))
+    trace_configs = [] if stats is None else [stats.trace_config()]
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs)
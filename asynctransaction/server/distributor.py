@@ -45,7 +45,15 @@ import aiohttp_jinja2
 from jinja2 import FileSystemLoader
 
 from asynctransaction.data.access.factory import *
-from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data import codec
+from asynctransaction.data.access.base import prepare_connection, profile_pragmas, PRAGMAS
+from asynctransaction.data.access.retry import RetryPolicy
+from asynctransaction.data.access.circuit_breaker import CircuitBreakers, OPEN, HALF_OPEN
+from asynctransaction.data.access.archiver import Archiver
+from asynctransaction.data.access.migration import upgrade
+from asynctransaction.server.delivery import DeliveryEngine, ConnectionStats, create_client_session
+from asynctransaction import metrics
+from asynctransaction.tracing import Tracer, TRACE_HEADER, DISABLED
 
 __version__ = '0.5.0'
 CONFIG_FILE_NAME: str = 'likemc.ini'
@@ -119,6 +127,8 @@ class PartnerAdmin(web.View):
             '127.0.0.1', 'PORT': '20', 'DESCRIPTION': 'CLIENT SERVER'} ->
             200, {'ID': 1, 'PORT': 20}
 
+    The page shows the circuit of the partner as well, e.g. {'STATE': 'open', 'FAILURES': 5, 'OPENED': 1,
+    'PROBE_IN': 12.5}.
     """
 
     @aiohttp_jinja2.template('admin.html')
@@ -135,7 +145,7 @@ class PartnerAdmin(web.View):
         except IndexError:
             raise web.HTTPBadRequest()
         log.debug(data.to_dict())
-        return data.to_dict()
+        return self._with_circuit(data.to_dict())
 
     @aiohttp_jinja2.template('admin.html')
     async def post(self) -> Dict:
@@ -144,7 +154,10 @@ class PartnerAdmin(web.View):
         partner_access = create_partner_access(con=self.request.app['DISTRIBUTOR_DB'])
         try:
             partner = await partner_access.change_partner_data(**multi_data)
-            return partner.to_dict()
+            return self._with_circuit(partner.to_dict())
+        except ValueError as error:  # BATCH_SIZE is no integer >= 0
+            log.warning(error)
+            raise web.HTTPBadRequest()
         except sqlite3.DatabaseError as error:
             log.error(error)
             raise web.HTTPException()
@@ -153,25 +166,118 @@ class PartnerAdmin(web.View):
     async def put(self) -> Dict:
         return await self.post()
 
+    def _with_circuit(self, partner: Dict) -> Dict:
+        delivery: DeliveryEngine = self.request.app.get('DISTRIBUTOR_DELIVERY')
+        if delivery is not None:
+            partner['CIRCUIT'] = delivery.circuit_breakers.get(partner['ID']).to_dict()
+        return partner
+
+
+class Metrics(web.View):
+    """
+    Metrics in the Prometheus text format::
+
+        "GET", "/admin/metrics" ->
+            200, asynctransaction_stage_seconds_bucket{stage="ingest",le="0.001"} 12 ...
+
+    Besides the counters and histograms of asynctransaction.metrics the queue depths per table in the states new
+    and in progress, the deliveries on their way, the pending data base calls and the open circuits are shown.
+    """
+    # the finished rows are left out, counting them would read the whole history at every scrape
+    QUEUE_STATES = (State.New.code, State.InProgress.code)
+
+    async def get(self) -> web.Response:
+        app = self.request.app
+        lines = metrics.REGISTRY.render()
+        depths = {}
+        for access in (create_task_access(app['DISTRIBUTOR_DB']), create_processing_step_access(app['DISTRIBUTOR_DB'])):
+            counts = await access.count_by_state(self.QUEUE_STATES)
+            for state in self.QUEUE_STATES:
+                depths[(access.name, state)] = counts.get(state, 0)
+        lines.extend(metrics.render_gauge('asynctransaction_queue_depth',
+                                          'Rows per table in the states new and in progress', ('table', 'state'),
+                                          depths))
+        lines.extend(metrics.render_gauge('asynctransaction_db_pending', 'Data base calls queued or running', (),
+                                          {(): app['DISTRIBUTOR_DB'].executor.pending}))
+        delivery: DeliveryEngine = app.get('DISTRIBUTOR_DELIVERY')
+        if delivery is not None:
+            lines.extend(metrics.render_gauge('asynctransaction_delivery_pending', 'Deliveries on their way', (),
+                                              {(): delivery.pending}))
+            lines.extend(metrics.render_gauge('asynctransaction_state_buffer_pending', 'States not written yet', (),
+                                              {(): delivery.state_buffer.pending}))
+            circuits = {(str(x), y['STATE']): 1 for x, y in delivery.circuit_breakers.to_dict().items()
+                        if y['STATE'] in {OPEN, HALF_OPEN}}
+            lines.extend(metrics.render_gauge('asynctransaction_circuit_open', 'Partners with an open circuit',
+                                              ('partner', 'state'), circuits))
+        return web.Response(body='\n'.join(lines + ['']).encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+class Traces(web.View):
+    """
+    The newest spans of the traced requests as json, oldest first. All parameters are optional::
+
+        "GET", "/admin/traces?trace_id=4bf92f3577b34da6&name=store&min_ms=5&limit=100" ->
+            200, {"STATS": {"sample_rate": 0.01, ..}, "SPANS": [{"TRACE_ID": "4bf92f3577b34da6", "NAME": "store",
+                  "START": 1700000000.12, "MS": 7.2, "QUEUE_MS": 5.1, "DUPLICATE_CHECK_MS": 0.4, ..}]}
+
+    A name ending with a dot selects all its sub stages, e.g. receive. for receive.read and receive.decode.
+    """
+
+    async def get(self) -> web.Response:
+        tracer: Tracer = self.request.app.get('DISTRIBUTOR_TRACER', DISABLED)
+        query = self.request.query
+        try:
+            min_ms = float(query.get('min_ms', 0))
+            limit = int(query.get('limit', 100))
+        except ValueError:
+            raise web.HTTPBadRequest()
+        spans = tracer.spans(trace_id=query.get('trace_id'), name=query.get('name'), min_ms=min_ms, limit=limit)
+        return web.json_response({'STATS': tracer.stats(), 'SPANS': spans})
+
+
+async def traced_post(view: web.View, stage: str) -> web.Response:
+    """
+    Run view._post() measured as stage of the metrics and, if the request is traced, as span of its trace. The
+    answer of a traced request carries the trace id in the X-Trace-Id header.
+    """
+    tracer: Tracer = view.request.app.get('DISTRIBUTOR_TRACER', DISABLED)
+    trace_id = tracer.start(view.request.headers.get(TRACE_HEADER))
+    with metrics.STAGE_SECONDS.time(stage), tracer.span(trace_id, stage, METHOD=view.request.method) as span:
+        response = await view._post(tracer, trace_id)
+        span.set(STATUS=response.status)
+    if trace_id is not None:
+        response.headers[TRACE_HEADER] = trace_id
+    return response
+
 
 class Distributor(web.View):
     async def post(self) -> web.Response:
+        return await traced_post(self, 'ingest')
+
+    async def _post(self, tracer: Tracer, trace_id: str = None) -> web.Response:
         name: str = self.request.match_info.get('name', "orders")
         event_access = create_event_access(self.request.app['DISTRIBUTOR_DB'])
-        transaction = create_transaction(self.request.app['DISTRIBUTOR_DB'])
+        transaction = create_transaction(self.request.app['DISTRIBUTOR_DB'], tracer=tracer, trace_id=trace_id)
         try:
-            event = await event_access.get_event_data(url=name, method=self.request.method)
+            with tracer.span(trace_id, 'receive.event'):
+                event = await event_access.get_event_data(url=name, method=self.request.method)
         except IndexError:
             return web.HTTPNotImplemented()
         response: State = await transaction.receive(self.request, event)
 
         if response.code not in {200, 201}:
             log.warning(response.message)
+            metrics.TASKS.inc(response.name)
             return web.Response(text=response.reason, status=response.code)
         response = await transaction.store()
+        metrics.TASKS.inc(response.name)
         if response.code not in {200, 201}:
             log.warning(response.message)
             return web.Response(text=response.reason, status=response.code)
+        if response == State.RequestReplayed:
+            return web.Response(text=transaction.message, status=201, headers={'Idempotent-Replayed': 'true'})
+        wake_up_spread(self.request.app)
         return web.Response(text=transaction.message, status=201)
 
     async def put(self) -> web.Response:
@@ -182,37 +288,168 @@ class Distributor(web.View):
         return await self.post()
 
 
+class DistributorBatch(web.View):
+    """
+    Store many tasks of one event with one request. The body is a json array (or newline delimited json) of
+    {"PARTNER_ID": .., "DATA": {"ID": .., ..}} items, the answer lists the status per item in the same order::
+
+        [{"STATUS": 201, "PATH": "/orders/239/2"}, {"STATUS": 409, "REASON": "already stored"}]
+
+    The status of the response is 201 if all items are stored, 207 otherwise. A body of Content-Type
+    application/msgpack is a msgpack array of the same items, the answer is encoded as the Accept header asks for.
+    """
+
+    async def post(self) -> web.Response:
+        return await traced_post(self, 'ingest_batch')
+
+    async def _post(self, tracer: Tracer, trace_id: str = None) -> web.Response:
+        name: str = self.request.match_info.get('name', "orders")
+        event_access = create_event_access(self.request.app['DISTRIBUTOR_DB'])
+        transaction = create_transaction(self.request.app['DISTRIBUTOR_DB'], tracer=tracer, trace_id=trace_id)
+        try:
+            with tracer.span(trace_id, 'receive.event'):
+                event = await event_access.get_event_data(url=name, method=self.request.method)
+        except IndexError:
+            return web.HTTPNotImplemented()
+        response: State = await transaction.receive_batch(self.request, event)
+        if response.code not in {200, 201}:
+            log.warning(response.message)
+            return web.Response(text=response.reason, status=response.code)
+        await transaction.store_batch()
+        for state, __ in transaction.batch:
+            metrics.TASKS.inc(state.name)
+        messages = transaction.messages
+        if any(x['STATUS'] == 201 for x in messages):
+            wake_up_spread(self.request.app)
+        status = 201 if all(x['STATUS'] == 201 for x in messages) else 207
+        answer_codec = codec.by_accept(self.request.headers.get('Accept'))
+        return web.Response(body=answer_codec.dumps(messages), status=status, content_type=answer_codec.content_type)
+
+    async def put(self) -> web.Response:
+        return await self.post()
+
+
 async def start_background_tasks(_app):
     log.info(f"start distributor with version {__version__}")
+    config: ConfigParser = _app.get('DISTRIBUTOR_CONFIG', ConfigParser())
+    read_batch = config.getint('SPREAD', 'read_batch', fallback=500)
+    if read_batch < 1:  # checked before anything is started
+        raise ValueError(f"[SPREAD] read_batch {read_batch} is less than 1")
+    if config.getboolean('DATABASE', 'migrate', fallback=True):
+        log.info(f"data base schema version {await upgrade(_app['DISTRIBUTOR_DB'])}")
+    await _app['DISTRIBUTOR_DB'].registry.refresh()
+    _app['DISTRIBUTOR_TRACER'] = Tracer.from_config(config)
+    _app['DISTRIBUTOR_DELIVERY'] = DeliveryEngine(
+        _app['DISTRIBUTOR_DB'],
+        max_in_flight=config.getint('DELIVERY', 'max_in_flight', fallback=50),
+        max_per_partner=config.getint('DELIVERY', 'max_per_partner', fallback=4),
+        max_queued_per_partner=config.getint('DELIVERY', 'max_queued_per_partner', fallback=0),
+        flush_items=config.getint('DELIVERY', 'flush_items', fallback=500),
+        flush_delay=config.getint('DELIVERY', 'flush_delay_ms', fallback=50) / 1000,
+        retry_policy=RetryPolicy.from_config(config),
+        circuit_breakers=CircuitBreakers.from_config(config),
+        batch_max_bytes=config.getint('DELIVERY', 'batch_max_bytes', fallback=1 << 20),
+        batch_linger=config.getint('DELIVERY', 'batch_linger_ms', fallback=20) / 1000,
+        tracer=_app['DISTRIBUTOR_TRACER'])
+    _app['DISTRIBUTOR_CLIENT_STATS'] = ConnectionStats()
+    if 'DISTRIBUTOR_CLIENT' not in _app:  # else provided by the caller, e.g. a test
+        _app['DISTRIBUTOR_CLIENT'] = create_client_session(config, _app['DISTRIBUTOR_CLIENT_STATS'])
+        _app['DISTRIBUTOR_CLIENT_OWNED'] = True
+    _app['DISTRIBUTOR_WAKEUP'] = asyncio.Event()
+    _app['DISTRIBUTOR_POLL'] = (config.getfloat('SPREAD', 'poll_min', fallback=1.0),
+                                config.getfloat('SPREAD', 'poll_max', fallback=30.0))
+    _app['DISTRIBUTOR_SPREAD_CHUNK'] = config.getint('SPREAD', 'chunk', fallback=1000)
+    _app['DISTRIBUTOR_READ_BATCH'] = read_batch
     _app['LIKEMC_SPREAD'] = _app.loop.create_task(spread(_app), )
+    if config.has_section('ARCHIVE'):  # finished tasks are kept forever without
+        _app['DISTRIBUTOR_ARCHIVER'] = Archiver.from_config(config, _app['DISTRIBUTOR_DB'])
+        _app['LIKEMC_ARCHIVE'] = _app.loop.create_task(_app['DISTRIBUTOR_ARCHIVER'].run())
 
 
 async def cleanup_background_tasks(_app):
     _app['LIKEMC_SPREAD'].cancel()
     await _app['LIKEMC_SPREAD']
+    if 'LIKEMC_ARCHIVE' in _app:
+        _app['LIKEMC_ARCHIVE'].cancel()
+        try:
+            await _app['LIKEMC_ARCHIVE']
+        except asyncio.CancelledError:
+            pass
+        await _app['DISTRIBUTOR_ARCHIVER'].close()
+    await _app['DISTRIBUTOR_DELIVERY'].close()
+    if _app.get('DISTRIBUTOR_CLIENT_OWNED', False):
+        await _app['DISTRIBUTOR_CLIENT'].close()
+    _app['DISTRIBUTOR_TRACER'].close()
+    _app['DISTRIBUTOR_DB'].close()  # shuts the executor threads down as well
+
+
+def wake_up_spread(_app: web.Application):
+    """
+    Start the next spread pass right away, called after new tasks are stored
+    """
+    if 'DISTRIBUTOR_WAKEUP' in _app:
+        _app['DISTRIBUTOR_WAKEUP'].set()
 
 
 async def spread(_app):
+    """
+    Background loop: spread the new tasks to their subscribers and deliver the processing steps. A pass starts when
+    wake_up_spread() is called or the poll interval is over. The interval is doubled up to poll_max after each pass
+    without work and falls back to poll_min as soon as there is work again. It is shortened to the time the next
+    failed delivery is due again.
+    """
+    delivery: DeliveryEngine = _app['DISTRIBUTOR_DELIVERY']
+    client: aiohttp.ClientSession = _app['DISTRIBUTOR_CLIENT']
+    wakeup: asyncio.Event = _app['DISTRIBUTOR_WAKEUP']
+    poll_min, poll_max = _app['DISTRIBUTOR_POLL']
+    spread_chunk: int = _app['DISTRIBUTOR_SPREAD_CHUNK']
+    read_batch: int = _app['DISTRIBUTOR_READ_BATCH']
+    tracer: Tracer = _app['DISTRIBUTOR_TRACER']
+    interval: float = poll_min
     while True:
         log.info(f"spread it at {datetime.now()}")
         try:
-            task_access = create_task_access(_app['DISTRIBUTOR_DB'])
-            await task_access.read_tasks(state=1)
-            transaction = create_transaction(_app['DISTRIBUTOR_DB'])
-            for data in task_access.get_data():
-                code = await transaction.spread(data.id)
-                log.info(code.message)
+            wakeup.clear()  # tasks stored from now on need another pass
+            work = 0
+            transaction = create_transaction(_app['DISTRIBUTOR_DB'], tracer=tracer, trace_id=tracer.start())
+            while True:  # chunk by chunk, so ingest can write in between
+                with metrics.STAGE_SECONDS.time('spread'):
+                    spread_tasks = await transaction.spread_all(limit=spread_chunk)
+                work += spread_tasks
+                if spread_chunk <= 0 or spread_tasks < spread_chunk:  # a chunk of 0 spreads all at once
+                    break
+            log.info(f"{work} tasks spread")
             processing_step = create_processing_step_access(_app['DISTRIBUTOR_DB'])
-            for check_state in {1, 2}:  # the two check states are new and in progress
-                await processing_step.read_processing_steps(state=check_state)
-                async with aiohttp.ClientSession(loop=_app.loop, conn_timeout=1.0) as client:
-                    for data in processing_step.get_data():
-                        state = await transaction.process(data, client)
-                        log.info(state)
-
-            await asyncio.sleep(5)
+            await delivery.begin_pass()
+            for check_state in (1, 2):  # the two check states are new and in progress
+                async for batch in processing_step.iter_by_state(state=check_state, batch_size=read_batch):
+                    for data in batch:
+                        if delivery.submit(data, client):  # steps still on their way are skipped
+                            work += 1
+            log.info(delivery.stats())
+            log.info(_app['DISTRIBUTOR_CLIENT_STATS'].to_dict())
+
+            interval = poll_min if work > 0 else min(interval * 2, poll_max)
+            next_attempt = await processing_step.seconds_to_next_attempt()
+            if next_attempt is not None:  # a failed delivery is due again
+                interval = max(poll_min, min(interval, next_attempt))
+            waiter = asyncio.ensure_future(wakeup.wait())
+            try:  # wait_for of python 3.11 loses a cancel which comes with the wakeup, cleanup would wait forever
+                await asyncio.wait({waiter}, timeout=interval)
+            finally:
+                waiter.cancel()
+        except sqlite3.Error as error:  # e.g. a busy or locked data base, the next pass tries again later
+            interval = min(interval * 2, poll_max)
+            log.error(f"spread pass failed: {error}, next one in {interval} seconds")
+            try:
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                log.warning("Cancelled")
+                await delivery.close()
+                return
         except asyncio.CancelledError:
             log.warning("Cancelled")
+            await delivery.close()
             return
 
 
@@ -229,9 +466,17 @@ def apply_config(task_app: web.Application, config_file_name: str) -> int:
     config = ConfigParser()
     config.read(config_file_name)
     task_port: int = config.getint('SERVER', 'task')
+    pragmas = profile_pragmas(config.get('DATABASE', 'profile', fallback='durable'),
+                              **{x: config.get('DATABASE', x) for x in PRAGMAS if config.has_option('DATABASE', x)})
     engine: sqlite3.Connection = prepare_connection(
-        database_name=str(config.get('DATABASE', 'task_db')))
+        database_name=str(config.get('DATABASE', 'task_db')),
+        readers=config.getint('DATABASE', 'readers', fallback=0),
+        queue_size=config.getint('DATABASE', 'queue_size', fallback=1000),
+        pragmas=pragmas,
+        cached_statements=config.getint('DATABASE', 'cached_statements', fallback=128))
+    log.info(f"data base {config.get('DATABASE', 'task_db')} with {engine.pragmas}")
     task_app['DISTRIBUTOR_DB'] = engine
+    task_app['DISTRIBUTOR_CONFIG'] = config
     return task_port
 
 
@@ -249,8 +494,11 @@ def apply_ssl(config_file_name: str) -> (ssl.SSLContext, None):
 
 def apply_routes(task_app: web.Application) -> bool:
     task_app.router.add_route('*', '/transactions/{name}', Distributor)
+    task_app.router.add_route('*', '/transactions/{name}/batch', DistributorBatch)
     task_app.router.add_route('*', '/admin/partners/{value}', PartnerAdmin)
     task_app.router.add_route('*', '/admin/subscribers', SubscriberAdmin)
+    task_app.router.add_route('GET', '/admin/metrics', Metrics)
+    task_app.router.add_route('GET', '/admin/traces', Traces)
     task_app.router.add_static(path='./asynctransaction/static', prefix='/static')
     aiohttp_jinja2.setup(app=task_app, loader=FileSystemLoader('./asynctransaction/view'))
     return True
@@ -0,0 +1,202 @@
+"""
+Spans of the stages of single requests. A trace is started for a sampled request or for one which sends an
+X-Trace-Id header, its spans are kept in a ring buffer and shown at /admin/traces. The trace id of a stored task is
+remembered, so its deliveries carry it in the X-Trace-Id header to the partners. An unsampled request costs one
+random number, its spans are a shared object doing nothing.
+
+Example::
+
+    trace_id = tracer.start(request.headers.get(TRACE_HEADER))
+    with tracer.span(trace_id, 'receive.read') as span:
+        ...
+        span.set(BYTES=len(body))
+
+The spans may be written to a file as json lines as well, see the [TRACING] section of the config file.
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+from collections import deque, OrderedDict
+from configparser import ConfigParser
+from typing import Deque, Dict, List, Optional
+
+log = logging.getLogger('asynctransaction.tracing')
+
+TRACE_HEADER = 'X-Trace-Id'
+_valid_trace_id = re.compile(r'[0-9A-Za-z_.:-]{1,64}')
+
+
+class Span(object):
+    __slots__ = ('tracer', 'trace_id', 'name', 'start', 'seconds', 'attributes', '_started')
+
+    def __init__(self, tracer: 'Tracer', trace_id: str, name: str, attributes: Dict):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.start = 0.0  # epoch seconds
+        self.seconds = 0.0
+        self.attributes = attributes
+        self._started = 0.0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> 'Span':
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._started
+        if exc_type is not None:
+            self.attributes['ERROR'] = exc_type.__name__
+        self.tracer.add(self)
+
+    def to_dict(self) -> Dict:
+        return {'TRACE_ID': self.trace_id, 'NAME': self.name, 'START': round(self.start, 6),
+                'MS': round(self.seconds * 1000, 3), **self.attributes}
+
+
+class _NoSpan(object):
+    """
+    Span of an unsampled request, records nothing
+    """
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> '_NoSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """
+    Samples requests and keeps the spans of the sampled ones. Spans are recorded on the event loop only.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, capacity: int = 1000, export_file: str = None):
+        """
+        Constructor of Tracer
+        :param sample_rate: Optional: Share of the requests without X-Trace-Id header which are traced, 0.0 traces
+            only requests sending the header. Default is 0.0 [float]
+        :param capacity: Optional: Spans kept for /admin/traces, older ones are dropped. 0 turns tracing off, also
+            for requests with the header. Default is 1000 [int]
+        :param export_file: Optional: File the spans are appended to as json lines. Default None writes no file [str]
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError(f"sample rate {sample_rate} is not between 0 and 1")
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self._spans: Deque[Span] = deque(maxlen=max(capacity, 1))
+        self._tasks: OrderedDict = OrderedDict()  # task id -> trace id, the newest capacity tasks
+        self._export = open(export_file, 'a', buffering=1 << 16) if export_file and capacity > 0 else None
+        self.started = 0
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> 'Tracer':
+        """
+        Tracer of the optional [TRACING] section of the config file
+        """
+        return cls(sample_rate=config.getfloat('TRACING', 'sample_rate', fallback=0.0),
+                   capacity=config.getint('TRACING', 'capacity', fallback=1000),
+                   export_file=config.get('TRACING', 'export_file', fallback=None))
+
+    def start(self, trace_id: str = None) -> Optional[str]:
+        """
+        Decide if a request is traced
+        :param trace_id: Optional: trace id the request came with, it is always traced then
+        :return: the trace id, None if the request is not traced
+        """
+        if self.capacity <= 0:
+            return None
+        if trace_id is not None and _valid_trace_id.fullmatch(trace_id) is not None:
+            self.started += 1
+            return trace_id
+        if self.sample_rate > 0.0 and random.random() < self.sample_rate:
+            self.started += 1
+            return os.urandom(8).hex()
+        return None
+
+    def span(self, trace_id: Optional[str], name: str, **attributes):
+        """
+        Context manager measuring its block as a span of the trace, it does nothing without a trace id
+        """
+        if trace_id is None:
+            return NO_SPAN
+        return Span(self, trace_id, name, attributes)
+
+    def record(self, trace_id: Optional[str], name: str, start: float, seconds: float, **attributes):
+        """
+        Add a span measured by the caller
+        :param start: epoch seconds the span started
+        :param seconds: duration of the span
+        """
+        if trace_id is None:
+            return
+        span = Span(self, trace_id, name, attributes)
+        span.start, span.seconds = start, seconds
+        self.add(span)
+
+    def add(self, span: Span):
+        self._spans.append(span)
+        if self._export is not None:
+            self._export.write(json.dumps(span.to_dict()) + '\n')
+
+    def follow(self, task_id: int, trace_id: Optional[str]):
+        """
+        Remember the trace of a stored task for its deliveries
+        """
+        if trace_id is None or not task_id:
+            return
+        self._tasks[task_id] = trace_id
+        if len(self._tasks) > self.capacity:
+            self._tasks.popitem(last=False)
+
+    def trace_of(self, task_id: int) -> Optional[str]:
+        return self._tasks.get(task_id)
+
+    def spans(self, trace_id: str = None, name: str = None, min_ms: float = 0.0, limit: int = 100) -> List[Dict]:
+        """
+        The newest spans, oldest first
+        :param trace_id: Optional: spans of this trace only
+        :param name: Optional: spans of this stage only, a name ending with a dot matches all its sub stages
+        :param min_ms: Optional: spans lasting at least this many milliseconds. Default is 0.0 [float]
+        :param limit: Optional: maximal number of spans. Default is 100 [int]
+        """
+        if self.capacity <= 0:
+            return []
+        result = []
+        for span in reversed(self._spans):
+            if len(result) >= limit:
+                break
+            if trace_id is not None and span.trace_id != trace_id:
+                continue
+            if name is not None and span.name != name and not (name.endswith('.') and span.name.startswith(name)):
+                continue
+            if span.seconds * 1000 < min_ms:
+                continue
+            result.append(span.to_dict())
+        result.reverse()
+        return result
+
+    def stats(self) -> Dict:
+        return {'sample_rate': self.sample_rate, 'capacity': self.capacity, 'started': self.started,
+                'spans': len(self._spans) if self.capacity > 0 else 0, 'followed_tasks': len(self._tasks)}
+
+    def close(self):
+        if self._export is not None:
+            self._export.close()
+            self._export = None
+
+
+DISABLED = Tracer(capacity=0)  # for data access without a tracer
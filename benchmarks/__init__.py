@@ -0,0 +1,20 @@
+"""
+Load tests of the distributor. A data base is seeded from transaction.sql, the real aiohttp app is started on it and
+delivers to stub partners built from server/client.py, all on 127.0.0.1. Run from the root of the repository::
+
+    python -m benchmarks --requests 2000 --concurrency 50 --partners 4 --history 100000 --backlog 5000
+
+The report is json on stdout (or --output), so runs can be compared:
+
+* ingest: posted orders per second and the p50/p99 latency of the requests
+* drain: seconds and steps per second until the seeded backlog has reached all partners
+* end_to_end: p50/p99 from posting an order until a partner received it
+
+The other modes measure a single code path, the reads on an in memory data base of --rows spread tasks::
+
+    python -m benchmarks --mode memory --rows 20000
+
+* memory: bytes per row the entities of a read of the tasks and of the processing steps keep alive
+* read: tasks per second through read(), without and with the joins, the best of --repeat reads
+* ingest-cpu: cpu microseconds per KB to decode an order of about 1, 10 and 100 KB and create its task
+"""
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+from typing import Dict, List
+
+from asynctransaction.data.entity import EntityBase, Event, State
+from asynctransaction.data.access.base import DbConnection, prepare_connection
+from asynctransaction.data.access.factory import create_processing_step_access, create_task_access
+from asynctransaction.data.access.transaction import Transaction, decode_payload
+
+from benchmarks.seed import payload, seed_database
+
+# sizes of the DATA of the orders decoded by the ingest mode
+INGEST_BYTES = (1000, 10000, 100000)
+
+
+def _copy(con: sqlite3.Connection, path: str):
+    source = sqlite3.connect(path)
+    try:
+        source.backup(con)
+    finally:
+        source.close()
+
+
+async def load_database(args: argparse.Namespace) -> DbConnection:
+    """
+    In memory data base with args.rows spread tasks, each with one processed step, so the file system stays out of
+    the measurements
+    """
+    with tempfile.TemporaryDirectory(prefix='asynctransaction-micro-') as workdir:
+        path = os.path.join(workdir, 'transaction.db')
+        seed_database(path, [3030], history=args.rows, payload_bytes=args.payload_bytes, seed=args.seed)
+        con = prepare_connection()
+        await con.executor.write(_copy, path)
+    await con.registry.refresh()
+    return con
+
+
+async def _read_tasks(con: DbConnection) -> List[EntityBase]:
+    access = create_task_access(con)
+    await access.read()  # with the joins of events and partners
+    return access.data
+
+
+async def _read_processing_steps(con: DbConnection) -> List[EntityBase]:
+    access = create_processing_step_access(con)
+    await access.read_processing_steps(State.Processed.code)
+    return access.data
+
+
+def _config(args: argparse.Namespace) -> Dict:
+    return {'rows': args.rows, 'payload_bytes': args.payload_bytes, 'repeat': args.repeat,
+            'python': sys.version.split()[0]}
+
+
+async def memory(args: argparse.Namespace) -> Dict:
+    """
+    Bytes per row the entities of one read keep alive, traced with tracemalloc from the start of the read
+    """
+    con = await load_database(args)
+    report = {}
+    try:
+        for name, read in (('tasks', _read_tasks), ('processing_steps', _read_processing_steps)):
+            tracemalloc.start()
+            try:
+                data = await read(con)
+                size = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            report[name] = {'rows': len(data), 'bytes_per_row': round(size / len(data)) if data else 0}
+            del data
+    finally:
+        con.close()
+    return {'config': _config(args), 'memory': report}
+
+
+async def read(args: argparse.Namespace) -> Dict:
+    """
+    Tasks per second through DataAccessBase.read(), without and with the joins, the best of args.repeat reads
+    """
+    con = await load_database(args)
+    report = {}
+    try:
+        for name, no_join in (('no_join', True), ('joins', False)):
+            seconds = []
+            for __ in range(args.repeat):
+                access = create_task_access(con)
+                start = time.perf_counter()
+                rows = await access.read(no_join=no_join)
+                seconds.append(time.perf_counter() - start)
+            report[name] = {'rows': rows, 'rows_per_second': round(rows / min(seconds), 1)}
+    finally:
+        con.close()
+    return {'config': _config(args), 'read': report}
+
+
+def _ingest(bodies: List[str], event: Event) -> float:
+    # what receive() does with a json body after reading it, the cpu seconds of all bodies
+    start = time.process_time()
+    for body in bodies:
+        received_data, raw_values = decode_payload(body)
+        Transaction._create_task(received_data, event, raw_values.get('DATA'))
+    return time.process_time() - start
+
+
+async def ingest_cpu(args: argparse.Namespace) -> Dict:
+    """
+    Cpu time per KB of a request to decode an order and create its task, without the server and the data base. Per
+    size of INGEST_BYTES args.kilobytes of orders are decoded, the best of args.repeat runs is reported.
+    """
+    rng = random.Random(args.seed)
+    event = Event(ID=1, URL='orders', METHOD='POST')
+    report = {}
+    for size in INGEST_BYTES:
+        body = json.dumps({'PARTNER_ID': 1, 'DATA': json.loads(payload(1, size, rng))})
+        bodies = [body] * max(1, args.kilobytes * 1024 // len(body))
+        seconds = min(_ingest(bodies, event) for __ in range(args.repeat))
+        kilobytes = len(body) * len(bodies) / 1024
+        report[f'{len(body) / 1024:.1f}KB'] = {'requests': len(bodies),
+                                               'us_per_kb': round(seconds * 10 ** 6 / kilobytes, 1)}
+    return {'config': {'kilobytes': args.kilobytes, 'repeat': args.repeat, 'python': sys.version.split()[0]},
+            'ingest': report}
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.micro import ingest_cpu, memory, read
+from benchmarks.seed import seed_database
+from benchmarks.stubs import Arrivals, SENT_AT, start_partners
+
+log = logging.getLogger('benchmarks.run')
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest rank percentile, 0.0 for no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))  # ceiling without floats getting in the way
+    return ordered[int(rank) - 1]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def write_config(path: str, db: str, port: int, args: argparse.Namespace):
+    with open(path, 'w') as config:
+        config.write(f"[DATABASE]\ntask_db: {db}\nprofile: {args.profile}\n"
+                     f"[SERVER]\ntask: {port}\nschema: http\n"
+                     f"[SPREAD]\npoll_min: 0.05\npoll_max: 0.5\n"
+                     f"[TRACING]\nsample_rate: {args.sample_rate}\n")
+
+
+async def ingest(url: str, first_id: int, args: argparse.Namespace) -> Dict:
+    """
+    POST args.requests new orders with args.concurrency requests at the same time
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    ids = iter(range(first_id, first_id + args.requests))
+    filler = 'x' * max(0, args.payload_bytes - 60)
+
+    async def worker(session: aiohttp.ClientSession):
+        for local_id in ids:
+            body = {'PARTNER_ID': 1, 'DATA': {'ID': local_id, SENT_AT: time.perf_counter(), 'NOTE': filler}}
+            start = time.perf_counter()
+            async with session.post(url, json=body) as resp:
+                await resp.read()
+                statuses[resp.status] += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for __ in range(args.concurrency)))
+        seconds = time.perf_counter() - start
+    return {'requests': args.requests, 'concurrency': args.concurrency, 'seconds': round(seconds, 3),
+            'throughput': round(args.requests / seconds, 1) if seconds > 0 else 0.0,
+            'p50_ms': _ms(percentile(latencies, 50)), 'p99_ms': _ms(percentile(latencies, 99)),
+            'statuses': {str(x): y for x, y in sorted(statuses.items())}}
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    from asynctransaction.server.distributor import (apply_config, apply_routes, start_background_tasks,
+                                                     cleanup_background_tasks)
+    arrivals = Arrivals()
+    partners = await start_partners(args.partners, arrivals)
+    workdir = tempfile.mkdtemp(prefix='asynctransaction-bench-')
+    db = args.db or os.path.join(workdir, 'transaction.db')
+    config_file = os.path.join(workdir, 'bench.ini')
+    app_runner = None
+    try:
+        last_id = seed_database(db, [x.addresses[0][1] for x in partners], history=args.history, backlog=args.backlog,
+                                payload_bytes=args.payload_bytes, batch_size=args.batch_size, seed=args.seed)
+        write_config(config_file, db, 0, args)
+        app = web.Application()
+        app.on_startup.append(start_background_tasks)
+        app.on_cleanup.append(cleanup_background_tasks)
+        apply_routes(app)
+        apply_config(app, config_file)
+
+        start = time.perf_counter()
+        app_runner = web.AppRunner(app, access_log=None)
+        await app_runner.setup()
+        site = web.TCPSite(app_runner, '127.0.0.1', 0)
+        await site.start()
+        port = app_runner.addresses[0][1]
+        backlog_steps = args.backlog * args.partners
+        await arrivals.wait_for(backlog_steps, args.timeout)
+        drain_seconds = time.perf_counter() - start
+
+        report_ingest = await ingest(f'http://127.0.0.1:{port}/transactions/orders', last_id + 1, args)
+        delivered = args.requests * args.partners
+        try:
+            await arrivals.wait_for(backlog_steps + delivered, args.timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"only {arrivals.count - backlog_steps} of {delivered} steps arrived")
+        return {
+            'config': {'partners': args.partners, 'history': args.history, 'backlog': args.backlog,
+                       'payload_bytes': args.payload_bytes, 'profile': args.profile, 'batch_size': args.batch_size,
+                       'sample_rate': args.sample_rate, 'python': sys.version.split()[0]},
+            'ingest': report_ingest,
+            'drain': {'steps': backlog_steps, 'seconds': round(drain_seconds, 3),
+                      'steps_per_second': round(backlog_steps / drain_seconds, 1) if backlog_steps else 0.0},
+            'end_to_end': {'delivered': len(arrivals.latencies), 'p50_ms': _ms(percentile(arrivals.latencies, 50)),
+                           'p99_ms': _ms(percentile(arrivals.latencies, 99))}}
+    finally:
+        if app_runner is not None:
+            await app_runner.cleanup()  # closes the data base as well
+        for partner in partners:
+            await partner.cleanup()
+        for name in os.listdir(workdir):  # the data base stays if it was given by --db
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+# benchmark per --mode, each one reports a dict
+MODES: Dict[str, Callable[[argparse.Namespace], Awaitable[Dict]]] = {
+    'load': run, 'memory': memory, 'read': read, 'ingest-cpu': ingest_cpu}
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Load the distributor with orders and deliver them to stub partners')
+    parser.add_argument('--mode', default='load', choices=tuple(MODES),
+                        help='load runs the distributor, the others measure a single code path')
+    parser.add_argument('--requests', type=int, default=1000, help='orders posted during the ingest')
+    parser.add_argument('--concurrency', type=int, default=20, help='requests at the same time')
+    parser.add_argument('--partners', type=int, default=2, help='stub partners subscribed to the orders')
+    parser.add_argument('--history', type=int, default=0, help='spread tasks already in the data base')
+    parser.add_argument('--backlog', type=int, default=0, help='new tasks delivered before the ingest starts')
+    parser.add_argument('--payload-bytes', type=int, default=256, help='size of the data of a task')
+    parser.add_argument('--profile', default='wal', choices=('durable', 'wal', 'fast'), help='data base profile')
+    parser.add_argument('--batch-size', type=int, default=0, help='BATCH_SIZE of the partners')
+    parser.add_argument('--sample-rate', type=float, default=0.0, help='share of the requests which are traced')
+    parser.add_argument('--db', default=None, help='keep the data base in this file instead of a temporary one')
+    parser.add_argument('--output', default=None, help='write the report to this file instead of stdout')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated data')
+    parser.add_argument('--rows', type=int, default=20000, help='rows read by the modes other than load')
+    parser.add_argument('--kilobytes', type=int, default=10000, help='payload per size decoded by ingest-cpu')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of a timed mode, the best one is reported')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for the deliveries')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> Dict:
+    args = parse_args(argv)
+    logging.getLogger('asynctransaction').setLevel(logging.WARNING)
+    logging.getLogger('aiohttp').setLevel(logging.WARNING)
+    logging.getLogger('asyncio').setLevel(logging.WARNING)
+    report = asyncio.run(MODES[args.mode](args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    return report
@@ -0,0 +1,61 @@
+import os
+import json
+import random
+import sqlite3
+import logging
+from typing import List
+
+log = logging.getLogger('benchmarks.seed')
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', 'asynctransaction', 'data', 'model', 'transaction.sql')
+
+
+def payload(local_id: int, payload_bytes: int, rng: random.Random) -> str:
+    """
+    Order like json data of about payload_bytes
+    """
+    items = []
+    data = {'ID': local_id, 'ORDER': rng.randint(1, 10 ** 6), 'ITEMS': items}
+    while len(json.dumps(data)) < payload_bytes:
+        items.append({'SKU': f'A-{rng.randint(0, 99999):05d}', 'QTY': rng.randint(1, 9),
+                      'PRICE': round(rng.uniform(1, 500), 2)})
+    return json.dumps(data)
+
+
+def seed_database(path: str, ports: List[int], history: int = 0, backlog: int = 0, payload_bytes: int = 256,
+                  batch_size: int = 0, seed: int = 1) -> int:
+    """
+    Create a new data base from transaction.sql with one partner per port, all of them subscribed to POST orders
+    :param path: file of the data base, an existing file is replaced
+    :param ports: ports of the stub partners on 127.0.0.1
+    :param history: Optional: spread tasks with their processed steps, as left by earlier traffic. Default is 0
+    :param backlog: Optional: new tasks, not spread yet. Default is 0
+    :param payload_bytes: Optional: size of the data of a task. Default is 256
+    :param batch_size: Optional: BATCH_SIZE of the partners. Default 0 delivers the steps one by one
+    :param seed: Optional: seed of the random data, the same seed gives the same data base. Default is 1
+    :return: the highest local id in use, new tasks should start above
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    try:
+        with open(SCHEMA) as schema:
+            con.executescript(schema.read())
+        with con:
+            con.execute("INSERT INTO EVENTS (URL, METHOD) VALUES ('orders', 'POST')")
+            con.execute("INSERT INTO EVENTS (URL, METHOD) VALUES ('orders', 'PUT')")
+            con.executemany("INSERT INTO PARTNERS (IP_ADDRESS, PORT, DESCRIPTION, BATCH_SIZE) VALUES (?, ?, ?, ?)",
+                            [('127.0.0.1', port, f'stub {port}', batch_size) for port in ports])
+            con.executemany('INSERT INTO SUBSCRIBERS (EVENT_ID, PARTNER_ID) VALUES (1, ?)',
+                            [(x + 1,) for x in range(len(ports))])
+            con.executemany('INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID, DATA, STATE) VALUES (?, 1, 1, ?, ?)',
+                            ((x + 1, payload(x + 1, payload_bytes, rng), 3 if x < history else 1)
+                             for x in range(history + backlog)))
+            con.execute("""INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID, STATE)
+                           SELECT TASKS.ID, SUBSCRIBERS.PARTNER_ID, 4 FROM TASKS, SUBSCRIBERS
+                            WHERE TASKS.STATE = 3 AND TASKS.EVENT_ID = SUBSCRIBERS.EVENT_ID""")
+    finally:
+        con.close()
+    log.info(f"{path}: {len(ports)} partners, {history} spread and {backlog} new tasks")
+    return history + backlog
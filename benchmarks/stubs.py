@@ -0,0 +1,70 @@
+import time
+import asyncio
+from typing import Dict, List
+
+from aiohttp import web
+
+from asynctransaction.server.client import Client, ClientBatch
+
+SENT_AT = 'SENT_AT'  # key in the data of a task, perf_counter() when the request was sent
+
+
+class Arrivals(object):
+    """
+    Steps received by the stub partners and the seconds from the request which stored their task to the arrival
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.latencies: List[float] = []
+        self._waiters: Dict[int, asyncio.Future] = {}
+
+    def add(self, data):
+        now = time.perf_counter()
+        self.count += 1
+        if isinstance(data, dict) and SENT_AT in data:
+            self.latencies.append(now - data[SENT_AT])
+        for count in [x for x in self._waiters if x <= self.count]:
+            self._waiters.pop(count).set_result(True)
+
+    async def wait_for(self, count: int, timeout: float):
+        """
+        Wait until count steps arrived
+        :raise asyncio.TimeoutError: if they are not there after timeout seconds
+        """
+        if self.count >= count:
+            return
+        future = self._waiters.setdefault(count, asyncio.get_event_loop().create_future())
+        await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+class StubClient(Client):
+    async def post(self) -> web.Response:
+        self.request.app['ARRIVALS'].add(await self.request.json())
+        return await super().post()
+
+
+class StubClientBatch(ClientBatch):
+    async def post(self) -> web.Response:
+        response = await super().post()
+        for item in await self.request.json():
+            self.request.app['ARRIVALS'].add(item)
+        return response
+
+
+async def start_partners(count: int, arrivals: Arrivals) -> List[web.AppRunner]:
+    """
+    Start stub partners on 127.0.0.1 with the routes of server/client.py, each on a free port
+    :return: the runners, the port of a partner is runner.addresses[0][1]
+    """
+    runners = []
+    for __ in range(count):
+        app = web.Application()
+        app['ARRIVALS'] = arrivals
+        app.router.add_route('*', '/transactions/{name}', StubClient)
+        app.router.add_route('*', '/transactions/{name}/batch', StubClientBatch)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        runners.append(runner)
+    return runners
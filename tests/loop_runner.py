@@ -0,0 +1,13 @@
+import functools
+from typing import Any, Callable, Coroutine
+
+
+def run_in_loop(func: Callable[..., Coroutine]) -> Callable[..., Any]:
+    """
+    Runs an async test method of a nose test class until complete on the loop of the class, self.loop. The
+    unittest_run_loop decorator of aiohttp does nothing since 3.8, the coroutine would never be awaited.
+    """
+    @functools.wraps(func)
+    def run(self, *args, **kwargs):
+        return self.loop.run_until_complete(func(self, *args, **kwargs))
+    return run
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import sqlite3
+import tempfile
+import nose.tools as nt
+
+from loop_runner import run_in_loop
+
+from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.access.archiver import Archiver
+from asynctransaction.data.entity import *
+
+OLD = '2000-01-01 00:00:00'
+
+
+class TestArchiver:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.archive_file = os.path.join(tempfile.gettempdir(), 'test_archive.db')
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        with open('asynctransaction/data/model/test_data.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        # task 1 of the test data is new; 2 finished; 3 has a step on error; 4 finished, but recently;
+        # 5 spread long ago, its step was processed recently; 6 finished without steps
+        tasks = [(2, 3, OLD), (3, 3, OLD), (4, 4, None), (5, 3, OLD), (6, 4, OLD)]
+        steps = [(2, 4, OLD), (2, 4, OLD), (3, 4, OLD), (3, 5, OLD), (4, 4, OLD), (5, 4, None)]
+        with self.dbh:
+            for task_id, state, updated_on in tasks:
+                self.dbh.execute("INSERT INTO TASKS (ID, LOCAL_ID, PARTNER_ID, EVENT_ID, STATE, DATA) "
+                                 "VALUES (?, ?, 1, 1, ?, '{}')", [task_id, 300 + task_id, state])
+                if updated_on is not None:
+                    self.dbh.execute('UPDATE TASKS SET UPDATED_ON = ? WHERE ID = ?', [updated_on, task_id])
+            for task_id, state, updated_on in steps:
+                cursor = self.dbh.execute('INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID, STATE) VALUES (?, 1, ?)',
+                                          [task_id, state])
+                if updated_on is not None:
+                    self.dbh.execute('UPDATE PROCESSING_STEPS SET UPDATED_ON = ? WHERE ID = ?',
+                                     [updated_on, cursor.lastrowid])
+
+    def teardown(self):
+        self.dbh.close()
+        if os.path.exists(self.archive_file):
+            os.remove(self.archive_file)
+        self.loop.close()
+
+    def task_ids(self, schema: str = 'main') -> List[int]:
+        return [row['ID'] for row in self.dbh.execute(f'SELECT ID FROM {schema}.TASKS ORDER BY ID')]
+
+    def step_task_ids(self, schema: str = 'main') -> List[int]:
+        return [row['TASK_ID'] for row in self.dbh.execute(f'SELECT TASK_ID FROM {schema}.PROCESSING_STEPS ORDER BY ID')]
+
+    def test_retention(self):
+        with nt.assert_raises(ValueError):
+            Archiver(self.dbh, retention=60)
+        with nt.assert_raises(ValueError):
+            Archiver(self.dbh, chunk=1000)
+
+    @run_in_loop
+    async def test_delete(self):
+        archiver = Archiver(self.dbh, retention=3600, chunk=1, scan_rows=2, pause=0)
+        nt.assert_equal(await archiver.run_once(), (2, 2))
+        nt.assert_equal(self.task_ids(), [1, 3, 4, 5])
+        nt.assert_not_in(2, self.step_task_ids())
+        nt.assert_equal(await archiver.run_once(), (0, 0))
+        nt.assert_equal(archiver.stats()['tasks'], 2)
+
+    @run_in_loop
+    async def test_archive(self):
+        archiver = Archiver(self.dbh, retention=3600, archive_file=self.archive_file, pause=0)
+        nt.assert_equal(await archiver.run_once(), (2, 2))
+        nt.assert_equal(self.task_ids('ARCHIVE'), [2, 6])
+        nt.assert_equal(self.step_task_ids('ARCHIVE'), [2, 2])
+        row = self.dbh.execute('SELECT LOCAL_ID, STATE, DATA FROM ARCHIVE.TASKS WHERE ID = 2').fetchone()
+        nt.assert_equal((row['LOCAL_ID'], row['STATE'], row['DATA']), (302, 3, '{}'))
+        await archiver.close()
+        # a column added to the data base is added to the archive as well
+        self.dbh.execute('ALTER TABLE TASKS ADD COLUMN ORIGIN TEXT')
+        self.dbh.execute('UPDATE TASKS SET STATE = 4, UPDATED_ON = ? WHERE ID = 1', [OLD])
+        self.dbh.execute('DELETE FROM PROCESSING_STEPS WHERE TASK_ID = 1')
+        self.dbh.commit()
+        archiver = Archiver(self.dbh, retention=3600, archive_file=self.archive_file, pause=0)
+        nt.assert_equal(await archiver.run_once(), (1, 0))
+        nt.assert_equal(self.task_ids('ARCHIVE'), [1, 2, 6])
+        nt.assert_in('ORIGIN', self.dbh.execute('SELECT * FROM ARCHIVE.TASKS').fetchone())
+        await archiver.close()
+
+    def test_move_checks_again(self):
+        # a step changed after the read is not moved
+        self.dbh.execute("UPDATE PROCESSING_STEPS SET STATE = 2 WHERE TASK_ID = 2")
+        nt.assert_equal(Archiver._move(self.dbh, [2, 6], '2001-01-01 00:00:00', False), (1, 0))
+        nt.assert_equal(self.task_ids(), [1, 2, 3, 4, 5])
@@ -0,0 +1,72 @@
+import os
+import asyncio
+import sqlite3
+import tempfile
+import nose.tools as nt
+from loop_runner import run_in_loop
+
+from benchmarks.micro import ingest_cpu, memory, read
+from benchmarks.run import percentile, parse_args, run
+from benchmarks.seed import seed_database
+
+
+class TestBenchmarks:
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.db_name = os.path.join(tempfile.gettempdir(), 'bench_test.db')
+
+    def teardown(self):
+        if os.path.exists(self.db_name):
+            os.remove(self.db_name)
+        self.loop.close()
+
+    def test_percentile(self):
+        values = [x / 100 for x in range(100, 0, -1)]
+        nt.assert_equal(percentile(values, 50), 0.5)
+        nt.assert_equal(percentile(values, 99), 0.99)
+        nt.assert_equal(percentile([0.3], 99), 0.3)
+        nt.assert_equal(percentile([], 50), 0.0)
+
+    def test_seed_database(self):
+        last_id = seed_database(self.db_name, [4001, 4002], history=3, backlog=2, payload_bytes=200, batch_size=10)
+        nt.assert_equal(last_id, 5)
+        con = sqlite3.connect(self.db_name)
+        try:
+            nt.assert_equal(con.execute('SELECT STATE, COUNT(*) FROM TASKS GROUP BY STATE').fetchall(),
+                            [(1, 2), (3, 3)])
+            nt.assert_equal(con.execute('SELECT COUNT(*) FROM PROCESSING_STEPS WHERE STATE = 4').fetchone(), (6,))
+            nt.assert_equal(con.execute('SELECT PORT, BATCH_SIZE FROM PARTNERS').fetchall(), [(4001, 10), (4002, 10)])
+            nt.assert_greater_equal(min(len(x) for x, in con.execute('SELECT DATA FROM TASKS')), 200)
+        finally:
+            con.close()
+
+    @run_in_loop
+    async def test_run(self):
+        report = await run(parse_args(['--requests', '10', '--concurrency', '2', '--partners', '2', '--backlog', '3',
+                                       '--db', self.db_name, '--timeout', '10']))
+        nt.assert_equal(report['ingest']['statuses'], {'201': 10})
+        nt.assert_equal(report['drain']['steps'], 6)
+        nt.assert_equal(report['end_to_end']['delivered'], 20)
+        nt.assert_less_equal(report['ingest']['p50_ms'], report['ingest']['p99_ms'])
+
+    @run_in_loop
+    async def test_memory(self):
+        report = await memory(parse_args(['--mode', 'memory', '--rows', '20']))
+        nt.assert_equal(report['memory']['tasks']['rows'], 20)
+        nt.assert_equal(report['memory']['processing_steps']['rows'], 20)
+        nt.assert_greater(report['memory']['tasks']['bytes_per_row'], 256)  # at least the data of a task
+
+    @run_in_loop
+    async def test_read(self):
+        report = await read(parse_args(['--mode', 'read', '--rows', '20', '--repeat', '2']))
+        for name in ('no_join', 'joins'):
+            nt.assert_equal(report['read'][name]['rows'], 20)
+            nt.assert_greater(report['read'][name]['rows_per_second'], 0)
+
+    @run_in_loop
+    async def test_ingest_cpu(self):
+        report = await ingest_cpu(parse_args(['--mode', 'ingest-cpu', '--kilobytes', '100', '--repeat', '1']))
+        nt.assert_equal(len(report['ingest']), 3)
+        for size in report['ingest'].values():
+            nt.assert_greater(size['requests'], 0)
+            nt.assert_greater(size['us_per_kb'], 0)
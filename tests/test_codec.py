@@ -0,0 +1,61 @@
+import nose.tools as nt
+from unittest import SkipTest
+
+from asynctransaction.data import codec
+from asynctransaction.data.entity import ProcessingStep
+from asynctransaction.data.access.transaction import encode_step, encode_batch
+
+
+class TestCodec:
+    def test_json(self):
+        value = {'ID': 239, 'NAME': 'Käse', 'ITEMS': [1.5, None]}
+        nt.assert_equal(codec.JSON.loads(codec.JSON.dumps(value)), value)
+        nt.assert_equal(codec.JSON.loads('{"ID": 1}'), {'ID': 1})
+        with nt.assert_raises(ValueError):
+            codec.JSON.loads('{"ID": 1')
+
+    def test_by_content_type(self):
+        nt.assert_is(codec.by_content_type('application/json'), codec.JSON)
+        nt.assert_is(codec.by_content_type('application/octet-stream'), codec.JSON)
+        nt.assert_is(codec.by_content_type(''), codec.JSON)
+
+    def test_by_name(self):
+        nt.assert_is(codec.by_name('json'), codec.JSON)
+        nt.assert_is(codec.by_name(None), codec.JSON)
+        nt.assert_is(codec.by_name('xml'), codec.JSON)
+
+    def test_by_accept(self):
+        nt.assert_is(codec.by_accept(None), codec.JSON)
+        nt.assert_is(codec.by_accept('*/*'), codec.JSON)
+        nt.assert_is(codec.by_accept('text/html, application/json;q=0.9'), codec.JSON)
+
+    def test_json_step(self):
+        step = ProcessingStep(ID=1, DATA='{"ID": 239,  "PRICE": 1.10}')
+        nt.assert_equal(encode_step(step), (b'{"ID": 239,  "PRICE": 1.10}', 'application/json'))
+        nt.assert_equal(encode_step(ProcessingStep(ID=1, DATA=None)), (None, 'application/json'))
+
+    def test_json_batch(self):
+        steps = [ProcessingStep(ID=1, DATA='{"ID": 1}'), ProcessingStep(ID=2, DATA='{"ID":  2.50}')]
+        nt.assert_equal(encode_batch(steps), (b'[{"ID": 1},{"ID":  2.50}]', 'application/json'))
+
+
+class TestMsgpack:
+    def setup(self):
+        if 'msgpack' not in codec.CODECS:
+            raise SkipTest('msgpack is not installed')
+
+    def test_negotiation(self):
+        msgpack = codec.CODECS['msgpack']
+        nt.assert_is(codec.by_content_type('application/msgpack'), msgpack)
+        nt.assert_is(codec.by_content_type('application/x-msgpack'), msgpack)
+        nt.assert_is(codec.by_accept('application/msgpack'), msgpack)
+        nt.assert_is(codec.by_accept('application/msgpack;q=0.5, application/json'), codec.JSON)
+        nt.assert_is(codec.by_name('msgpack'), msgpack)
+
+    def test_msgpack_step(self):
+        step = ProcessingStep(ID=1, DATA='{"ID": 239, "ORDER": 12}', FORMAT='msgpack')
+        body, content_type = encode_step(step)
+        nt.assert_equal(content_type, 'application/msgpack')
+        nt.assert_equal(codec.CODECS['msgpack'].loads(body), {'ID': 239, 'ORDER': 12})
+        body, content_type = encode_batch([step, step])
+        nt.assert_equal(codec.CODECS['msgpack'].loads(body), [{'ID': 239, 'ORDER': 12}] * 2)
@@ -2,7 +2,7 @@ import nose.tools as nt
 import asyncio
 import sqlite3
 
-from aiohttp.test_utils import unittest_run_loop
+from loop_runner import run_in_loop
 
 from asynctransaction.data.access.factory import *
 from asynctransaction.data.access.base import DataAccessBase, MixedEntitiesException, prepare_connection
@@ -13,7 +13,7 @@ class TestDataAccessBase:
     def __init__(self):
         self.record: Dict = {}
         self.dbh = None
-        self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
 
     def setup(self):
         self.record = {'ID': 1, 'URL': 'orders', 'METHOD': 'POST'}
@@ -21,6 +21,7 @@ class TestDataAccessBase:
 
     def teardown(self):
         self.dbh.close()
+        self.loop.close()
 
     def test_ctor(self):
         test = DataAccessBase(self.dbh)
@@ -32,6 +33,13 @@ class TestDataAccessBase:
             # noinspection PyProtectedMember
             dac._entity_factory(self.record)
 
+    def test_entity_class(self):
+        dac = DataAccessBase(con=self.dbh, name='processing_steps', loop=self.loop)
+        # noinspection PyProtectedMember
+        nt.assert_is(dac._entity_class(), ProcessingStep)
+        # noinspection PyProtectedMember
+        nt.assert_is_instance(dac._entity_factory({'ID': 3, 'TASK_ID': 1}), ProcessingStep)
+
     def test_bad_entities(self):
         dac = DataAccessBase(con=self.dbh, name='', loop=self.loop)
         dac.data.append(Task())
@@ -41,12 +49,12 @@ class TestDataAccessBase:
         with nt.assert_raises(IndexError):
             dac.get_result()
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_insert(self):
         dac = DataAccessBase(con=self.dbh, name='EVENTS')
         nt.assert_equals(await dac.insert(), 0)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_entity(self):
         dac = DataAccessBase(con=self.dbh, name='XXX')
         nt.assert_equals(await dac.update_state(0), 0)
@@ -67,7 +75,7 @@ class TestDataAccessBase:
             create_subscriber_access(self.dbh, 'x')
 
     # noinspection PyProtectedMember
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_execute(self):
         dac = DataAccessBase(con=self.dbh, name='EVENTS')
         future: asyncio.Future = self.loop.create_future()
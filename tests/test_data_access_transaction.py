@@ -2,15 +2,19 @@ import nose.tools as nt
 import json
 import sqlite3
 import asyncio
+from unittest import SkipTest
 
-from aiohttp.test_utils import unittest_run_loop
+from loop_runner import run_in_loop
 from aiohttp import web
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientConnectionError
 
 from asynctransaction.data.access.base import prepare_connection, DataAccessBase
-from asynctransaction.data.access.transaction import Transaction
+from asynctransaction.data.access.transaction import Transaction, decode_payload
 from asynctransaction.data.access.processing_step import ProcessingStep as ProcessingAccess
+from asynctransaction.data.access.retry import RetryPolicy
 from asynctransaction.data.entity import *
+from asynctransaction.data import codec
+from asynctransaction.tracing import Tracer, TRACE_HEADER
 
 
 # noinspection PyMissingConstructor
@@ -22,7 +26,30 @@ class TestClient(ClientSession):
         return self.response
 
 
+# noinspection PyMissingConstructor
+class DeadClient(ClientSession):
+    def __init__(self):
+        pass
+
+    async def request(self, method, url, **kwargs) -> web.Response:
+        raise ClientConnectionError('connection refused')
+
+
+# noinspection PyMissingConstructor
+class RecordingClient(ClientSession):
+    def __init__(self, response: web.Response):
+        self.response = response
+        self.sent_headers = []
+
+    async def request(self, method, url, **kwargs) -> web.Response:
+        self.sent_headers.append(kwargs.get('headers', {}))
+        return self.response
+
+
 class TestRequest(web.BaseRequest):
+    headers = {}
+    content_type = 'application/json'
+
     # noinspection PyMissingConstructor
     def __init__(self, data):
         self.data = data
@@ -30,12 +57,15 @@ class TestRequest(web.BaseRequest):
     async def json(self, *, loads=json.loads):
         return self.data
 
+    async def read(self) -> bytes:
+        return self.data if isinstance(self.data, bytes) else json.dumps(self.data).encode()
+
 
 class TestTransaction:
     def __init__(self):
         self.dbh: sqlite3.Connection = None
         self.tc: Transaction = None
-        self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
 
     def setup(self):
         self.dbh = prepare_connection()
@@ -50,54 +80,96 @@ class TestTransaction:
 
     def teardown(self):
         self.dbh.close()
+        self.loop.close()
 
     def test_ctor(self):
         nt.assert_true(isinstance(self.tc.data, list))
         nt.assert_equal(len(self.tc.data), 0)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_receive_bad_body(self):
         nt.assert_equal(await self.tc.receive(TestRequest(data={})), State.BadRequestMandatoryKey)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_receive_no_data(self):
         data = {'DATA': {}, 'PARTNER_ID': 1, 'EVENT_ID': 23}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.BadRequestMandatoryKey)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_receive_str_data(self):
         data = 'DATA'
-        with nt.assert_raises(AttributeError):
-            await self.tc.receive(TestRequest(data=data))
+        nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.BadRequestMandatoryKey)
+        nt.assert_equal(await self.tc.receive(TestRequest(data=[1, 2])), State.BadRequestMandatoryKey)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_receive_bad_data_format(self):
         data = {'DATA': 3001, 'PARTNER_ID': 1, 'EVENT_ID': 23}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.BadRequestNotStoreAble)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_receive_wrong_data_type(self):
         data = {'DATA': 'text', 'PARTNER_ID': 1, 'EVENT_ID': 23}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.BadRequestNotStoreAble)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_receive(self):
         data = {'DATA': {'ID': 3876, 'DATA': 'important things'}, 'PARTNER_ID': 1, 'EVENT_ID': 23}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.RequestReceived)
 
-    @unittest_run_loop
+    @run_in_loop
+    async def test_receive_raw_data(self):
+        body = b'{"PARTNER_ID": 1, "EVENT_ID": 23, "DATA": {"ID": 3876,  "PRICE": 1.10, "NAME": "K\xc3\xa4se"}}'
+        nt.assert_equal(await self.tc.receive(TestRequest(data=body)), State.RequestReceived)
+        nt.assert_equal(self.tc.task.local_id, 3876)
+        nt.assert_equal(self.tc.task.data.encode(), b'{"ID": 3876,  "PRICE": 1.10, "NAME": "K\xc3\xa4se"}')
+
+    @run_in_loop
+    async def test_receive_bad_json(self):
+        for body in (b'{"PARTNER_ID": 1, "DATA": {"ID": 1}', b'{"PARTNER_ID" 1}', b'{"PARTNER_ID": 1,}',
+                     b'{"PARTNER_ID": 1} 2', b'\xff'):
+            nt.assert_equal(await self.tc.receive(TestRequest(data=body)), State.BadRequestJsonDecode)
+
+    @run_in_loop
+    async def test_receive_msgpack(self):
+        if 'msgpack' not in codec.CODECS:
+            raise SkipTest('msgpack is not installed')
+        request = TestRequest(data=codec.CODECS['msgpack'].dumps({'PARTNER_ID': 1, 'EVENT_ID': 23, 'DATA': {'ID': 1}}))
+        request.content_type = 'application/x-msgpack'
+        nt.assert_equal(await self.tc.receive(request), State.RequestReceived)
+        nt.assert_equal(codec.JSON.loads(self.tc.task.data), {'ID': 1})
+
+    @run_in_loop
+    async def test_receive_msgpack_not_installed(self):
+        request = TestRequest(data=b'\x81\xaaPARTNER_ID\x01')
+        request.content_type = 'application/msgpack'
+        offered = dict(codec._by_content_type)
+        for content_type in codec.MsgpackCodec.content_types:  # as without the msgpack package
+            codec._by_content_type.pop(content_type, None)
+        try:
+            nt.assert_equal(await self.tc.receive(request), State.UnsupportedMediaType)
+        finally:
+            codec._by_content_type.update(offered)
+
+    def test_decode_payload(self):
+        values, texts = decode_payload(' { "A" : [1, 2] ,"B":{"C": null} } ')
+        nt.assert_equal(values, {'A': [1, 2], 'B': {'C': None}})
+        nt.assert_equal(texts, {'A': '[1, 2]', 'B': '{"C": null}'})
+        nt.assert_equal(decode_payload('{}'), ({}, {}))
+        nt.assert_equal(decode_payload('[1]'), ([1], {}))
+
+    @run_in_loop
     async def test_bad_event_receive(self):
         data = {'DATA': {'ID': 3876, 'DATA': 'important things'}, 'PARTNER_ID': 1}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data)), State.BadRequestMandatoryKey)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_receive_with_event(self):
         this_event = Event(**{'ID': 1})
         data = {'DATA': {'ID': 3876, 'DATA': 'important things'}, 'PARTNER_ID': 1}
         nt.assert_equal(await self.tc.receive(TestRequest(data=data), this_event=this_event),
                         State.RequestReceived)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_store_db_error(self):
         data = {'LOCAL_ID': 238, 'PARTNER_ID': 100, 'EVENT_ID': 100,
                 'DATA': json.dumps({'ID': 238, 'DATA': 'confuser cat'})}
@@ -105,7 +177,7 @@ class TestTransaction:
         self.tc.data.append(Task(**data))
         nt.assert_equal(await self.tc.store(), State.BadRequestDBError)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_bad_store_conflict(self):
         data = {'LOCAL_ID': 238, 'PARTNER_ID': 1, 'EVENT_ID': 1,
                 'DATA': json.dumps({'ID': 238, 'DATA': 'confuser cat'})}
@@ -113,7 +185,7 @@ class TestTransaction:
         self.tc.data.append(Task(**data))
         nt.assert_equal(await self.tc.store(), State.ConflictRequest)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_store(self):
         data = {'LOCAL_ID': 238, 'PARTNER_ID': 1, 'EVENT_ID': 2,
                 'DATA': json.dumps({'ID': 238, 'DATA': 'confuser cat update'})}
@@ -121,26 +193,38 @@ class TestTransaction:
         self.tc.data.append(Task(**data))
         nt.assert_equal(await self.tc.store(), State.RequestStored)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_spread(self):
         for row in self.dbh.execute("SELECT ID FROM TASKS WHERE STATE=1"):
             nt.assert_equal(await self.tc.spread(row['ID']), State.RequestStored)
 
-    @unittest_run_loop
+    @run_in_loop
+    async def test_spread_all(self):
+        for local_id in (301, 302, 303):
+            self.dbh.execute('INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID) VALUES (?, 1, 3)', [local_id])
+        nt.assert_equal(await self.tc.spread_all(limit=2), 2)
+        states = [row['STATE'] for row in self.dbh.execute('SELECT STATE FROM TASKS ORDER BY ID')]
+        nt.assert_equal(states, [3, 3, 1, 1])
+        nt.assert_equal(await self.tc.spread_all(), 2)
+        nt.assert_equal(await self.tc.spread_all(), 0)
+        steps = self.dbh.execute('SELECT COUNT(*) STEPS FROM PROCESSING_STEPS WHERE STATE = 1').fetchone()
+        nt.assert_equal(steps['STEPS'], 1 + 1 + 3)  # one from the test data, one subscriber per task
+
+    @run_in_loop
     async def test_bad_spread(self):
         self.dbh.execute('DROP TABLE PROCESSING_STEPS')
         self.dbh.commit()
         with nt.assert_raises(sqlite3.Error):
             await self.tc.spread(task_id=1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_datetime(self):
         dac = DataAccessBase(self.dbh, 'TASKS')
         await dac.read()
         for row in dac.data:
             nt.assert_is_instance(row.updated_on, datetime)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_read(self):
         dac = DataAccessBase(self.dbh, 'PARTNERS')
         await dac.read()
@@ -149,25 +233,25 @@ class TestTransaction:
             nt.assert_equal(record.name, 'PARTNERS')
             nt.assert_greater(record.id, 0)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_read_joined_tasks(self):
         dac = DataAccessBase(self.dbh, 'TASKS')
         await dac.read()
         nt.assert_equal(len(dac.data), 1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_read_joined_processing_steps(self):
         dac = DataAccessBase(self.dbh, 'PROCESSING_STEPS')
         await dac.read(entity_id=1)
         nt.assert_equal(len(dac.data), 1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_read_joined_by_id(self):
         dac = DataAccessBase(self.dbh, 'TASKS')
         await dac.read(entity_id=1)
         nt.assert_equal(len(dac.data), 1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_update_state(self):
         dac = ProcessingAccess(self.dbh)
         nt.assert_equal(await dac.update_state(0), 0)
@@ -183,7 +267,7 @@ class TestTransaction:
         await dac.read(entity_id=1, no_join=True)
         nt.assert_equal(dac.get_result(False).state, 5)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_process(self):
         dac = ProcessingAccess(self.dbh)
         await dac.read(entity_id=1)
@@ -192,7 +276,29 @@ class TestTransaction:
         result = await self.tc.process(dac.get_result(), client)
         nt.assert_equal(result, State.RequestStored)
 
-    @unittest_run_loop
+    @run_in_loop
+    async def test_trace(self):
+        tracer = Tracer(capacity=100)
+        tc = Transaction(self.dbh, tracer=tracer, trace_id='t1')
+        data = {'DATA': {'ID': 3877}, 'PARTNER_ID': 1, 'EVENT_ID': 1}
+        nt.assert_equal(await tc.receive(TestRequest(data=data)), State.RequestReceived)
+        nt.assert_equal(await tc.store(), State.RequestStored)
+        nt.assert_equal([x['NAME'] for x in tracer.spans(trace_id='t1')], ['receive.read', 'receive.decode', 'store'])
+        store = tracer.spans(name='store')[0]
+        nt.assert_equal(store['STATE'], 'RequestStored')
+        nt.assert_true({'QUEUE_MS', 'DUPLICATE_CHECK_MS', 'INSERT_MS', 'COMMIT_MS'}.issubset(store))
+        nt.assert_equal(tracer.trace_of(tc.task.id), 't1')
+        step = ProcessingStep(ID=1, TASK_ID=tc.task.id, PARTNER_ID=1)
+        client = RecordingClient(web.HTTPOk())
+        nt.assert_equal(await Transaction(self.dbh, tracer=tracer).process(step, client), State.RequestStored)
+        nt.assert_equal(client.sent_headers[0][TRACE_HEADER], 't1')
+        nt.assert_equal(tracer.spans(name='process')[0]['STATUS'], 200)
+        step.task_id = 0  # an untraced task is delivered without trace id
+        await Transaction(self.dbh, tracer=tracer).process(step, client)
+        nt.assert_not_in(TRACE_HEADER, client.sent_headers[1])
+        nt.assert_equal(len(tracer.spans(name='process')), 1)
+
+    @run_in_loop
     async def test_bad_process(self):
         dac = ProcessingAccess(self.dbh)
         await dac.read(entity_id=1)
@@ -200,10 +306,36 @@ class TestTransaction:
         client = TestClient(web.HTTPBadRequest())
         nt.assert_equal(await self.tc.process(dac.get_result(), client), State.BadRequest)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_no_client_connection(self):
         dac = ProcessingAccess(self.dbh)
         await dac.read(entity_id=1)
         nt.assert_greater_equal(len(dac.data), 1)
         client = ClientSession(loop=self.loop, conn_timeout=1.0)
         nt.assert_equal(await self.tc.process(dac.get_result(), client), State.BadRequest)
+
+    @run_in_loop
+    async def test_retry_with_backoff(self):
+        tc = Transaction(self.dbh, retry_policy=RetryPolicy(base_delay=60, jitter=0, max_attempts=2))
+        dac = ProcessingAccess(self.dbh)
+        await dac.read(entity_id=1, no_join=True)
+        step: ProcessingStep = dac.get_result()
+        nt.assert_equal(await tc.process(step, DeadClient()), State.BadRequest)
+        await dac.read(entity_id=1, no_join=True)
+        nt.assert_equal((dac.get_result().state, dac.get_result().attempts), (State.InProgress.code, 1))
+        due = [x.id for batch in [batch async for batch in dac.iter_by_state(State.InProgress.code)] for x in batch]
+        nt.assert_not_in(1, due)
+        nt.assert_almost_equal(await dac.seconds_to_next_attempt(), 60, delta=2)
+        nt.assert_equal(await tc.process(dac.get_result(), DeadClient()), State.BadRequest)
+        await dac.read(entity_id=1, no_join=True)
+        nt.assert_equal((dac.get_result().state, dac.get_result().attempts), (State.DeadLetter.code, 2))
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(base_delay=1, factor=2, max_delay=5, jitter=0.5, max_attempts=3)
+        nt.assert_true(0.5 <= policy.delay(1) <= 1)
+        nt.assert_true(2 <= policy.delay(3) <= 4)
+        nt.assert_true(2.5 <= policy.delay(10) <= 5)
+        nt.assert_false(policy.gives_up(2))
+        nt.assert_true(policy.gives_up(3))
+        with nt.assert_raises(ValueError):
+            RetryPolicy(jitter=2)
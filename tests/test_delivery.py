@@ -0,0 +1,285 @@
+import nose.tools as nt
+import asyncio
+import sqlite3
+from collections import Counter
+from configparser import ConfigParser
+
+from aiohttp.test_utils import TestServer
+from loop_runner import run_in_loop
+from aiohttp import web
+from aiohttp import ClientSession, ClientConnectionError
+
+from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.entity import *
+from asynctransaction.server.client import Client, ClientBatch
+from asynctransaction.data.access.circuit_breaker import CircuitBreakers
+from asynctransaction.server.delivery import DeliveryEngine, ConnectionStats, create_client_session
+
+
+# noinspection PyMissingConstructor
+class SlowClient(ClientSession):
+    """Answers after a delay per port and counts the concurrent requests per port"""
+
+    def __init__(self, delays: Dict[str, float]):
+        self.delays = delays
+        self.running: Counter = Counter()
+        self.max_running: Counter = Counter()
+        self.max_total = 0
+
+    async def request(self, method, url, **kwargs) -> web.Response:
+        port = url.split(':')[2].split('/')[0]
+        self.running[port] += 1
+        self.max_running[port] = max(self.max_running[port], self.running[port])
+        self.max_total = max(self.max_total, sum(self.running.values()))
+        await asyncio.sleep(self.delays[port])
+        self.running[port] -= 1
+        return web.HTTPOk()
+
+
+# noinspection PyMissingConstructor
+class FlakyClient(ClientSession):
+    """Can't connect while down and counts the requests"""
+
+    def __init__(self):
+        self.down = True
+        self.requests = 0
+
+    async def request(self, method, url, **kwargs) -> web.Response:
+        self.requests += 1
+        if self.down:
+            raise ClientConnectionError('connection refused')
+        return web.HTTPOk()
+
+
+class TestDelivery:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        with open('asynctransaction/data/model/test_data.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    @staticmethod
+    def steps(partner_id: int, port: int, count: int, first_id: int = 1) -> List[ProcessingStep]:
+        return [ProcessingStep(ID=first_id + x, TASK_ID=1, PARTNER_ID=partner_id, IP_ADDRESS='127.0.0.1', PORT=port)
+                for x in range(count)]
+
+    @run_in_loop
+    async def test_limits(self):
+        client = SlowClient({'3030': 0.02, '3000': 0.02})
+        engine = DeliveryEngine(self.dbh, max_in_flight=5, max_per_partner=3)
+        for step in self.steps(1, 3030, 10) + self.steps(2, 3000, 10, first_id=11):
+            nt.assert_true(engine.submit(step, client))
+        await engine.join()
+        await engine.close()
+        nt.assert_equal(client.max_running['3030'], 3)
+        nt.assert_equal(client.max_total, 5)
+        nt.assert_equal(engine.results['RequestStored'], 20)
+        nt.assert_equal(engine.pending, 0)
+
+    @run_in_loop
+    async def test_slow_partner(self):
+        client = SlowClient({'3030': 0.5, '3000': 0.01})
+        engine = DeliveryEngine(self.dbh, max_in_flight=10, max_per_partner=2)
+        for step in self.steps(1, 3030, 4) + self.steps(2, 3000, 10, first_id=11):
+            engine.submit(step, client)
+        await asyncio.sleep(0.2)
+        # the fast partner is done while the slow one still holds its own slots
+        nt.assert_equal(engine.results['RequestStored'], 10)
+        nt.assert_equal(engine.stats()['queued_per_partner'], {1: 4})
+        await engine.close()
+        nt.assert_equal(engine.pending, 0)
+
+    @run_in_loop
+    async def test_no_double_submit(self):
+        client = SlowClient({'3030': 0.01})
+        engine = DeliveryEngine(self.dbh, max_per_partner=1, max_queued_per_partner=2)
+        steps = self.steps(1, 3030, 3)
+        nt.assert_true(engine.submit(steps[0], client))
+        nt.assert_false(engine.submit(steps[0], client))
+        nt.assert_true(engine.submit(steps[1], client))
+        nt.assert_false(engine.submit(steps[2], client))  # queue of the partner is full
+        await engine.join()
+        nt.assert_false(engine.submit(steps[0], client))  # finished during this pass
+        await engine.begin_pass()
+        nt.assert_true(engine.submit(steps[2], client))
+        await engine.join()
+        await engine.close()
+
+    @run_in_loop
+    async def test_circuit_breaker(self):
+        client = FlakyClient()
+        engine = DeliveryEngine(self.dbh, max_per_partner=1,
+                                circuit_breakers=CircuitBreakers(failure_threshold=3, probe_interval=0.1))
+        for step in self.steps(1, 3030, 5):
+            engine.submit(step, client)
+        await engine.join()
+        # the queued steps of the partner are skipped as soon as its circuit is open
+        nt.assert_equal(client.requests, 3)
+        nt.assert_equal(engine.results['CircuitOpen'], 2)
+        nt.assert_equal(engine.circuit_breakers.get(1).state, 'open')
+        await engine.begin_pass()
+        nt.assert_false(engine.submit(self.steps(1, 3030, 1, first_id=6)[0], client))
+        nt.assert_equal(client.requests, 3)
+        await asyncio.sleep(0.1)
+        # a failed probe opens the circuit again
+        await engine.begin_pass()
+        for step in self.steps(1, 3030, 2, first_id=7):
+            engine.submit(step, client)
+        await engine.join()
+        nt.assert_equal(client.requests, 4)
+        nt.assert_equal(engine.circuit_breakers.get(1).to_dict()['OPENED'], 2)
+        await asyncio.sleep(0.1)
+        client.down = False
+        await engine.begin_pass()
+        nt.assert_true(engine.submit(self.steps(1, 3030, 1, first_id=9)[0], client))
+        await engine.join()
+        await engine.close()
+        nt.assert_equal(engine.circuit_breakers.get(1).state, 'closed')
+        nt.assert_equal(engine.results['RequestStored'], 1)
+
+
+class CountingBatch(ClientBatch):
+    sizes: List[int] = []
+
+    async def post(self) -> web.Response:
+        CountingBatch.sizes.append(len(await self.request.json()))
+        return await super().post()
+
+
+class TestBatchDelivery:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.server: TestServer = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        self.dbh.executescript(open('asynctransaction/data/model/transaction.sql').read())
+        CountingBatch.sizes = []
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    async def start_partner(self) -> int:
+        partner = web.Application()
+        partner.router.add_route('*', '/transactions/{name}/batch', CountingBatch)
+        self.server = TestServer(partner, host='127.0.0.1')
+        await self.server.start_server()
+        return self.server.port
+
+    @staticmethod
+    def steps(port: int, count: int, batch_size: int, data: str = '{"ID": 1}', **kwargs) -> List[ProcessingStep]:
+        return [ProcessingStep(ID=x + 1, TASK_ID=1, PARTNER_ID=1, EVENT_ID=1, IP_ADDRESS='127.0.0.1', PORT=port,
+                               DATA=data, BATCH_SIZE=batch_size, **kwargs) for x in range(count)]
+
+    @run_in_loop
+    async def test_batch_size(self):
+        port = await self.start_partner()
+        client = ClientSession()
+        engine = DeliveryEngine(self.dbh)
+        for step in self.steps(port, 25, 10):
+            nt.assert_true(engine.submit(step, client))
+        await engine.join()
+        await engine.close()
+        await client.close()
+        await self.server.close()
+        nt.assert_equal(CountingBatch.sizes, [10, 10, 5])
+        nt.assert_equal(engine.results['RequestStored'], 25)
+        nt.assert_equal(engine.batches, 3)
+        nt.assert_equal(engine.pending, 0)
+
+    @run_in_loop
+    async def test_batch_bytes_and_linger(self):
+        port = await self.start_partner()
+        client = ClientSession()
+        engine = DeliveryEngine(self.dbh, batch_max_bytes=30, batch_linger=0.01)
+        for step in self.steps(port, 5, 100):
+            engine.submit(step, client)
+        await asyncio.sleep(0.2)  # the last step is sent when the linger time is over
+        nt.assert_equal(engine.results['RequestStored'], 5)
+        await engine.close()
+        await client.close()
+        await self.server.close()
+        nt.assert_equal(CountingBatch.sizes, [3, 2])
+
+    @run_in_loop
+    async def test_batch_item_results(self):
+        port = await self.start_partner()
+        client = ClientSession()
+        engine = DeliveryEngine(self.dbh)
+        steps = self.steps(port, 3, 10) + self.steps(port, 1, 10, data='{"NO_ID": 4}')
+        steps[-1].id = 4
+        for step in steps:
+            engine.submit(step, client)
+        await engine.join()
+        await engine.close()
+        await client.close()
+        await self.server.close()
+        nt.assert_equal(engine.results['RequestStored'], 3)
+        nt.assert_equal(engine.results['BadRequest'], 1)
+        nt.assert_equal(engine.state_buffer.flushed, 4)
+
+    @run_in_loop
+    async def test_batch_no_partner(self):
+        client = ClientSession()
+        engine = DeliveryEngine(self.dbh)
+        for step in self.steps(9, 4, 10):
+            engine.submit(step, client)
+        await engine.join()
+        await engine.close()
+        await client.close()
+        nt.assert_equal(engine.results['BadRequest'], 4)
+        nt.assert_equal(engine.batches, 1)
+        nt.assert_equal(engine.circuit_breakers.get(1).failures, 1)  # one request, one failure
+        nt.assert_equal(engine.state_buffer.flushed, 4)
+
+
+class TestClientSession:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    @run_in_loop
+    async def test_connection_reuse(self):
+        partner = web.Application()
+        partner.router.add_route('*', '/transactions/{name}', Client)
+        server = TestServer(partner, host='127.0.0.1')
+        await server.start_server()
+        config = ConfigParser()
+        config.read_string('[CLIENT]\nlimit_per_host: 1\n')
+        stats = ConnectionStats()
+        client = create_client_session(config, stats)
+        engine = DeliveryEngine(self.dbh)
+        for x in range(5):
+            engine.submit(ProcessingStep(ID=x + 1, IP_ADDRESS='127.0.0.1', PORT=server.port), client)
+        await engine.join()
+        await client.close()
+        await server.close()
+        nt.assert_equal(engine.results['RequestStored'], 5)
+        await engine.close()
+        nt.assert_equal(stats.created, 1)
+        nt.assert_equal(stats.reused, 4)
@@ -1,9 +1,11 @@
+from configparser import ConfigParser
+from unittest import SkipTest
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp.web import Application, Response, HTTPOk
 from aiohttp import ClientSession
 
 from asynctransaction.server.distributor import *
-from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.access.base import prepare_connection, DataAccessBase
 from asynctransaction.data.access.partner import Partner
 
 
@@ -50,6 +52,110 @@ class MyAppTestCase(AioHTTPTestCase):
         text = await request.text()
         self.assertEqual(text, '/orders/239/2')
 
+    @unittest_run_loop
+    async def test_idempotent_post(self):
+        for __ in range(2):
+            request = await self.client.request(
+                "PUT", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 245}}',
+                headers={'Idempotency-Key': 'a1'})
+            self.assertEqual(request.status, 201)
+            self.assertEqual(await request.text(), '/orders/245/2')
+        self.assertEqual(request.headers.get('Idempotent-Replayed'), 'true')
+        request = await self.client.request(
+            "PUT", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 246}}',
+            headers={'Idempotency-Key': 'a1'})
+        self.assertEqual(await request.text(), '/orders/245/2')
+        request = await self.client.request(
+            "PUT", "/transactions/orders", data='{"PARTNER_ID": 2,  "DATA": {"ID": 245}}',
+            headers={'Idempotency-Key': 'a1'})
+        self.assertEqual(await request.text(), '/orders/245/3')
+        self.assertNotIn('Idempotent-Replayed', request.headers)
+
+    @unittest_run_loop
+    async def test_traces(self):
+        request = await self.client.request(
+            "POST", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 241}}',
+            headers={'X-Trace-Id': 'abc-1'})
+        self.assertEqual(request.status, 201)
+        self.assertEqual(request.headers.get('X-Trace-Id'), 'abc-1')
+        request = await self.client.request("POST", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 242}}')
+        self.assertNotIn('X-Trace-Id', request.headers)
+        request = await self.client.request("GET", "/admin/traces?trace_id=abc-1")
+        self.assertEqual(request.status, 200)
+        answer = await request.json()
+        self.assertEqual([x['NAME'] for x in answer['SPANS']][:5],
+                         ['receive.event', 'receive.read', 'receive.decode', 'store', 'ingest'])
+        self.assertEqual(answer['SPANS'][4]['STATUS'], 201)
+        self.assertEqual(answer['STATS']['started'], 1)
+        request = await self.client.request("GET", "/admin/traces?limit=x")
+        self.assertEqual(request.status, 400)
+
+    @unittest_run_loop
+    async def test_batch_post(self):
+        request = await self.client.request(
+            "POST", "/transactions/orders/batch",
+            data='[{"PARTNER_ID": 1, "DATA": {"ID": 239}}, {"PARTNER_ID": 2, "DATA": {"ID": 240}}]')
+        self.assertEqual(request.status, 201)
+        self.assertEqual(await request.json(), [{'STATUS': 201, 'PATH': '/orders/239/2'},
+                                                {'STATUS': 201, 'PATH': '/orders/240/3'}])
+
+    @unittest_run_loop
+    async def test_batch_mixed(self):
+        request = await self.client.request(
+            "POST", "/transactions/orders/batch",
+            data='[{"PARTNER_ID": 1, "DATA": {"ID": 238}}, {"PARTNER_ID": 100, "DATA": {"ID": 241}}, '
+                 '{"DATA": {"ID": 242}}, "text", {"PARTNER_ID": 1, "DATA": {"ID": 243}}, '
+                 '{"PARTNER_ID": 1, "DATA": {"ID": 243}}]')
+        self.assertEqual(request.status, 207)
+        self.assertEqual([x['STATUS'] for x in await request.json()], [409, 400, 400, 400, 201, 409])
+
+    @unittest_run_loop
+    async def test_batch_ndjson(self):
+        request = await self.client.request(
+            "PUT", "/transactions/orders/batch",
+            data='{"PARTNER_ID": 1, "DATA": {"ID": 238}}\n{"PARTNER_ID": 1\n{"PARTNER_ID": 1, "DATA": {"ID": 238}}\n',
+            headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(request.status, 207)
+        self.assertEqual([x['STATUS'] for x in await request.json()], [201, 400, 201])
+
+    @unittest_run_loop
+    async def test_batch_msgpack(self):
+        if 'msgpack' not in codec.CODECS:
+            raise SkipTest('msgpack is not installed')
+        msgpack = codec.CODECS['msgpack']
+        request = await self.client.request(
+            "POST", "/transactions/orders/batch", data=msgpack.dumps([{'PARTNER_ID': 1, 'DATA': {'ID': 239}}]),
+            headers={'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'})
+        self.assertEqual(request.status, 201)
+        self.assertEqual(request.content_type, 'application/msgpack')
+        self.assertEqual(msgpack.loads(await request.read()), [{'STATUS': 201, 'PATH': '/orders/239/2'}])
+
+    @unittest_run_loop
+    async def test_batch_bad_json(self):
+        request = await self.client.request("POST", "/transactions/orders/batch", data='[{"PARTNER_ID": 1')
+        self.assertEqual(request.status, 400)
+
+    @unittest_run_loop
+    async def test_post_wakes_up_spread(self):
+        request = await self.client.request(
+            "POST", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 244, "ORDER": 12}}')
+        self.assertEqual(request.status, 201)
+        task = DataAccessBase(self.app['DISTRIBUTOR_DB'], 'TASKS')
+        for __ in range(30):  # far below the poll interval
+            await asyncio.sleep(0.01)
+            await task.read(entity_id=2, no_join=True)
+            if task.get_result().state == State.Published.code:
+                break
+        self.assertEqual(task.get_result().state, State.Published.code)
+
+    @unittest_run_loop
+    async def test_spread_survives_db_error(self):
+        await self.app['DISTRIBUTOR_DB'].executor.write(
+            lambda con: con.execute('ALTER TABLE TASKS RENAME TO TASKS_AWAY'))
+        wake_up_spread(self.app)
+        await asyncio.sleep(0.05)  # the pass fails on the missing table
+        self.assertFalse(self.app['LIKEMC_SPREAD'].done())
+
     @unittest_run_loop
     async def test_bad_post(self):
         request = await self.client.request(
@@ -70,6 +176,16 @@ class MyAppTestCase(AioHTTPTestCase):
             data='{"PARTNER_ID": 1,  "DATA": {"ORDER": 12}}')
         self.assertEqual(request.status, 400)
 
+    @unittest_run_loop
+    async def test_no_object(self):
+        request = await self.client.request("POST", "/transactions/orders", data='[1, 2]')
+        self.assertEqual(request.status, 400)
+        if 'msgpack' not in codec.CODECS:
+            return
+        request = await self.client.request("POST", "/transactions/orders", data=codec.CODECS['msgpack'].dumps([1, 2]),
+                                            headers={'Content-Type': 'application/msgpack'})
+        self.assertEqual(request.status, 400)
+
     @unittest_run_loop
     async def test_bad_store(self):
         request = await self.client.request(
@@ -86,6 +202,27 @@ class MyAppTestCase(AioHTTPTestCase):
         text = await request.text()
         self.assertEqual(text, '/orders/111/2')
 
+    @unittest_run_loop
+    async def test_metrics(self):
+        await self.client.request(
+            "POST", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 246}}')
+        task = create_task_access(self.app['DISTRIBUTOR_DB'])
+        for __ in range(100):  # until the spread of the woken up loop is done
+            if State.New.code not in await task.count_by_state((State.New.code,)):
+                break
+            await asyncio.sleep(0.01)
+        request = await self.client.request("GET", "/admin/metrics")
+        self.assertEqual(request.status, 200)
+        self.assertTrue(request.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = await request.text()
+        self.assertIn('asynctransaction_stage_seconds_bucket{stage="ingest",le="+Inf"}', text)
+        self.assertIn('asynctransaction_stage_seconds_count{stage="store"}', text)
+        self.assertIn('asynctransaction_tasks_total{result="RequestStored"}', text)
+        self.assertIn('asynctransaction_db_execute_seconds_count{function="_store_unique"}', text)
+        self.assertIn('asynctransaction_queue_depth{table="TASKS",state="1"} 0', text)
+        self.assertIn('asynctransaction_queue_depth{table="PROCESSING_STEPS",state="2"}', text)
+        self.assertNotIn('asynctransaction_queue_depth{table="TASKS",state="3"}', text)
+
     @unittest_run_loop
     async def test_get(self):
         request = await self.client.request("GET", "/admin/partners/127.0.0.1:3030")
@@ -93,6 +230,7 @@ class MyAppTestCase(AioHTTPTestCase):
         text = await request.text()
         self.assertIsInstance(text, str)
         self.assertTrue(text.find('IP_ADDRESS'))
+        self.assertIn('Circuit: closed', text)
 
     @unittest_run_loop
     async def test_only_port(self):
@@ -129,6 +267,17 @@ class MyAppTestCase(AioHTTPTestCase):
         await partner.read()
         self.assertEqual(len([a for a in filter(lambda x: x.port == 20, partner.data)]), 1)
 
+    @unittest_run_loop
+    async def test_change_partner_batch_size_not_valid(self):
+        for batch_size in ('many', '-1'):
+            request = await self.client.request(
+                "POST", "/admin/partners/3030",
+                data={'ID': '0', 'IP_ADDRESS': '127.0.0.1', 'PORT': '21', 'BATCH_SIZE': batch_size})
+            self.assertEqual(request.status, 400)
+        partner = Partner(self.app['DISTRIBUTOR_DB'])
+        await partner.read()
+        self.assertEqual([a for a in filter(lambda x: x.port == 21, partner.data)], [])
+
     @unittest_run_loop
     async def test_get_not_found(self):
         request = await self.client.request("GET", "/admin/partners/127.1.1.1:3030")
@@ -202,3 +351,35 @@ class MyAppTestCase(AioHTTPTestCase):
         self.assertEqual(len([a for a in filter(lambda x: x.port == 203, subscriber.data)]), 2)
 
     # todo: event handling, add, change, assign to group
+
+
+class SpreadAllTestCase(AioHTTPTestCase):
+    """
+    [SPREAD] chunk: 0 spreads all new tasks with one statement
+    """
+
+    async def get_application(self):
+        test_app = await MyAppTestCase.get_application(self)
+        test_app['DISTRIBUTOR_CONFIG'] = ConfigParser()
+        test_app['DISTRIBUTOR_CONFIG'].read_dict({'SPREAD': {'chunk': '0'}})
+        return test_app
+
+    @unittest_run_loop
+    async def test_delivery_runs(self):
+        request = await self.client.request(
+            "POST", "/transactions/orders", data='{"PARTNER_ID": 1,  "DATA": {"ID": 247}}')
+        self.assertEqual(request.status, 201)
+        processing_step = create_processing_step_access(self.app['DISTRIBUTOR_DB'])
+        for __ in range(100):  # until the steps of the test data and of the new task are delivered
+            if len(await processing_step.count_by_state((State.New.code, State.InProgress.code))) == 0:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(await processing_step.count_by_state((State.New.code, State.InProgress.code)), {})
+        self.assertEqual(await create_task_access(self.app['DISTRIBUTOR_DB']).count_by_state((State.New.code,)), {})
+
+    @unittest_run_loop
+    async def test_read_batch_config(self):
+        config = ConfigParser()
+        config.read_dict({'SPREAD': {'read_batch': '0'}})
+        with self.assertRaises(ValueError):
+            await start_background_tasks({'DISTRIBUTOR_CONFIG': config})
@@ -3,7 +3,7 @@ from typing import Dict
 import sqlite3
 import asyncio
 
-from aiohttp.test_utils import unittest_run_loop
+from loop_runner import run_in_loop
 
 from asynctransaction.data.entity.event import Event
 from asynctransaction.data.access.event import Event as EventAccess
@@ -29,6 +29,7 @@ class TestEvent:
 
     def teardown(self):
         self.dbh.close()
+        self.loop.close()
 
     def test_ctor(self):
         ev = Event()
@@ -48,7 +49,7 @@ class TestEvent:
         nt.assert_dict_contains_subset(self.record, ev.to_dict())
         nt.assert_dict_contains_subset({'DELETED': 0, 'ID': 1}, ev.to_dict())
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_event_access(self):
         ev = EventAccess(self.dbh)
         data = await ev.get_event_data(url='orders', method='POST')
@@ -0,0 +1,101 @@
+import nose.tools as nt
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import os
+
+from loop_runner import run_in_loop
+
+from asynctransaction.data.access.base import prepare_connection, profile_pragmas, row_keys, select_tuples
+from asynctransaction.data.access.executor import DbExecutor
+from asynctransaction.data.access.event import Event as EventAccess
+from asynctransaction.data.entity import Event, Partner, Task
+
+
+class TestExecutor:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.directory: tempfile.TemporaryDirectory = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dbh = prepare_connection(os.path.join(self.directory.name, 'transaction.db'), readers=2, queue_size=3)
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        with open('asynctransaction/data/model/test_data.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        self.dbh.commit()
+
+    def teardown(self):
+        self.dbh.close()
+        self.directory.cleanup()
+        self.loop.close()
+
+    def test_readers_need_factory(self):
+        with nt.assert_raises(ValueError):
+            DbExecutor(self.dbh, readers=1)
+
+    def test_memory_without_readers(self):
+        dbh = prepare_connection(readers=2)
+        nt.assert_is_none(dbh.executor._readers)
+        dbh.close()
+
+    @run_in_loop
+    async def test_bounded_reads(self):
+        events = await asyncio.gather(*[EventAccess(self.dbh).get_event_data(url='orders', method='PUT')
+                                        for _ in range(10)])
+        nt.assert_equal({x.id for x in events}, {2})
+        stats = self.dbh.executor.stats()
+        nt.assert_equal(stats['pending'], 0)
+        nt.assert_less_equal(stats['max_pending'], 3)
+        nt.assert_equal(stats['executed'], 10)
+        nt.assert_greater(stats['readers'], 0)
+
+    @run_in_loop
+    async def test_write_runs_off_loop(self):
+        def thread_name(con: sqlite3.Connection):
+            return threading.current_thread().name
+        nt.assert_true((await self.dbh.executor.write(thread_name)).startswith('likemc-db-writer'))
+        nt.assert_true((await self.dbh.executor.read(thread_name)).startswith('likemc-db-reader'))
+
+    def test_fast_profile(self):
+        dbh = prepare_connection(os.path.join(self.directory.name, 'fast.db'), readers=1, cached_statements=16,
+                                 pragmas=profile_pragmas('fast', cache_size=-2000))
+        nt.assert_equal(dbh.pragmas['journal_mode'], 'wal')
+        nt.assert_equal(dbh.pragmas['synchronous'], '1')
+        nt.assert_equal(dbh.pragmas['cache_size'], '-2000')
+        nt.assert_equal(dbh.pragmas['temp_store'], '2')
+        reader = dbh.executor._connect()
+        nt.assert_equal(reader.pragmas, dbh.pragmas)
+        reader.close()
+        dbh.close()
+
+    def test_bad_profile(self):
+        with nt.assert_raises(ValueError):
+            profile_pragmas('turbo')
+        with nt.assert_raises(ValueError):
+            profile_pragmas('fast', locking_mode='EXCLUSIVE')
+        with nt.assert_raises(ValueError):
+            profile_pragmas('fast', cache_size='1; DROP TABLE TASKS')
+
+    def test_select_tuples(self):
+        keys, rows = select_tuples(self.dbh, 'SELECT id, url, Method FROM EVENTS WHERE ID = ?', [2])
+        nt.assert_equal(keys, ('ID', 'URL', 'METHOD'))
+        nt.assert_is(row_keys(rows.description), keys)
+        events = Event.from_rows(keys, rows)
+        nt.assert_equal([(x.id, x.url, x.method) for x in events], [(2, 'orders', 'PUT')])
+        nt.assert_equal(self.dbh.execute('SELECT id FROM EVENTS WHERE ID = 2').fetchone(), {'ID': 2})
+
+    def test_from_rows_defaults(self):
+        keys = ('ID', 'IP_ADDRESS', 'BATCH_SIZE')
+        partner, = Partner.from_rows(keys, [(3, 'localhost', None)])
+        nt.assert_equal((partner.id, str(partner.ip_address), partner.port, partner.format, partner.batch_size,
+                         partner.description), (3, '127.0.0.1', '80', 'json', 0, ''))
+        nt.assert_is(Partner.row_layout(keys), Partner.row_layout(keys))
+        task, = Task.from_rows(('ID', 'LOCAL_ID', 'DATA'), [(4, 0, '{"ID": 12}')])
+        nt.assert_equal((task.local_id, task.state, task.idempotency_key), (12, 1, None))
@@ -0,0 +1,54 @@
+import nose.tools as nt
+import threading
+
+from asynctransaction.metrics import Registry, render_gauge
+
+
+class TestMetrics:
+    def __init__(self):
+        self.registry: Registry = None
+
+    def setup(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_total', 'Test counter', ('result',))
+        counter.inc('ok')
+        counter.inc('ok', amount=2)
+        counter.inc('fail')
+        nt.assert_equal(counter.value('ok'), 3)
+        nt.assert_is(self.registry.counter('test_total', 'Test counter', ('result',)), counter)
+        nt.assert_equal(self.registry.render(), ['# HELP test_total Test counter', '# TYPE test_total counter',
+                                                 'test_total{result="fail"} 1', 'test_total{result="ok"} 3'])
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Test histogram', ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, 'ingest')
+        nt.assert_equal(histogram.render(), [
+            '# HELP test_seconds Test histogram', '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="ingest",le="0.1"} 2',
+            'test_seconds_bucket{stage="ingest",le="1.0"} 3',
+            'test_seconds_bucket{stage="ingest",le="+Inf"} 4',
+            'test_seconds_sum{stage="ingest"} 3.65',
+            'test_seconds_count{stage="ingest"} 4'])
+
+    def test_timer_and_threads(self):
+        histogram = self.registry.histogram('test_seconds', 'Test histogram', ('stage',))
+
+        def observe():
+            for __ in range(1000):
+                with histogram.time('store'):
+                    pass
+
+        threads = [threading.Thread(target=observe) for __ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        nt.assert_equal(histogram.count('store'), 4000)
+
+    def test_gauge(self):
+        lines = render_gauge('test_depth', 'Rows', ('table', 'state'), {('TASKS', 1): 3, ('TASKS', '"x"'): 0.5})
+        nt.assert_equal(lines, ['# HELP test_depth Rows', '# TYPE test_depth gauge',
+                                'test_depth{table="TASKS",state="\\"x\\""} 0.5', 'test_depth{table="TASKS",state="1"} 3'])
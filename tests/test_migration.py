@@ -0,0 +1,187 @@
+import asyncio
+import sqlite3
+import nose.tools as nt
+from typing import Any, Dict, List
+
+from loop_runner import run_in_loop
+
+from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.entity import Partner
+from asynctransaction.data.access.migration import (MIGRATIONS, SCHEMA, SCHEMA_VERSION, migrate, missing, upgrade,
+                                                    version)
+
+# schema of a data base of an earlier release, before idempotency keys, retries, codecs and batches
+OLD_SCHEMA = """
+CREATE TABLE EVENTS (ID integer primary key, URL text, METHOD text, DESCRIPTION text,
+    CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    DELETED integer default(0));
+CREATE TABLE PARTNERS (ID integer primary key, IP_ADDRESS TEXT, PORT integer, DESCRIPTION text,
+    CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    DELETED integer default(0));
+CREATE TABLE SUBSCRIBERS (ID integer primary key, EVENT_ID integer, PARTNER_ID integer,
+    CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    DELETED integer default(0));
+CREATE TABLE TASKS (ID integer primary key, LOCAL_ID integer, PARTNER_ID integer, EVENT_ID integer, DATA TEXT,
+    STATE INTEGER DEFAULT(1), CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')), DELETED integer default(0));
+CREATE INDEX TASK_EVENT_FK ON TASKS(EVENT_ID);
+CREATE TABLE PROCESSING_STEPS (ID integer primary key, TASK_ID integer, PARTNER_ID integer,
+    STATE INTEGER DEFAULT(1), CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
+    DELETED integer default(0));
+INSERT INTO EVENTS (URL, METHOD) VALUES ('orders', 'POST');
+INSERT INTO PARTNERS (IP_ADDRESS, PORT) VALUES ('127.0.0.1', 3011);
+INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID, DATA) VALUES (1, 1, 1, '{}');
+INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID, STATE) VALUES (1, 1, 2);
+"""
+
+
+class TestMigration:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    def columns(self, table: str) -> List[str]:
+        return [row['NAME'] for row in self.dbh.execute(f'PRAGMA table_info({table})')]
+
+    @staticmethod
+    def definition(con: sqlite3.Connection) -> Dict[str, Any]:
+        # type, not null and default per column, unique and columns per index, the order of the columns aside
+        result = {}
+        for entity in SCHEMA:
+            for row in con.execute(f'PRAGMA table_info({entity.name})'):
+                result[f"{entity.name}.{row['NAME']}"] = (row['TYPE'].upper(), row['NOTNULL'], row['DFLT_VALUE'])
+            for index in con.execute(f'PRAGMA index_list({entity.name})'):
+                columns = [row['NAME'] for row in con.execute(f"PRAGMA index_info({index['NAME']})")]
+                result[index['NAME']] = (entity.name, index['UNIQUE'], columns)
+        return result
+
+    def test_new_data_base(self):
+        nt.assert_equal(version(self.dbh), 0)
+        nt.assert_equal(migrate(self.dbh), SCHEMA_VERSION)
+        nt.assert_equal(version(self.dbh), SCHEMA_VERSION)
+        nt.assert_equal(missing(self.dbh), [])
+        self.dbh.execute("INSERT INTO EVENTS (URL) VALUES ('orders')")
+        nt.assert_equal(self.dbh.execute('SELECT METHOD FROM EVENTS').fetchone()['METHOD'], 'POST')
+
+    def test_transaction_sql(self):
+        # the hand written schema has to follow the entities
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            self.dbh.executescript(prepare_db.read())
+        nt.assert_equal(version(self.dbh), SCHEMA_VERSION)
+        nt.assert_equal(missing(self.dbh), [])
+        for entity in SCHEMA:
+            nt.assert_equal(sorted(self.columns(entity.name)), sorted(['ID'] + [x.name for x in entity.columns]))
+        created = prepare_connection()
+        try:
+            migrate(created)
+            nt.assert_equal(self.definition(self.dbh), self.definition(created))
+        finally:
+            created.close()
+
+    def test_old_data_base_definition(self):
+        # an old data base ends up like a new one, defaults included
+        self.dbh.executescript(OLD_SCHEMA)
+        migrate(self.dbh)
+        created = prepare_connection()
+        try:
+            migrate(created)
+            nt.assert_equal(self.definition(self.dbh), self.definition(created))
+        finally:
+            created.close()
+
+    def test_old_data_base(self):
+        self.dbh.executescript(OLD_SCHEMA)
+        nt.assert_in('TASKS.IDEMPOTENCY_KEY', missing(self.dbh))
+        nt.assert_in('TASK_STATE', missing(self.dbh))
+        nt.assert_equal(migrate(self.dbh), SCHEMA_VERSION)
+        nt.assert_equal(missing(self.dbh), [])
+        nt.assert_in('BATCH_SIZE', self.columns('PARTNERS'))
+        step = self.dbh.execute('SELECT * FROM PROCESSING_STEPS').fetchone()
+        nt.assert_equal(step['STATE'], 2)
+        nt.assert_equal(step['ATTEMPTS'], 0)
+        nt.assert_is_not_none(step['NEXT_ATTEMPT_AT'])  # else the step would never be due
+        nt.assert_equal(self.dbh.execute('SELECT DATA FROM TASKS').fetchone()['DATA'], '{}')
+
+    def test_idempotency_key(self):
+        # the upsert of store_unique needs the unique index
+        self.dbh.executescript(OLD_SCHEMA)
+        migrate(self.dbh)
+        for __ in range(2):
+            self.dbh.execute("INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID, DATA, IDEMPOTENCY_KEY) "
+                             "VALUES (2, 1, 1, '{}', 'k1') ON CONFLICT(IDEMPOTENCY_KEY) DO NOTHING")
+        count = self.dbh.execute("SELECT COUNT(*) N FROM TASKS WHERE IDEMPOTENCY_KEY = 'k1'").fetchone()['N']
+        nt.assert_equal(count, 1)
+
+    def test_retries(self):
+        # the table is created again, its rows stay as they are, even one of a partner which is gone
+        self.dbh.executescript(OLD_SCHEMA)
+        self.dbh.execute('INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID, STATE) VALUES (1, 9, 4)')
+        self.dbh.commit()
+        migrate(self.dbh)
+        nt.assert_equal(self.dbh.execute('PRAGMA foreign_keys').fetchone()['FOREIGN_KEYS'], 1)
+        self.dbh.execute('INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID) VALUES (1, 1)')
+        steps = self.dbh.execute('SELECT * FROM PROCESSING_STEPS ORDER BY ID').fetchall()
+        nt.assert_equal([x['STATE'] for x in steps], [2, 4, 1])
+        for step in steps:  # else the step would never be due
+            nt.assert_is_not_none(step['NEXT_ATTEMPT_AT'])
+            nt.assert_equal(step['ATTEMPTS'], 0)
+        plan = ' '.join(row['DETAIL'] for row in self.dbh.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM PROCESSING_STEPS WHERE STATE = 1 AND NEXT_ATTEMPT_AT <= 0'))
+        nt.assert_in('INDEX PROCESS_DUE', plan)
+
+    def test_partners(self):
+        self.dbh.executescript(OLD_SCHEMA)
+        migrate(self.dbh)
+        partners = [Partner(**x) for x in self.dbh.execute(Partner.select_statement(), [0])]
+        nt.assert_equal([(x.port, x.format, x.batch_size) for x in partners], [(3011, 'json', 0)])
+
+    def test_steps(self):
+        # every change of the schema has its own step, the completion at the end must find nothing to do
+        self.dbh.executescript(OLD_SCHEMA)
+        for __, __, function in MIGRATIONS:
+            function(self.dbh)
+        self.dbh.commit()
+        nt.assert_equal(missing(self.dbh), [])
+
+    def test_idempotent(self):
+        self.dbh.executescript(OLD_SCHEMA)
+        migrate(self.dbh)
+        schema = self.dbh.execute('SELECT TYPE, NAME, SQL FROM sqlite_master ORDER BY NAME').fetchall()
+        nt.assert_equal(migrate(self.dbh), SCHEMA_VERSION)
+        nt.assert_equal(self.dbh.execute('SELECT TYPE, NAME, SQL FROM sqlite_master ORDER BY NAME').fetchall(), schema)
+
+    def test_dropped_index(self):
+        migrate(self.dbh)
+        self.dbh.execute('DROP INDEX TASK_STATE')
+        nt.assert_equal(missing(self.dbh), ['TASK_STATE'])
+        migrate(self.dbh)
+        nt.assert_equal(missing(self.dbh), [])
+
+    def test_newer_data_base(self):
+        self.dbh.execute(f'PRAGMA user_version = {SCHEMA_VERSION + 1}')
+        with nt.assert_raises(sqlite3.DatabaseError):
+            migrate(self.dbh)
+
+    def test_query_plan(self):
+        migrate(self.dbh)
+        for sql, index in (('SELECT * FROM TASKS WHERE STATE = 1', 'TASK_STATE'),
+                           ("SELECT * FROM PARTNERS WHERE IP_ADDRESS = '127.0.0.1' AND PORT = 3011 AND DELETED = 0",
+                            'PARTNER_ADDRESS')):
+            plan = ' '.join(row['DETAIL'] for row in self.dbh.execute(f'EXPLAIN QUERY PLAN {sql}'))
+            nt.assert_in(f'INDEX {index}', plan)
+
+    @run_in_loop
+    async def test_upgrade(self):
+        nt.assert_equal(await upgrade(self.dbh), SCHEMA_VERSION)
+        await self.dbh.registry.refresh()
@@ -6,7 +6,7 @@ import asyncio
 from multidict import CIMultiDict
 import logging
 
-from aiohttp.test_utils import unittest_run_loop
+from loop_runner import run_in_loop
 
 from asynctransaction.data.access.base import prepare_connection
 from asynctransaction.data.entity.partner import Partner
@@ -34,6 +34,7 @@ class TestPartner:
 
     def teardown(self):
         self.dbh.close()
+        self.loop.close()
 
     def test_ctor1(self):
         test = Partner(netloc='145.123.45.2')
@@ -73,15 +74,16 @@ class TestPartner:
     def test_to_dict(self):
         test = Partner(**self.record)
         nt.assert_dict_contains_subset(self.record, test.to_dict())
+        nt.assert_equal(test.to_dict()['FORMAT'], 'json')
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_get_partner_data(self):
         pa = PartnerAccess(con=self.dbh)
         partner = await pa.get_partner_data(IP_ADDRESS='127.0.0.1', PORT=3030)
         nt.assert_is_instance(partner, Partner)
         nt.assert_equal(partner.id, 1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_change_partner_data(self):
         pa = PartnerAccess(con=self.dbh)
         self.record['ID'] = 2
@@ -90,9 +92,12 @@ class TestPartner:
         nt.assert_equal(str(partner.ip_address), self.record['IP_ADDRESS'])
         nt.assert_equal(partner.id, 2)
         partner.id = 0
+        partner.format, partner.batch_size = 'msgpack', 20
         partner = await pa.change_partner_data(**partner.to_dict())
         nt.assert_is_instance(partner, Partner)
         nt.assert_equal(partner.id, 3)
+        await pa.read(entity_id=3)
+        nt.assert_equal((pa.get_result().format, pa.get_result().batch_size), ('msgpack', 20))
 
     def test_ctor_multi_dict(self):
         multi_dict = CIMultiDict(self.record)
@@ -0,0 +1,72 @@
+import nose.tools as nt
+import asyncio
+import sqlite3
+
+from loop_runner import run_in_loop
+
+from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.access.partner import Partner as PartnerAccess
+from asynctransaction.data.access.processing_step import ProcessingStep as ProcessingAccess
+
+
+class TestRegistry:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        with open('asynctransaction/data/model/test_data.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    @run_in_loop
+    async def test_lookups(self):
+        registry = self.dbh.registry
+        nt.assert_equal((await registry.get_event('orders', 'PUT')).id, 2)
+        nt.assert_is_none(await registry.get_event('orders', 'GET'))
+        nt.assert_equal((await registry.get_event_by_id(3)).url, 'articles')
+        nt.assert_equal([x.id for x in await registry.get_partners(3)], [2])
+        nt.assert_equal(await registry.get_partners(99), [])
+        nt.assert_equal(await registry.get_netloc(1), '127.0.0.1:3030')
+        nt.assert_false(await registry.refresh())
+
+    @run_in_loop
+    async def test_invalidate_on_write(self):
+        registry = self.dbh.registry
+        nt.assert_equal(await registry.get_netloc(2), '127.0.0.1:3000')
+        version = registry.version
+        await PartnerAccess(self.dbh).change_partner_data(ID=2, IP_ADDRESS='127.0.0.2', PORT=3001)
+        nt.assert_greater(registry.version, version)
+        nt.assert_equal(await registry.get_netloc(2), '127.0.0.2:3001')
+
+    @run_in_loop
+    async def test_complete_processing_steps(self):
+        self.dbh.execute("INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID) VALUES (17, 2, 4)")
+        self.dbh.execute("INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID) VALUES (2, 2)")
+        dac = ProcessingAccess(self.dbh)
+        await dac.read_processing_steps(state=1)
+        steps = {x.task_id: x for x in dac.get_data()}
+        nt.assert_equal((steps[1].method, steps[1].url, steps[1].port), ('POST', 'orders', 3030))
+        nt.assert_equal((steps[2].method, steps[2].url, steps[2].port), ('PUT', 'articles', 3000))
+        nt.assert_equal(steps[2].local_id, 17)
+
+    @run_in_loop
+    async def test_iter_processing_steps(self):
+        self.dbh.execute("INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID) VALUES (17, 2, 4)")
+        self.dbh.executemany("INSERT INTO PROCESSING_STEPS (TASK_ID, PARTNER_ID) VALUES (2, 2)", [()] * 4)
+        dac = ProcessingAccess(self.dbh)
+        batches = [batch async for batch in dac.iter_by_state(state=1, batch_size=2)]
+        nt.assert_equal([len(x) for x in batches], [2, 2, 1])
+        ids = [x.id for batch in batches for x in batch]
+        nt.assert_equal(ids, sorted(ids))
+        nt.assert_equal((batches[-1][0].url, batches[-1][0].port), ('articles', 3000))
+        nt.assert_equal(dac.get_data(), [])
@@ -0,0 +1,85 @@
+import nose.tools as nt
+import asyncio
+import sqlite3
+
+from loop_runner import run_in_loop
+
+from asynctransaction.data.access.base import prepare_connection
+from asynctransaction.data.access.state_buffer import StateBuffer
+from asynctransaction.data.entity import *
+
+
+class TestStateBuffer:
+    def __init__(self):
+        self.dbh: sqlite3.Connection = None
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+    def setup(self):
+        self.dbh = prepare_connection()
+        cursor: sqlite3.Cursor = self.dbh.cursor()
+        with open('asynctransaction/data/model/transaction.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+        with open('asynctransaction/data/model/test_data.sql') as prepare_db:
+            prepare_sql = prepare_db.read()
+            cursor.executescript(str(prepare_sql))
+
+    def teardown(self):
+        self.dbh.close()
+        self.loop.close()
+
+    def states(self) -> List[int]:
+        return [row['STATE'] for row in self.dbh.execute('SELECT STATE FROM PROCESSING_STEPS ORDER BY ID')]
+
+    @run_in_loop
+    async def test_flush(self):
+        buffer = StateBuffer(self.dbh.executor, max_delay=10)
+        buffer.set_state(1, State.InProgress.code)
+        buffer.set_state(2, State.Error.code)
+        buffer.set_state(1, State.Processed.code)  # last one wins
+        nt.assert_equal(self.states(), [1, 2, 2])
+        nt.assert_equal(await buffer.flush(), 2)
+        nt.assert_equal(self.states(), [4, 5, 2])
+        nt.assert_equal(buffer.stats(), {'pending': 0, 'flushes': 1, 'flushed': 2})
+        nt.assert_equal(await buffer.flush(), 0)
+        await buffer.close()
+
+    @run_in_loop
+    async def test_flush_with_columns(self):
+        buffer = StateBuffer(self.dbh.executor, max_delay=10)
+        buffer.set_state(1, State.InProgress.code, ATTEMPTS=3)
+        buffer.set_state(2, State.InProgress.code)
+        nt.assert_equal(await buffer.flush(), 2)
+        nt.assert_equal([row['ATTEMPTS'] for row in self.dbh.execute('SELECT ATTEMPTS FROM PROCESSING_STEPS')],
+                        [3, 0, 0])
+        nt.assert_equal(self.states(), [2, 2, 2])
+        await buffer.close()
+
+    @run_in_loop
+    async def test_flush_after_delay(self):
+        buffer = StateBuffer(self.dbh.executor, max_delay=0.01)
+        buffer.set_state(3, State.Processed.code)
+        await asyncio.sleep(0.05)
+        nt.assert_equal(self.states(), [1, 2, 4])
+        nt.assert_equal(buffer.pending, 0)
+        await buffer.close()
+
+    @run_in_loop
+    async def test_flush_when_full(self):
+        buffer = StateBuffer(self.dbh.executor, max_items=3, max_delay=10)
+        for step_id in (1, 2, 3):
+            buffer.set_state(step_id, State.Processed.code)
+        await asyncio.sleep(0.01)
+        nt.assert_equal(self.states(), [4, 4, 4])
+        nt.assert_equal(buffer.flushes, 1)
+        await buffer.close()
+
+    @run_in_loop
+    async def test_keep_states_on_error(self):
+        buffer = StateBuffer(self.dbh.executor, max_delay=10)
+        buffer.set_state(1, State.Processed.code)
+        self.dbh.execute('DROP TABLE PROCESSING_STEPS')
+        with nt.assert_raises(sqlite3.Error):
+            await buffer.flush()
+        nt.assert_equal(buffer.pending, 1)
+        buffer._flusher.cancel()
@@ -5,10 +5,11 @@ import json
 import asyncio
 import sqlite3
 
-from aiohttp.test_utils import unittest_run_loop
+from loop_runner import run_in_loop
 
 from asynctransaction.data.access.base import prepare_connection
 from asynctransaction.data.entity.task import Task
+from asynctransaction.data.entity.state import State
 from asynctransaction.data.access.task import Task as TaskAccess
 
 
@@ -33,7 +34,7 @@ class TestTask:
             cursor.executescript(str(prepare_sql))
 
     def teardown(self):
-        pass
+        self.loop.close()
 
     def test_ctor(self):
         task = Task()
@@ -48,6 +49,14 @@ class TestTask:
         nt.assert_equal(task.id, self.record['ID'])
         nt.assert_equal(task.local_id, self.data['ID'])
 
+    def test_row_without_metadata(self):
+        task = Task(**self.record)
+        nt.assert_false(hasattr(task, '__dict__'))
+        nt.assert_is(task.columns, Task.columns)
+        nt.assert_is_none(task._updated_on)
+        nt.assert_less_equal(task.updated_on, datetime.now())
+        nt.assert_is(task.updated_on, task.updated_on)
+
     def test_create_table(self):
         expected = """CREATE TABLE TASKS (
     ID INTEGER PRIMARY KEY,
@@ -55,6 +64,7 @@ class TestTask:
     PARTNER_ID INTEGER ,
     EVENT_ID INTEGER ,
     DATA TEXT ,
+    IDEMPOTENCY_KEY TEXT ,
     STATE INTEGER DEFAULT(1),
     UPDATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
     CREATED_ON TIMESTAMP DEFAULT(datetime('now','localtime')),
@@ -63,7 +73,47 @@ class TestTask:
     CONSTRAINT FK_TASKS_EVENT_ID foreign key(EVENT_ID) REFERENCES EVENTS(ID));"""
         nt.assert_multi_line_equal(Task().create_table_statement(), expected)
 
-    @unittest_run_loop
+    @run_in_loop
+    async def test_store_unique(self):
+        ta = TaskAccess(self.dbh)
+        tasks = [Task(LOCAL_ID=238, PARTNER_ID=1, EVENT_ID=1, DATA='{}'),
+                 Task(LOCAL_ID=239, PARTNER_ID=1, EVENT_ID=1, DATA='{}', IDEMPOTENCY_KEY='k'),
+                 Task(LOCAL_ID=240, PARTNER_ID=1, EVENT_ID=1, DATA='{}', IDEMPOTENCY_KEY='k'),
+                 Task(LOCAL_ID=241, PARTNER_ID=9, EVENT_ID=1, DATA='{}'),
+                 Task(LOCAL_ID=239, PARTNER_ID=1, EVENT_ID=1, DATA='{}')]
+        states = await ta.store_unique(tasks)
+        nt.assert_equal(states, [State.ConflictRequest, State.RequestStored, State.RequestReplayed,
+                                 State.BadRequestDBError, State.ConflictRequest])
+        nt.assert_equal((tasks[2].id, tasks[2].local_id), (tasks[1].id, 239))
+        plan = ' '.join(str(row) for row in self.dbh.execute(
+            'EXPLAIN QUERY PLAN SELECT ID FROM TASKS WHERE EVENT_ID = 1 AND PARTNER_ID = 1 AND LOCAL_ID = 1'))
+        nt.assert_in('TASK_LOCAL_KEY', plan)
+
+    @run_in_loop
+    async def test_iter_by_state(self):
+        self.dbh.executemany("INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID) VALUES (?, 2, 4)",
+                             [(x,) for x in range(1, 6)])
+        ta = TaskAccess(self.dbh)
+        batches = [batch async for batch in ta.iter_by_state(state=1, batch_size=3)]
+        nt.assert_equal([len(x) for x in batches], [3, 3])
+        nt.assert_equal([x.local_id for x in batches[1]], [3, 4, 5])
+        nt.assert_equal([batch async for batch in ta.iter_by_state(state=4)], [])
+        with nt.assert_raises(ValueError):
+            [batch async for batch in ta.iter_by_state(state=1, batch_size=0)]
+
+    def test_statements_per_class(self):
+        insert = Task(**self.record).create_insert_statement()
+        nt.assert_equal(insert, 'INSERT INTO TASKS (LOCAL_ID, PARTNER_ID, EVENT_ID, DATA, IDEMPOTENCY_KEY) VALUES '
+                                '(:LOCAL_ID, :PARTNER_ID, :EVENT_ID, :DATA, :IDEMPOTENCY_KEY);')
+        nt.assert_is(Task().create_insert_statement(), insert)
+        nt.assert_is(Task.select_statement(read_all=False, by_state=True),
+                     Task().create_select_statement(read_all=False, by_state=True))
+        nt.assert_is(Task().create_update_statement(ID=1, STATE=2),
+                     Task().create_update_statement(STATE=3, ID=4))
+        nt.assert_not_equal(Task().create_update_statement(ID=1, STATE=2),
+                            Task().create_update_statement(ID=1, DATA=''))
+
+    @run_in_loop
     async def test_task_access_really_new(self):
         ta = TaskAccess(self.dbh)
         task = Task(**self.record)
@@ -73,7 +123,7 @@ class TestTask:
         await future
         nt.assert_equals(future.result(), 0)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_task_access_duplicate(self):
         ta = TaskAccess(self.dbh)
         task = Task(**{'LOCAL_ID': 238, 'PARTNER_ID': 1, 'EVENT_ID': 1})
@@ -83,7 +133,7 @@ class TestTask:
         await future
         nt.assert_equals(future.result(), 100)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_task_access_put_processed(self):
         ta = TaskAccess(self.dbh)
         task = Task(**{'LOCAL_ID': 237, 'PARTNER_ID': 1, 'EVENT_ID': 2})
@@ -94,7 +144,7 @@ class TestTask:
         await future
         nt.assert_equals(future.result(), 0)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_task_access_put_with_error(self):
         ta = TaskAccess(self.dbh)
         task = Task(**{'LOCAL_ID': 237, 'PARTNER_ID': 1, 'EVENT_ID': 2})
@@ -105,7 +155,7 @@ class TestTask:
         await future
         nt.assert_equals(future.result(), 1)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_task_access_put_high_probability(self):
         ta = TaskAccess(self.dbh)
         task = Task(**{'LOCAL_ID': 237, 'PARTNER_ID': 1, 'EVENT_ID': 2})
@@ -117,7 +167,7 @@ class TestTask:
         await future
         nt.assert_equals(future.result(), 3)
 
-    @unittest_run_loop
+    @run_in_loop
     async def test_task_access_old_put(self):
         ta = TaskAccess(self.dbh)
         task = Task(**{'LOCAL_ID': 237, 'PARTNER_ID': 1, 'EVENT_ID': 2})
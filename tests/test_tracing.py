@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+import nose.tools as nt
+
+from asynctransaction.tracing import Tracer, NO_SPAN
+
+
+class TestTracing:
+    def __init__(self):
+        self.tracer: Tracer = None
+        self.file_name = os.path.join(tempfile.gettempdir(), 'test_tracing.jsonl')
+
+    def setup(self):
+        self.tracer = Tracer(capacity=3)
+
+    def teardown(self):
+        self.tracer.close()
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    def test_start(self):
+        nt.assert_is_none(self.tracer.start())
+        nt.assert_equal(self.tracer.start('4bf92f3577b34da6'), '4bf92f3577b34da6')
+        nt.assert_is_none(self.tracer.start('no spaces'))
+        nt.assert_equal(len(Tracer(sample_rate=1.0).start()), 16)
+        nt.assert_is_none(Tracer(sample_rate=1.0, capacity=0).start('4bf92f3577b34da6'))
+        with nt.assert_raises(ValueError):
+            Tracer(sample_rate=2.0)
+
+    def test_span(self):
+        nt.assert_is(self.tracer.span(None, 'store'), NO_SPAN)
+        with self.tracer.span(None, 'store') as span:
+            span.set(STATE='RequestStored')
+        nt.assert_equal(self.tracer.spans(), [])
+        with self.tracer.span('t1', 'store', ITEMS=2) as span:
+            span.set(STATE='RequestStored')
+        with nt.assert_raises(KeyError):
+            with self.tracer.span('t1', 'receive.read'):
+                raise KeyError('x')
+        spans = self.tracer.spans()
+        nt.assert_equal([(x['NAME'], x['TRACE_ID']) for x in spans], [('store', 't1'), ('receive.read', 't1')])
+        nt.assert_equal((spans[0]['ITEMS'], spans[0]['STATE']), (2, 'RequestStored'))
+        nt.assert_equal(spans[1]['ERROR'], 'KeyError')
+
+    def test_ring_buffer_and_query(self):
+        for name in ('receive.read', 'receive.decode', 'store', 'process'):
+            self.tracer.record('t1', name, 0.0, 0.002)
+        self.tracer.record('t2', 'store', 0.0, 0.010)
+        nt.assert_equal([x['NAME'] for x in self.tracer.spans()], ['store', 'process', 'store'])
+        nt.assert_equal([x['NAME'] for x in self.tracer.spans(trace_id='t1')], ['store', 'process'])
+        nt.assert_equal([x['TRACE_ID'] for x in self.tracer.spans(name='store')], ['t1', 't2'])
+        nt.assert_equal([x['TRACE_ID'] for x in self.tracer.spans(min_ms=5)], ['t2'])
+        nt.assert_equal([x['NAME'] for x in self.tracer.spans(limit=1)], ['store'])
+        self.tracer.record('t3', 'receive.read', 0.0, 0.001)
+        nt.assert_equal(len(self.tracer.spans(name='receive.')), 1)
+
+    def test_follow(self):
+        for task_id in range(1, 5):
+            self.tracer.follow(task_id, f't{task_id}')
+        self.tracer.follow(5, None)
+        nt.assert_is_none(self.tracer.trace_of(1))
+        nt.assert_equal(self.tracer.trace_of(4), 't4')
+        nt.assert_is_none(self.tracer.trace_of(5))
+        nt.assert_equal(self.tracer.stats()['followed_tasks'], 3)
+
+    def test_export(self):
+        self.tracer = Tracer(capacity=10, export_file=self.file_name)
+        with self.tracer.span('t1', 'spread', TASKS=4):
+            pass
+        self.tracer.close()
+        with open(self.file_name) as export:
+            lines = [json.loads(x) for x in export]
+        nt.assert_equal([(x['TRACE_ID'], x['NAME'], x['TASKS']) for x in lines], [('t1', 'spread', 4)])